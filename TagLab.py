@@ -75,6 +75,7 @@ from source.QtTableLabel import QtTableLabel
 from source.QtProjectWidget import QtProjectWidget
 from source.QtProjectEditor import QtProjectEditor
 from source.Project import Project, loadProject
+from source.Autosave import Autosave
 from source.Image import Image
 from source.Annotation import Annotation
 from source.MapClassifier import MapClassifier
@@ -88,7 +89,7 @@ from source.DecayAnnotation import DecayAnnotation
 from source.QtColorAnnotationSettingsWidget import QtColorAnnotationSettingsWidget
 
 from source import utils
-from source.Blob import Blob
+from source.Blob import Blob, mask_cache
 from source.Shape import Layer, Shape
 
 # training modules
@@ -124,6 +125,9 @@ class MainWindow(QMainWindow):
                 event.ignore()
                 return
 
+        # do not leave an autosave in progress
+        taglab.autosaver.wait()
+
         super(MainWindow, self).closeEvent(event)
 
 class TagLab(QMainWindow):
@@ -399,6 +403,11 @@ class TagLab(QMainWindow):
         self.labelMouseLeftInfo.setMinimumWidth(70)
         self.labelMouseTopInfo.setMinimumWidth(70)
 
+        # autosave indicator
+        self.labelAutosave = QLabel("Autosaving..")
+        self.labelAutosave.setStyleSheet("color: rgb(255,200,0)")
+        self.labelAutosave.hide()
+
 
         layout_header = QHBoxLayout()
         layout_header.addWidget(QLabel("Map:  "))
@@ -413,6 +422,7 @@ class TagLab(QMainWindow):
         layout_header.addWidget(self.checkBoxIds)
         layout_header.addWidget(self.checkBoxGrid)
         layout_header.addStretch()
+        layout_header.addWidget(self.labelAutosave)
         layout_header.addWidget(self.labelZoom)
         layout_header.addWidget(self.labelZoomInfo)
         layout_header.addWidget(self.labelMouseLeft)
@@ -627,6 +637,13 @@ class TagLab(QMainWindow):
         # autosave timer
         self.timer = QTimer(self)
 
+        # the autosave is written by a worker thread
+        self.autosaver = Autosave(self)
+        self.autosaver.started[str].connect(self.autosaveStarted)
+        self.autosaver.skipped[str].connect(self.autosaveSkipped)
+        self.autosaver.finished[str, float].connect(self.autosaveFinished)
+        self.autosaver.failed[str].connect(self.autosaveFailed)
+
         self.updateToolStatus()
 
         self.split_screen_flag = False
@@ -800,7 +817,28 @@ class TagLab(QMainWindow):
     @pyqtSlot()
     def autosave(self):
         filename, file_extension = os.path.splitext(self.project.filename)
-        self.project.save(filename + "_autosave.json")
+        # the autosave keeps the format of the project
+        if file_extension.lower() != ".tlp":
+            file_extension = ".json"
+        self.autosaver.save(self.project, filename + "_autosave" + file_extension)
+
+    @pyqtSlot(str)
+    def autosaveStarted(self, filename):
+        self.labelAutosave.show()
+
+    @pyqtSlot(str)
+    def autosaveSkipped(self, filename):
+        logfile.info("[PROJECT] Autosave of " + filename + " skipped, the previous autosave is still running.")
+
+    @pyqtSlot(str, float)
+    def autosaveFinished(self, filename, elapsed):
+        self.labelAutosave.hide()
+        logfile.info("[PROJECT] Autosaved in " + filename + " (snapshot taken in {:.3f} s).".format(elapsed))
+
+    @pyqtSlot(str)
+    def autosaveFailed(self, message):
+        self.labelAutosave.hide()
+        logfile.info("[PROJECT] Autosave failed: " + message)
 
     # call by pressing right button
     def openContextMenu(self, position):
@@ -1308,12 +1346,12 @@ class TagLab(QMainWindow):
         img_target_index = self.comboboxTargetImage.currentIndex()
         source_img = self.project.images[img_source_index]
         target_img = self.project.images[img_target_index]
+        source_annotations = self.viewerplus.annotations
+        target_annotaions = self.viewerplus2.annotations
 
         updated_corresp = self.project.updateGenets(source_img, source_annotations, target_img, target_annotaions)
 
         if self.compare_panel.correspondences is None:
-            source_annotations = self.viewerplus.annotations
-            target_annotaions = self.viewerplus2.annotations
             self.compare_panel.setTable(self.project, source_img, source_annotations, target_img, target_annotaions)
         else:
             self.compare_panel.updateTable(updated_corresp)
@@ -1325,7 +1363,6 @@ class TagLab(QMainWindow):
         if not filename:
             return
 
-        self.project.genet.updateGenets()
         self.project.genet.exportSVG(filename)
 
         msgBox = QMessageBox(self)
@@ -1340,7 +1377,6 @@ class TagLab(QMainWindow):
         if not filename:
             return
 
-        self.project.genet.updateGenets()
         self.project.genet.exportCSV(filename)
 
         msgBox = QMessageBox(self)
@@ -2351,6 +2387,7 @@ class TagLab(QMainWindow):
         self.network_name = None
         self.dataset_train_info = None
         self.project = Project()
+        mask_cache.clear()
         #self.project.loadDictionary(self.default_dictionary)
         self.last_image_loaded = None
         self.last_annotation_loaded = None
@@ -3654,7 +3691,7 @@ class TagLab(QMainWindow):
     @pyqtSlot()
     def openProject(self):
 
-        filters = "ANNOTATION PROJECT (*.json)"
+        filters = "ANNOTATION PROJECT (*.json *.tlp)"
         filename, _ = QFileDialog.getOpenFileName(self, "Open a project", self.taglab_dir, filters)
 
         if filename:
@@ -3679,12 +3716,12 @@ class TagLab(QMainWindow):
     @pyqtSlot()
     def saveAsProject(self):
 
-        filters = "ANNOTATION PROJECT (*.json)"
-        filename, _ = QFileDialog.getSaveFileName(self, "Save project", self.taglab_dir, filters)
+        filters = "ANNOTATION PROJECT (*.json) ;; BINARY ANNOTATION PROJECT (*.tlp)"
+        filename, filter = QFileDialog.getSaveFileName(self, "Save project", self.taglab_dir, filters)
 
         if filename:
-            if not filename.endswith('.json'):
-                filename += '.json'
+            if not filename.endswith('.json') and not filename.endswith('.tlp'):
+                filename += '.tlp' if filter.startswith("BINARY") else '.json'
             dir = QDir(self.taglab_dir)
             self.project.filename = dir.relativeFilePath(filename)
             self.setProjectTitle(self.project.filename)
@@ -3696,7 +3733,7 @@ class TagLab(QMainWindow):
         Opens a previously saved project and append the annotated images to the current ones.
         """
 
-        filters = "ANNOTATION PROJECT (*.json)"
+        filters = "ANNOTATION PROJECT (*.json *.tlp)"
         filename, _ = QFileDialog.getOpenFileName(self, "Open a project", self.taglab_dir, filters)
         if filename:
             self.disableSplitScreen(True)
@@ -3918,10 +3955,9 @@ class TagLab(QMainWindow):
 
 
         QApplication.setOverrideCursor(Qt.WaitCursor)
-        created_blobs = self.activeviewer.annotations.import_label_mapNoScores(filename, self.activeviewer.annotations.labels, offset=[0,0],
-                                                                       scale=[1.0, 1.0], progress=self.progress_bar)
-        for blob in created_blobs:
-            self.activeviewer.addBlob(blob, selected=False)
+        created_blobs = self.activeviewer.annotations.import_label_map_tiled(filename, self.activeviewer.annotations.labels, offset=[0,0],
+                                                                             scale=[1.0, 1.0], progress=self.progress_bar)
+        self.activeviewer.addBlobs(created_blobs)
         self.activeviewer.saveUndo()
 
         self.deleteProgressBar()
@@ -3985,9 +4021,8 @@ class TagLab(QMainWindow):
             self.groupbox_blobpanel.updateRegionAttributes(self.project.region_attributes)
 
             for i in range(0, len(blob_list)):
-                blob = blob_list[i]
-                blob.class_name = classes_list[i]
-                self.activeviewer.addBlob(blob, selected=False)
+                blob_list[i].class_name = classes_list[i]
+            self.activeviewer.addBlobs(blob_list)
             self.activeviewer.saveUndo()
 
         elif shapetype == 'Sampling':
@@ -4158,11 +4193,13 @@ class TagLab(QMainWindow):
 
         if output_filename:
             size = QSize(self.activeviewer.image.width, self.activeviewer.image.height)
-            label_map_img = self.activeviewer.annotations.create_label_map(size, self.activeviewer.annotations.labels, None)
-            label_map_np = utils.qimageToNumpyArray(label_map_img)
+            annotations = self.activeviewer.annotations
+            working_area = self.project.working_area
+            (palette, window) = annotations.labelMapWindow(size, annotations.labels, working_area)
+            tiles = annotations.labelMapTiles(size, annotations.labels, working_area)
             georef_filename = self.activeviewer.image.georef_filename
             outfilename = os.path.splitext(output_filename)[0]
-            rasterops.saveGeorefLabelMap(label_map_np, georef_filename, self.project.working_area, outfilename)
+            rasterops.saveGeorefLabelTiles(tiles, palette, georef_filename, window, outfilename)
 
             msgBox = QMessageBox(self)
             msgBox.setWindowTitle(self.TAGLAB_VERSION)
@@ -4269,7 +4306,8 @@ class TagLab(QMainWindow):
 
             basename = self.newDatasetWidget.getDatasetFolder()
             tilename = os.path.splitext(self.activeviewer.image.name)[0]
-            new_dataset.export_tiles(basename=basename, tilename=tilename)
+            resume = self.newDatasetWidget.checkResume.isChecked()
+            new_dataset.export_tiles(basename=basename, tilename=tilename, progress_bar=self.progress_bar, resume=resume)
 
             # save the target pixel size
             target_pixel_size_file = os.path.join(basename, "target-pixel-size.txt")
@@ -4669,6 +4707,8 @@ class TagLab(QMainWindow):
             checkColor = self.classifierWidget.chkAutocolor.isChecked()
             checkLevel = self.classifierWidget.chkAutolevel.isChecked()
             pred_thresh = self.classifierWidget.sliderScores.value() / 100.0
+            aggregation = self.classifierWidget.aggregation()
+            batch_size = self.classifierWidget.batchSize()
 
             for class_name in classifier_selected['Classes']:
                 mylabel = self.activeviewer.annotations.labels.get(class_name)
@@ -4702,7 +4742,9 @@ class TagLab(QMainWindow):
             QApplication.processEvents()
 
             self.classifier.run(1026, 513, 256, prediction_threshold=pred_thresh,
-                                save_scores=True,autocolor = checkColor, autolevel = checkLevel)
+                                save_scores=True,autocolor = checkColor, autolevel = checkLevel,
+                                aggregation=aggregation, batch_size=batch_size)
+            logfile.info("[AUTOCLASS] Preview timings (s): " + self.classifier.timingsReport())
             self.classifier.loadScores()
             self.showScores()
 
@@ -4745,6 +4787,8 @@ class TagLab(QMainWindow):
             checkcolor = self.classifierWidget.chkAutocolor.isChecked()
             checklevel = self.classifierWidget.chkAutolevel.isChecked()
             pred_thresh = self.classifierWidget.sliderScores.value() / 100.0
+            aggregation = self.classifierWidget.aggregation()
+            batch_size = self.classifierWidget.batchSize()
 
             for class_name in classifier_selected['Classes']:
                 mylabel = self.activeviewer.annotations.labels.get(class_name)
@@ -4797,7 +4841,9 @@ class TagLab(QMainWindow):
 
                 # runs the classifier
                 self.classifier.run(1026, 513, 256, prediction_threshold=pred_thresh,
-                    save_scores=True, autocolor=checkcolor,  autolevel=checklevel)
+                    save_scores=True, autocolor=checkcolor,  autolevel=checklevel, aggregation=aggregation,
+                    batch_size=batch_size)
+                logfile.info("[AUTOCLASS] Classification timings (s): " + self.classifier.timingsReport())
 
                 if self.classifier.flagStopProcessing is False:
 
@@ -4806,16 +4852,14 @@ class TagLab(QMainWindow):
                     self.progress_bar.setMessage("Finalizing classification results ...")
                     QApplication.processEvents()
 
-                    filenameLabels = os.path.join("temp", "labelmap.png")
-                    filenameScores = os.path.join("temp", "assembled_scores.dat")
-
                     offset = self.classifier.offset
                     scale = [self.classifier.scale_factor, self.classifier.scale_factor]
-                    
-                    created_blobs = self.activeviewer.annotations.import_label_map(filenameLabels, filenameScores, self.activeviewer.annotations.labels,
-                                                                                   offset, scale, progress=self.progress_bar)
-                    for blob in created_blobs:
-                        self.viewerplus.addBlob(blob, selected=False)
+
+                    created_blobs = self.activeviewer.annotations.import_label_map_arrays(self.classifier.label_map,
+                                                                                          self.classifier.maxScores(),
+                                                                                          self.activeviewer.annotations.labels,
+                                                                                          offset, scale, progress=self.progress_bar)
+                    self.viewerplus.addBlobs(created_blobs)
 
                     logfile.info("[AUTOCLASS] Automatic classification ENDS.")
 
@@ -0,0 +1,96 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Benchmark of the backends used to extract the contours of the blobs from their masks.
+#
+# Usage: python benchmarks/contours.py [project.json] [repetitions]
+#
+# The masks are recorded from the blobs of the project (by default the multi-temporal comparison sample project),
+# each mask is converted back into contours with both backends, checking that the geometry is the same.
+
+import os
+import sys
+import json
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import source.Blob as BlobModule
+from source.Blob import Blob
+
+DEFAULT_PROJECT = os.path.join(os.path.dirname(__file__), "..", "sampleProjects", "multi-temporal_comparison_project.json")
+
+
+def recordMasks(filename):
+    """
+    It returns the list of (mask, bbox) of all the blobs of the project.
+    """
+    f = open(filename, "r")
+    data = json.load(f)
+    f.close()
+
+    masks = []
+    for image in data["images"]:
+        for blob_dict in image["annotations"]:
+            blob = Blob(None, 0, 0, 0)
+            blob.bbox = np.asarray(blob_dict["bbox"])
+            blob.contour = blob.toContour(blob_dict["contour"])
+            blob.inner_contours = [blob.toContour(c) for c in blob_dict["inner contours"]]
+            masks.append((blob.getMask(), blob.bbox))
+
+    return masks
+
+def extractContours(masks, backend):
+    """
+    It extracts the contours of all the masks with the given backend, it returns the blobs and the elapsed time.
+    """
+    BlobModule.CONTOUR_BACKEND = backend
+
+    blobs = []
+    start = time.perf_counter()
+    for mask, bbox in masks:
+        blob = Blob(None, 0, 0, 0)
+        blob.createContourFromMask(mask, bbox)
+        blobs.append(blob)
+    elapsed = time.perf_counter() - start
+
+    return blobs, elapsed
+
+def sameGeometry(blob1, blob2):
+
+    if not np.array_equal(blob1.contour, blob2.contour):
+        return False
+    if len(blob1.inner_contours) != len(blob2.inner_contours):
+        return False
+    for c1, c2 in zip(blob1.inner_contours, blob2.inner_contours):
+        if not np.array_equal(c1, c2):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+
+    filename = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PROJECT
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    masks = recordMasks(filename)
+    pixels = sum([mask.size for mask, bbox in masks])
+    print("Recorded {:d} masks ({:.1f} Mpixels) from {:s}".format(len(masks), pixels / 1e6, filename))
+
+    timings = {}
+    results = {}
+    for backend in ["skimage", "fast"]:
+        best = float("inf")
+        for i in range(repetitions):
+            blobs, elapsed = extractContours(masks, backend)
+            best = min(best, elapsed)
+        timings[backend] = best
+        results[backend] = blobs
+        print("{:8s}: {:.3f} s (best of {:d})".format(backend, best, repetitions))
+
+    different = sum([not sameGeometry(b1, b2) for b1, b2 in zip(results["skimage"], results["fast"])])
+    holes = sum([len(blob.inner_contours) for blob in results["fast"]])
+    print("Speed-up: {:.2f}x, holes: {:d}, blobs with a different geometry: {:d}".format(timings["skimage"] / timings["fast"], holes, different))
+
+    BlobModule.CONTOUR_BACKEND = "fast"
@@ -1,6 +1,7 @@
 from __future__ import print_function, division
 import sys
 import os
+import json
 import numpy as np
 from PIL import Image as PILimage
 import matplotlib.pyplot as plt
@@ -8,9 +9,13 @@ import torch
 from torch.utils.data import Dataset
 from torchvision import transforms
 import glob
+import cv2
 from albumentations import (CLAHE, HueSaturationValue, RGBShift, RandomBrightnessContrast, Compose)
 from source.Label import Label
 
+# folder, inside the labels folder, with the labels converted to class indices (see CoralsDataset.prepareDataset)
+INDEX_FOLDER = ".index"
+INDEX_VERSION = 1
 
 
 # ALBUMENTATIONS - USED JUST TO PERFORM THE COLOR AUGMENTATION
@@ -75,6 +80,12 @@ class CoralsDataset(Dataset):
         self.weights = None
         self.dataset_average = np.zeros(3, dtype=float)
 
+        # labels converted to indices of the palette of the colors of the labels (see prepareDataset)
+        self.palette = None
+        self.index_folder = None
+        self.index_histogram = None
+        self.index_average = None
+
 
     def augmentationSettings(self, range_T, range_R, range_scale, crop_size, augmentation_flip=True):
         """
@@ -150,6 +161,44 @@ class CoralsDataset(Dataset):
     def __len__(self):
         return len(self.images_names)
 
+    def geometricTransform(self, w, h):
+        """
+        It draws a random geometric transformation (flip, rotation and translation followed by the center crop)
+        of an image of size w x h. It returns the 2 x 3 affine matrix of the whole transformation and the size of
+        the transformed image.
+        """
+
+        M = np.eye(3)
+
+        if self.flagDataAugmentationFlip:
+            # horizontal random flip
+            if np.random.uniform() > 0.5:
+                M = np.array([[-1.0, 0.0, w - 1.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]) @ M
+
+            # vertical random flip
+            if np.random.uniform() > 0.5:
+                M = np.array([[1.0, 0.0, 0.0], [0.0, -1.0, h - 1.0], [0.0, 0.0, 1.0]]) @ M
+
+        # rotation around the center and translation
+        if self.flagDataAugmentationRT:
+            rot = np.random.randint(self.RANDOM_ROTATION_MINVALUE, self.RANDOM_ROTATION_MAXVALUE)
+            tx = np.random.randint(self.RANDOM_TRANSLATION_MINVALUE, self.RANDOM_TRANSLATION_MAXVALUE)
+            ty = np.random.randint(self.RANDOM_TRANSLATION_MINVALUE, self.RANDOM_TRANSLATION_MAXVALUE)
+            RT = np.eye(3)
+            RT[:2] = cv2.getRotationMatrix2D(((w - 1) / 2.0, (h - 1) / 2.0), -rot, 1.0)
+            RT[0, 2] += tx
+            RT[1, 2] += ty
+            M = RT @ M
+
+        # center crop (the same of computeAverage and computeWeights)
+        if self.flagDataAugmentationCrop:
+            ox = int((w - self.CROP_SIZE) / 2)
+            oy = int((h - self.CROP_SIZE) / 2)
+            M = np.array([[1.0, 0.0, -ox], [0.0, 1.0, -oy], [0.0, 0.0, 1.0]]) @ M
+            w = h = self.CROP_SIZE
+
+        return M[:2], (w, h)
+
     def __getitem__(self, idx):
 
         # sample name
@@ -157,95 +206,157 @@ class CoralsDataset(Dataset):
 
         img_filename = os.path.join(self.images_dir, self.images_names[idx])
         label_filename = os.path.join(self.labels_dir, self.images_names[idx])
-        img = PILimage.open(img_filename)
-        imglbl = PILimage.open(label_filename)
+        img = np.array(PILimage.open(img_filename))
+        if self.index_folder is None:
+            imglbl = np.array(PILimage.open(label_filename))
+        else:
+            imglbl = np.load(os.path.join(self.index_folder, sample_name + ".npy"))
 
         # APPLY DATA AUGMENTATION
         if self.flagDataAugmentation:
+
+            # APPLY GEOMETRIC TRANSFORMATION
+            # flip, rotation, translation and crop are applied at once, with the same matrix for the image and the labels
+            h, w = img.shape[:2]
+            M, size = self.geometricTransform(w, h)
+            img = cv2.warpAffine(img, M, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            imglbl = cv2.warpAffine(imglbl, M, size, flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
             # SET COLOR TRANSFORMATION
             if self.flagColorAugmentation is True:
-                img_np = np.array(img)
-                data = {"image": img_np}
+                data = {"image": img}
                 augmented = self.custom_color_aug(**data)
-                img_np = augmented["image"]
-                img = PILimage.fromarray(img_np)
+                img = augmented["image"]
 
+        # numpy array -> Pytorch tensor
+        img_tensor = transforms.functional.to_tensor(img)
+        # normalize directly the Pytorch tensor
+        img_tensor = self.normalizeInputImage(img_tensor)
 
+        # numpy array -> Pytorch tensor
+        imglbl_tensor = transforms.functional.to_tensor(self.labelColors(imglbl))
 
-            # APPLY GEOMETRIC TRANSFORMATION
+        # create labels: from the label image to Pytorch tensor
+        labels_tensor = self.imageLabelToLongTensor(imglbl)
 
-            # random flip
-            img_flipped = img
-            imglbl_flipped = imglbl
-
-            if self.flagDataAugmentationFlip:
-                # horizontal random flip
-                if np.random.uniform() > 0.5:
-                    img_flipped = img_flipped.transpose(PILimage.FLIP_LEFT_RIGHT)
-                    imglbl_flipped = imglbl_flipped.transpose(PILimage.FLIP_LEFT_RIGHT)
-
-                # vertical random flip
-                if np.random.uniform() > 0.5:
-                    img_flipped = img_flipped.transpose(PILimage.FLIP_TOP_BOTTOM)
-                    imglbl_flipped = imglbl_flipped.transpose(PILimage.FLIP_TOP_BOTTOM)
-
-
-            # rotation and translation
-
-            if self.flagDataAugmentationRT:
-                rot = np.random.randint(self.RANDOM_ROTATION_MINVALUE, self.RANDOM_ROTATION_MAXVALUE)
-                tx = np.random.randint(self.RANDOM_TRANSLATION_MINVALUE, self.RANDOM_TRANSLATION_MAXVALUE)
-                ty = np.random.randint(self.RANDOM_TRANSLATION_MINVALUE, self.RANDOM_TRANSLATION_MAXVALUE)
-                img_flipped_RT = transforms.functional.affine(img_flipped, angle=rot, scale=1.0, shear=0.0,
-                                                              translate=(tx, ty), resample=PILimage.BILINEAR)
-                imglbl_flipped_RT = transforms.functional.affine(imglbl_flipped, angle=rot, scale=1.0, shear=0.0,
-                                                                 translate=(tx, ty), resample=PILimage.NEAREST)
-            else:
-                img_flipped_RT = img_flipped
-                imglbl_flipped_RT = imglbl_flipped
-
-
-            # center crop
-            if self.flagDataAugmentationCrop:
-                w, h = img_flipped_RT.size
-                left = (w / 2) - (self.CROP_SIZE / 2)
-                top = (h / 2) - (self.CROP_SIZE / 2)
-                img_augmented = transforms.functional.crop(img_flipped_RT, top, left, self.CROP_SIZE, self.CROP_SIZE)
-                imglbl_augmented = transforms.functional.crop(imglbl_flipped_RT, top, left, self.CROP_SIZE,
-                                                              self.CROP_SIZE)
-            else:
-                img_augmented = img_flipped_RT
-                imglbl_augmented = imglbl_flipped_RT
-
-
-            # PIL image -> Pytorch tensor
-            img_tensor = transforms.functional.to_tensor(img_augmented)
-            # normalize directly the Pytorch tensor
-            img_tensor = self.normalizeInputImage(img_tensor)
-
-            # PIL image -> Pytorch tensor
-            imglbl_tensor = transforms.functional.to_tensor(imglbl_augmented)
-
-            # create labels: from PIL image to Pytorch tensor
-            labels_tensor = self.imageLabelToLongTensor(imglbl_augmented)
+        # image labels saves the label as image for check purposes
+        sample = {'image': img_tensor, 'image_label': imglbl_tensor, 'labels': labels_tensor, 'name': sample_name}
 
-        else:
+        return sample
+
+    def labelsPalette(self):
+        """
+        It returns the palette of the colors of the labels, as color codes (R + G * 256 + B * 65536). The index 0 is
+        black (the color of the background and of the pixels added by the geometric transformations), the index 1
+        is used for the colors not in the labels dictionary.
+        """
+        palette = [0, -1]
+        for key in self.labels_dictionary.keys():
+            color = self.labels_dictionary[key].fill
+            code = int(color[0]) + int(color[1]) * 256 + int(color[2]) * 65536
+            if code not in palette:
+                palette.append(code)
+        return palette
 
-            # PIL image -> Pytorch tensor
-            img_tensor = transforms.functional.to_tensor(img)
-            # normalize directly the Pytorch tensor
-            img_tensor = self.normalizeInputImage(img_tensor)
+    def indexSignature(self):
 
-            # PIL image -> Pytorch tensor
-            imglbl_tensor = transforms.functional.to_tensor(imglbl)
+        files = {}
+        for name in self.images_names:
+            for filename in [os.path.join(self.images_dir, name), os.path.join(self.labels_dir, name)]:
+                stat = os.stat(filename)
+                files[filename] = [stat.st_size, stat.st_mtime]
 
-            # create labels: from PIL image to Pytorch tensor
-            labels_tensor = self.imageLabelToLongTensor(imglbl)
+        return { "version": INDEX_VERSION, "palette": self.labelsPalette(), "crop_size": self.CROP_SIZE, "files": files }
 
-        # image labels saves the label as image for check purposes
-        sample = {'image': img_tensor, 'image_label': imglbl_tensor, 'labels': labels_tensor, 'name': sample_name}
+    def prepareDataset(self):
+        """
+        It converts the labels to single channel uint8 indices of the palette of the colors of the labels (see
+        labelsPalette), stored in the INDEX_FOLDER inside the labels folder. The histogram of the indices and the
+        average color of the images (on the center crop) are stored with them. The conversion is done only when
+        the dataset changes, after that the labels are read directly as indices and converted with a LUT.
+        """
 
-        return sample
+        palette = self.labelsPalette()
+        if len(palette) > 256:
+            print("Too many label colors, the labels are not converted to indices.")
+            return
+
+        folder = os.path.join(self.labels_dir, INDEX_FOLDER)
+        info_filename = os.path.join(folder, "index.json")
+        signature = self.indexSignature()
+
+        try:
+            with open(info_filename, "r") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            info = None
+
+        if info is None or info.get("signature") != signature:
+
+            os.makedirs(folder, exist_ok=True)
+
+            palette_index = { code: index for index, code in enumerate(palette) }
+            histogram = np.zeros(len(palette), dtype=np.int64)
+            color_sum = np.zeros(3, dtype=np.float64)
+            N = len(self.images_names)
+            print(" ")
+            for i, image_name in enumerate(self.images_names):
+
+                data = np.array(PILimage.open(os.path.join(self.labels_dir, image_name))).astype(np.int64)
+                color_codes = data[:, :, 0] + data[:, :, 1] * 256 + data[:, :, 2] * 65536
+
+                # the colors not in the palette are 1
+                unique_codes, inverse = np.unique(color_codes, return_inverse=True)
+                mapping = np.array([palette_index.get(code, 1) for code in unique_codes.tolist()], dtype=np.uint8)
+                indices = mapping[inverse].reshape(color_codes.shape)
+
+                np.save(os.path.join(folder, image_name + ".npy"), indices)
+
+                h, w = indices.shape
+                ox = int((w - self.CROP_SIZE) / 2)
+                oy = int((h - self.CROP_SIZE) / 2)
+                histogram += np.bincount(indices[oy:oy + self.CROP_SIZE, ox:ox + self.CROP_SIZE].ravel(), minlength=len(palette))
+
+                img = np.array(PILimage.open(os.path.join(self.images_dir, image_name)))
+                img_crop = img[oy:oy + self.CROP_SIZE, ox:ox + self.CROP_SIZE, :3]
+                color_sum += img_crop.reshape(-1, 3).sum(axis=0, dtype=np.float64)
+
+                sys.stdout.write("\rPreparing the dataset... %.2f" % ((i * 100.0) / float(N)))
+            print()
+
+            average = color_sum / (max(N, 1) * self.CROP_SIZE * self.CROP_SIZE * 255.0)
+            info = { "signature": signature, "histogram": histogram.tolist(), "average": average.tolist() }
+            with open(info_filename + ".tmp", "w") as f:
+                json.dump(info, f)
+            os.replace(info_filename + ".tmp", info_filename)
+
+        self.palette = palette
+        self.index_folder = folder
+        self.index_histogram = np.array(info["histogram"], dtype=np.int64)
+        self.index_average = np.array(info["average"], dtype=float)
+
+    def labelsLUT(self):
+        """
+        It returns the table palette index -> class label of the current target classes.
+        """
+        lut = np.zeros(len(self.palette), dtype='int64')
+        lut[:] = self.dict_target['Background']
+        for key in self.dict_target.keys():
+            color = self.labels_dictionary[key].fill
+            code = int(color[0]) + int(color[1]) * 256 + int(color[2]) * 65536
+            lut[self.palette.index(code)] = self.dict_target[key]
+        return lut
+
+    def labelColors(self, image_label):
+        """
+        It returns the label (numpy array) as a RGB image, the labels stored as indices are converted to their colors.
+        """
+        if self.index_folder is None:
+            return image_label
+
+        codes = np.array(self.palette, dtype=np.int64).clip(0)
+        colors = np.stack([codes & 255, (codes >> 8) & 255, codes >> 16], axis=-1).astype(np.uint8)
+        return colors[image_label]
 
     @staticmethod
     def importClassesFromDataset(labels_folder, labels_dictionary):
@@ -316,7 +427,11 @@ class CoralsDataset(Dataset):
         class_sample_count = np.zeros(self.num_classes)
         N = len(self.images_names)
         print(" ")
-        for i, image_name in enumerate(self.images_names):
+        if self.index_folder is not None:
+            class_sample_count += np.bincount(self.labelsLUT(), weights=self.index_histogram, minlength=self.num_classes)
+            N = 0
+
+        for i, image_name in enumerate(self.images_names[:N]):
 
             label_filename = os.path.join(self.labels_dir, image_name)
             imglbl = PILimage.open(label_filename)
@@ -366,6 +481,10 @@ class CoralsDataset(Dataset):
 
     def computeAverage(self):
 
+        if self.index_folder is not None:
+            self.dataset_average[:] = self.index_average
+            return
+
         sum = np.zeros((self.CROP_SIZE, self.CROP_SIZE, 3), dtype=np.float)
         N = len(self.images_names)
         print(" ")
@@ -410,12 +529,15 @@ class CoralsDataset(Dataset):
         """
         It converts an image label to a Pytorch Long Tensor containing the class labels.
 
-        :param image_label: input image is a PIL image
+        :param image_label: input image is a numpy array (or a PIL image)
         :param image_label_mask:  label mask. It is applied only if the masking flag is True.
         :return: Pytorch Long Tensor
         """
 
         data = np.array(image_label)
+        if self.index_folder is not None:
+            return torch.from_numpy(self.labelsLUT()[data])
+
         height = data.shape[0]
         width = data.shape[1]
         labelsint = np.zeros((height, width), dtype='int64')
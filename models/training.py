@@ -1,5 +1,6 @@
 import sys
 import os
+import time
 import numpy as np
 import torch
 import torch.multiprocessing
@@ -20,6 +21,32 @@ np.random.seed(997)
 torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = False
 
+# processes loading and augmenting the samples (0 means that they are loaded by the training process)
+DATALOADER_WORKERS = max(0, min(4, (os.cpu_count() or 1) - 1))
+
+# batches loaded in advance by each worker
+DATALOADER_PREFETCH = 2
+
+
+def initWorker(worker_id):
+    """
+    Initialize a data loading worker: each worker has its own random sequence for the augmentation and OpenCV
+    does not start other threads inside it.
+    """
+    np.random.seed(torch.initial_seed() % (2 ** 32))
+    cv2.setNumThreads(0)
+
+def createDataLoader(dataset, batch_size, shuffle, num_workers=DATALOADER_WORKERS, prefetch_factor=DATALOADER_PREFETCH):
+    """
+    It creates the DataLoader of a dataset. With num_workers > 0 the samples are loaded and augmented by a pool
+    of persistent worker processes, each one keeping prefetch_factor batches ready.
+    """
+    options = {}
+    if num_workers > 0:
+        options = { "persistent_workers": True, "prefetch_factor": prefetch_factor, "worker_init_fn": initWorker }
+
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers, drop_last=True,
+                      pin_memory=True, **options)
 
 def checkDataset(dataset_folder):
     """
@@ -254,7 +281,8 @@ def trainingNetwork(images_folder_train, labels_folder_train, images_folder_val,
                     labels_dictionary, target_classes, output_classes, save_network_as, classifier_name,
                     epochs, batch_sz, batch_mult, learning_rate, L2_penalty, validation_frequency, loss_to_use,
                     epochs_switch, epochs_transition, tversky_alpha, tversky_gamma, optimiz,
-                    flag_shuffle, flag_training_accuracy, progress):
+                    flag_shuffle, flag_training_accuracy, progress,
+                    num_workers=DATALOADER_WORKERS, prefetch_factor=DATALOADER_PREFETCH):
 
     ##### DATA #####
     print("target_classes", target_classes)
@@ -262,6 +290,7 @@ def trainingNetwork(images_folder_train, labels_folder_train, images_folder_val,
     datasetTrain = CoralsDataset(images_folder_train, labels_folder_train, labels_dictionary, target_classes)
 
     print("Dataset setup..", end='')
+    datasetTrain.prepareDataset()
     datasetTrain.computeAverage()
     datasetTrain.computeWeights()
     print("print(datasetTrain.dict_target)",datasetTrain.dict_target)
@@ -275,6 +304,7 @@ def trainingNetwork(images_folder_train, labels_folder_train, images_folder_val,
     datasetTrain.enableAugumentation()
 
     datasetVal = CoralsDataset(images_folder_val, labels_folder_val, labels_dictionary, target_classes)
+    datasetVal.prepareDataset()
     datasetVal.dataset_average = datasetTrain.dataset_average
     datasetVal.weights = datasetTrain.weights
     print("datasetVal.dict_target", datasetVal.dict_target)
@@ -282,12 +312,12 @@ def trainingNetwork(images_folder_train, labels_folder_train, images_folder_val,
     datasetVal.disableAugumentation()
 
     # setup the data loader
-    dataloaderTrain = DataLoader(datasetTrain, batch_size=batch_sz, shuffle=flag_shuffle, num_workers=0, drop_last=True,
-                                 pin_memory=True)
+    dataloaderTrain = createDataLoader(datasetTrain, batch_size=batch_sz, shuffle=flag_shuffle,
+                                       num_workers=num_workers, prefetch_factor=prefetch_factor)
 
     validation_batch_size = 4
-    dataloaderVal = DataLoader(datasetVal, batch_size=validation_batch_size, shuffle=False, num_workers=0, drop_last=True,
-                                 pin_memory=True)
+    dataloaderVal = createDataLoader(datasetVal, batch_size=validation_batch_size, shuffle=False,
+                                     num_workers=num_workers, prefetch_factor=prefetch_factor)
 
     training_images_number = len(datasetTrain.images_names)
     validation_images_number = len(datasetVal.images_names)
@@ -372,8 +402,17 @@ def trainingNetwork(images_folder_train, labels_folder_train, images_folder_val,
         optimizer.zero_grad()
 
         loss_values_per_iter = []
+
+        # time spent waiting for the data and in the computation
+        data_time = 0.0
+        compute_time = 0.0
+        t = time.perf_counter()
+
         for i, minibatch in enumerate(dataloaderTrain):
 
+            t_data = time.perf_counter()
+            data_time += t_data - t
+
             updateProgressBar(progress, "Training - Iteration ", num_iter, total_iter)
             num_iter += 1
 
@@ -401,8 +440,12 @@ def trainingNetwork(images_folder_train, labels_folder_train, images_folder_val,
             print(epoch, i, loss.item())
             loss_values_per_iter.append(loss.item())
 
+            t = time.perf_counter()
+            compute_time += t - t_data
+
         mean_loss_train = sum(loss_values_per_iter) / len(loss_values_per_iter)
         print("Epoch: %d , Mean loss = %f" % (epoch, mean_loss_train))
+        print("Epoch: %d , Data loading time = %.1f s, Compute time = %.1f s" % (epoch, data_time, compute_time))
 
         loss_values_train.append(mean_loss_train)
 
@@ -460,7 +503,8 @@ def trainingNetwork(images_folder_train, labels_folder_train, images_folder_val,
 
 
 def testNetwork(images_folder, labels_folder, labels_dictionary, target_classes, dataset_train,
-                network_filename, output_folder, progress):
+                network_filename, output_folder, progress,
+                num_workers=DATALOADER_WORKERS, prefetch_factor=DATALOADER_PREFETCH):
     """
     Load a network and test it on the test dataset.
     :param network_filename: Full name of the network to load (PATH+name)
@@ -468,6 +512,7 @@ def testNetwork(images_folder, labels_folder, labels_dictionary, target_classes,
 
     # TEST DATASET
     datasetTest = CoralsDataset(images_folder, labels_folder, labels_dictionary, target_classes)
+    datasetTest.prepareDataset()
     datasetTest.disableAugumentation()
 
     datasetTest.num_classes = dataset_train.num_classes
@@ -477,8 +522,8 @@ def testNetwork(images_folder, labels_folder, labels_dictionary, target_classes,
     output_classes = dataset_train.num_classes
 
     batchSize = 1
-    dataloaderTest = DataLoader(datasetTest, batch_size=batchSize, shuffle=False, num_workers=0, drop_last=True,
-                            pin_memory=True)
+    dataloaderTest = createDataLoader(datasetTest, batch_size=batchSize, shuffle=False,
+                                      num_workers=num_workers, prefetch_factor=prefetch_factor)
 
     # DEEPLAB V3+
     net = DeepLab(backbone='resnet', output_stride=16, num_classes=output_classes)
@@ -18,6 +18,8 @@
 # for more details.
 import json
 import os
+import heapq
+import itertools
 import numpy as np
 from cv2 import fillPoly
 import pickle as pkl
@@ -37,15 +39,28 @@ from source import utils
 
 import uuid
 import pandas as pd
+import rasterio as rio
+from rasterio.windows import Window
 from scipy import ndimage as ndi
-from skimage.morphology import watershed, binary_dilation, binary_erosion
-from source.Blob import Blob
+from skimage.morphology import watershed, binary_erosion
+from source.Blob import Blob, blobsPerimeters, labelsMoments
 from source.Label import Label
+from source.SpatialIndex import SpatialIndex
+from source.DisjointSet import DisjointSet
 import source.Mask as Mask
 
 from PyQt5.QtWidgets import QApplication
 #from PIL import Image as Img  #for debug
 
+# attributes of the annotation created with the blobs (a lazy layer does not have them until it is used)
+BLOB_ATTRIBUTES = ("seg_blobs", "blobs_by_id", "blobs_by_genet", "spatial_index", "free_ids", "next_free_id")
+
+# revisions of the blobs of the layers, unique among all the layers (see Annotation.revision)
+LAYER_REVISIONS = itertools.count()
+
+# size of the tiles in which the label maps are drawn
+LABEL_MAP_TILE_SIZE = 2048
+
 #refactor: change name to annotationS
 class Annotation(QObject):
     """
@@ -59,9 +74,10 @@ class Annotation(QObject):
     def __init__(self, name = "Annotation", id = -1):
         super(QObject, self).__init__()
 
-        #refactor: rename this to blobs.
-        # list of all blobs
-        self.seg_blobs = []
+        self.initBlobs()
+
+        # it changes every time a blob is added or removed, the binary projects save only the changed layers
+        self.revision = next(LAYER_REVISIONS)
 
         if id == -1:
             self.id = str(uuid.uuid4())
@@ -84,6 +100,76 @@ class Annotation(QObject):
         self.cache_data_table = None
         self.cache_labels_table = None
 
+    def initBlobs(self):
+
+        #refactor: rename this to blobs.
+        # list of all blobs
+        self.seg_blobs = []
+
+        # indices kept in sync by addBlob/removeBlob/updateBlob
+        self.blobs_by_id = {}
+        self.blobs_by_genet = {}
+        self.spatial_index = SpatialIndex()
+
+        # free ids allocator: min-heap of the ids below next_free_id that could be free (lazily cleaned)
+        self.free_ids = []
+        self.next_free_id = 0
+
+    def setPendingBlobs(self, records):
+        """
+        The blobs of the layer are created only when the layer is used (see hydrate). The records are the blobs
+        as saved in the project (dictionaries or Blob), or a function that returns them.
+        """
+        for name in BLOB_ATTRIBUTES:
+            self.__dict__.pop(name, None)
+        self.pending_blobs = records
+        self.revision = next(LAYER_REVISIONS)
+
+    def isHydrated(self):
+        return "pending_blobs" not in self.__dict__
+
+    def blobCount(self):
+        """
+        Number of blobs of the layer, a lazy layer is not hydrated.
+        """
+        if not self.isHydrated():
+            return len(self.pending_blobs)
+        return len(self.seg_blobs)
+
+    def hydrate(self):
+        """
+        It creates the blobs of a layer loaded lazily.
+        """
+        records = self.__dict__.pop("pending_blobs", None)
+        if records is None:
+            return
+
+        self.initBlobs()
+
+        # the blobs created are the ones of the records, the layer is not changed
+        revision = self.revision
+
+        if callable(records):
+            records = records()
+
+        for record in records:
+            if isinstance(record, Blob):
+                blob = record
+            else:
+                blob = Blob(None, 0, 0, 0)
+                blob.fromDict(record)
+            self.addBlob(blob, notify=False)
+
+        self.revision = revision
+        self.table_needs_update = True
+
+    def __getattr__(self, name):
+        # called only for the missing attributes: the blobs of a lazy layer are created on first use
+        if name in BLOB_ATTRIBUTES and "pending_blobs" in self.__dict__:
+            self.hydrate()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
     @classmethod
     def get_annotation_type(cls, attributes):
         for c in cls.__subclasses__():
@@ -91,15 +177,18 @@ class Annotation(QObject):
                 return c(attributes["name"], attributes["id"], attributes["dictionary_name"], attributes["dictionary_description"], attributes["labels"])
 
     def classBrushFromName(self, blob):
+        return self.classBrush(blob.class_name)
+
+    def classBrush(self, class_name):
         brush = QBrush()
-        if blob.class_name == "Empty":
+        if class_name == "Empty":
             return brush
 
-        if not blob.class_name in self.labels:
-            print("Missing label for " + blob.class_name + ". Creating one.")
-            self.labels[blob.class_name] = Label(blob.class_name, blob.class_name, fill = [255, 0, 0])
+        if not class_name in self.labels:
+            print("Missing label for " + class_name + ". Creating one.")
+            self.labels[class_name] = Label(class_name, class_name, fill = [255, 0, 0])
 
-        color = self.labels[blob.class_name].fill
+        color = self.labels[class_name].fill
         brush = QBrush(QColor(color[0], color[1], color[2], 200))
         return brush
 
@@ -152,10 +241,11 @@ class Annotation(QObject):
             self.labels[label.name] = label
 
     def addBlob(self, blob, notify=True):
-        used = [blob.id for blob in self.seg_blobs]
-        if blob.id in used:
+        if blob.id in self.blobs_by_id:
             blob.id = self.getFreeId()
         self.seg_blobs.append(blob)
+        self.indexBlob(blob)
+        self.revision = next(LAYER_REVISIONS)
 
         # notification that a blob has been added
         if notify:
@@ -171,6 +261,8 @@ class Annotation(QObject):
 
         index = self.seg_blobs.index(blob)
         del self.seg_blobs[index]
+        self.unindexBlob(blob)
+        self.revision = next(LAYER_REVISIONS)
 
         self.table_needs_update = True
 
@@ -183,6 +275,58 @@ class Annotation(QObject):
 
         self.table_needs_update = True
 
+    def indexBlob(self, blob):
+        """
+        Register the blob in the id, genet and spatial indices and in the free ids allocator.
+        """
+        self.blobs_by_id[blob.id] = blob
+
+        if blob.id >= self.next_free_id:
+            for free_id in range(self.next_free_id, blob.id):
+                heapq.heappush(self.free_ids, free_id)
+            self.next_free_id = blob.id + 1
+
+        self.blobs_by_genet.setdefault(blob.genet, []).append(blob)
+        self.spatial_index.insert(blob)
+
+    def unindexBlob(self, blob):
+        """
+        Remove the blob from the id, genet and spatial indices and give its id back to the free ids allocator.
+        """
+        self.spatial_index.remove(blob)
+
+        if self.blobs_by_id.get(blob.id) is blob:
+            del self.blobs_by_id[blob.id]
+            if 0 <= blob.id < self.next_free_id:
+                heapq.heappush(self.free_ids, blob.id)
+
+        blobs = self.blobs_by_genet.get(blob.genet)
+        if blobs is not None and blob in blobs:
+            blobs.remove(blob)
+            if len(blobs) == 0:
+                del self.blobs_by_genet[blob.genet]
+
+    def updateGenetIndex(self):
+        """
+        Rebuild the genet -> blobs index (the genets are re-assigned all together by the Genet class).
+        """
+        self.blobs_by_genet = {}
+        for blob in self.seg_blobs:
+            self.blobs_by_genet.setdefault(blob.genet, []).append(blob)
+
+    def setBlobGenet(self, blob, genet):
+        """
+        Change the genet of a blob keeping the genet index updated.
+        """
+        blobs = self.blobs_by_genet.get(blob.genet)
+        if blobs is not None and blob in blobs:
+            blobs.remove(blob)
+            if len(blobs) == 0:
+                del self.blobs_by_genet[blob.genet]
+
+        blob.genet = genet
+        self.blobs_by_genet.setdefault(genet, []).append(blob)
+
     def setBlobClass(self, blob, class_name):
 
         if blob.class_name == class_name:
@@ -197,15 +341,49 @@ class Annotation(QObject):
         self.table_needs_update = True
 
     def blobById(self, id):
-        for blob in self.seg_blobs:
-            if blob.id == id:
-                return blob
-        return None
+        return self.blobs_by_id.get(id)
 
     def blobByGenet(self, genet):
-        return [blob for blob in self.seg_blobs if blob.genet == genet]
+        return list(self.blobs_by_genet.get(genet, []))
+
+    def blobsInBox(self, box, inside=False):
+        """
+        It returns the blobs whose bounding box intersects the given box (top, left, width, height).
+        If inside is True only the blobs falling entirely inside the box are returned.
+        """
+        return self.spatial_index.rectQuery(box, inside)
+
+    def nearestBlob(self, x, y):
+        """
+        It returns the blob whose bounding box is the nearest to the point (x, y).
+        """
+        return self.spatial_index.nearest(x, y)
+
+    def pendingBlobs(self):
+        """
+        It returns the records of a layer never used (see setPendingBlobs), None if its blobs have been created.
+        """
+        return self.__dict__.get("pending_blobs")
+
+    def savedBlobs(self):
+        """
+        It returns the blobs to save, the records of a layer never used are returned as they have been loaded.
+        """
+        records = self.pendingBlobs()
+        return self.seg_blobs if records is None else records
+
+    def save(self, blobs=True):
+        """
+        It returns the data of the layer to save. If blobs is False the blobs are not included (they are stored
+        apart by the binary projects) and a layer never used is not hydrated.
+        """
+        # the records of a layer never used are saved as they have been loaded, if they are in the current format
+        records = self.__dict__.get("pending_blobs")
+        if blobs and records is not None:
+            if callable(records) or any(not isinstance(record, dict) or type(record["contour"]) is not str
+                                        for record in records[:1]):
+                self.hydrate()
 
-    def save(self):
         data = self.__dict__.copy()
         
         del data["refine_depth_weight"]
@@ -213,6 +391,13 @@ class Annotation(QObject):
         del data["table_needs_update"]
         del data["cache_data_table"]
         del data["cache_labels_table"]
+        del data["revision"]
+        for name in BLOB_ATTRIBUTES:
+            data.pop(name, None)
+
+        records = data.pop("pending_blobs", None)
+        if blobs:
+            data["seg_blobs"] = self.seg_blobs if records is None else records
 
         return data
 
@@ -238,13 +423,14 @@ class Annotation(QObject):
         return last_blobs_added
 
     def getFreeId(self):
-        used = []
-        for blob  in self.seg_blobs:
-            used.append(blob.id)
-        for id in range(len(used)):
-            if id not in used:
-                return id
-        return len(used)
+        """
+        It returns the smallest id not used by the blobs of this annotation (the id is not reserved).
+        """
+        while self.free_ids and self.free_ids[0] in self.blobs_by_id:
+            heapq.heappop(self.free_ids)
+        if self.free_ids:
+            return self.free_ids[0]
+        return self.next_free_id
 
     def union(self, blobs):
         """
@@ -591,9 +777,9 @@ class Annotation(QObject):
 
         blobs_clicked = []
 
-        for blob in self.seg_blobs:
+        point = np.array([[x, y]])
+        for blob in self.spatial_index.pointQuery(x, y):
 
-            point = np.array([[x, y]])
             out = measure.points_in_poly(point, blob.contour)
             if out[0] == True:
                 blobs_clicked.append(blob)
@@ -614,65 +800,66 @@ class Annotation(QObject):
     def create_label_map(self, size, labels_dictionary, working_area):
         """
         Create a label map as a QImage and returns it.
+        Only the working area (if given) is drawn, see labelMapTiles.
         """
 
-        # create a black canvas of the same size of your map
-        w = size.width()
-        h = size.height()
-
-        imagebox = [0, 0, h, w]
-        image = np.zeros([h, w, 3], np.uint8)
-
-        for i, blob in enumerate(self.seg_blobs):
-            if not blob.qpath_gitem.isVisible():
-                continue
-
-            if blob.class_name == "Empty":
-                rgb = [255, 255, 255]
-            else:
-                rgb = labels_dictionary[blob.class_name].fill
-
-            mask = blob.getMask().astype(bool)  # bool is required for bitmask indexing
-            box = blob.bbox.copy()  # blob.bbox is top, left, width, height
-            (box[2], box[3]) = (box[3] + box[0], box[2] + box[1])  # box is now startx, starty, endx, endy
-
-            #range is the interection of box and imagebox
-            range = [max(box[0], imagebox[0]), max(box[1], imagebox[1]), min(box[2], imagebox[2]), min(box[3], imagebox[3])]
-            subimage = image[range[0] - imagebox[0]:range[2] - imagebox[0], range[1] - imagebox[1]:range[3] - imagebox[1]]
-            submask = mask[range[0] - box[0]:range[2] - box[0], range[1] - box[1]:range[3] - box[1]]
-
-            #use the binary mask to assign a color
-            subimage[submask] = rgb
-
-            #create 1px border: dilate then subtract the mask.
-            border = binary_dilation(submask) & ~submask
-
-            #select only the border over blobs of the same color and draw the border
-            samecolor = np.all(subimage == rgb, axis=-1)
-            subimage[border & samecolor] = [0, 0, 0]
+        (palette, window) = self.labelMapWindow(size, labels_dictionary, working_area)
+        image = np.zeros([window[3], window[2], 3], np.uint8)
+        for (top, left, tile) in self.labelMapTiles(size, labels_dictionary, working_area):
+            image[top:top + tile.shape[0], left:left + tile.shape[1]] = palette[tile]
 
-        labelimg = utils.rgbToQImage(image)
+        return utils.rgbToQImage(image)
 
-        if working_area is not None:
-            # FIXME: this is inefficient! The working_area should be used during the drawing.
-            labelimg_cropped = utils.cropQImage(labelimg, working_area)
-            return labelimg_cropped
+    def labelMapWindow(self, size, labels_dictionary, working_area):
+        """
+        It returns the palette (N x 3 uint8) of the class indices of the label map and the drawn window
+        (top, left, width, height), that is the working area or the whole map.
+        """
+        palette = labelMapPalette(labels_dictionary)[0]
+        if working_area is None:
+            window = [0, 0, size.width(), size.height()]
         else:
-            return labelimg
+            window = [int(value) for value in working_area]
+        return (palette, window)
 
+    def labelMapTiles(self, size, labels_dictionary, working_area, tile_size=LABEL_MAP_TILE_SIZE):
+        """
+        It draws the label map of the working area (the whole map if None) by tiles, so the full canvas is never
+        allocated. For each tile it yields its position (top, left) in the working area and its class indices
+        (H x W, see labelMapPalette; 0 is the background and the borders).
+        The blobs are drawn in order over a buffer of blob indices and the 1px borders between blobs of the same
+        color are computed once per tile, from this buffer.
+        """
+        (colors, color_index) = labelMapPalette(labels_dictionary)
+        dtype = np.uint8 if len(colors) <= 256 else np.uint16
+        window = self.labelMapWindow(size, labels_dictionary, working_area)[1]
+        (w, h) = (size.width(), size.height())
+
+        blobs = [blob for blob in self.seg_blobs if blob.qpath_gitem.isVisible()]
+        classes = np.zeros(len(blobs) + 1, dtype=dtype)
+        boxes = np.zeros((len(blobs), 4), dtype=np.int64)
+        for i, blob in enumerate(blobs):
+            classes[i + 1] = color_index[blob.class_name]
+            boxes[i] = blob.bbox[0], blob.bbox[1], blob.bbox[0] + blob.bbox[3], blob.bbox[1] + blob.bbox[2]
+
+        # a blob (and its border) is never drawn outside the map
+        boxes = np.maximum(boxes, 0)
+        boxes[:, 2] = np.minimum(boxes[:, 2], h)
+        boxes[:, 3] = np.minimum(boxes[:, 3], w)
+
+        for tile_top in range(0, window[3], tile_size):
+            for tile_left in range(0, window[2], tile_size):
+                tile_box = [window[0] + tile_top, window[1] + tile_left,
+                            min(tile_size, window[2] - tile_left), min(tile_size, window[3] - tile_top)]
+                tile = drawLabelTile(blobs, classes, boxes, tile_box)
+                yield (tile_top, tile_left, tile)
 
     def calculate_inner_blobs(self, working_area):
         """
         This consider only blobs falling ENTIRELY in the working area"
         """
 
-        selected_blobs = self.seg_blobs
-        inner_blobs = []
-        for blob in selected_blobs:
-            if Mask.insideBox(working_area, blob.bbox):
-                inner_blobs.append(blob)
-
-        return inner_blobs
+        return self.blobsInBox(working_area, inside=True)
 
 
     def calculate_perclass_blobs_value(self, label, pixel_size):
@@ -697,168 +884,228 @@ class Annotation(QObject):
         """
         qimg_label_map = QImage(filenameLabels)
         qimg_label_map = qimg_label_map.convertToFormat(QImage.Format_RGB32)
+        label_map = utils.qimageToNumpyArray(qimg_label_map)
 
         fileobject = open(filenameScores, 'rb')
         scores = pkl.load(fileobject)
-        max_scores = np.max(scores, 0)
-        max_scores =  max_scores * 100
-        h = max_scores.shape[0]
-        w = max_scores.shape[1]
-
-        max_scores_aux = np.zeros([h, w, 3], np.uint8)
-        max_scores_aux[:,:,0] = max_scores
-        max_scores_aux[:,:,1] = max_scores
-        max_scores_aux[:,:,2] = max_scores
+        fileobject.close()
 
-        max_scores = max_scores_aux
+        max_scores = np.max(scores, 0) * 100
+        max_scores = max_scores.astype(np.uint8)
 
-        #im = Imagee.fromarray(max_scores[:,:,0])
-        #if im.mode != 'RGB':
-        #    im = im.convert('RGB')
-        #im.save("your_file1.png")
+        return self.import_label_map_arrays(label_map, max_scores, labels_dictionary, offset, scale, progress, create_holes)
 
-        fileobject.close()
-        qimg_scores_map = utils.rgbToQImage(max_scores)
+    def import_label_mapNoScores(self, filenameLabels, labels_dictionary, offset, scale, progress, create_holes=False):
+        """
+        It imports a label map and create the corresponding blobs without Scores.
+        The offset is stored as a [top, left] coordinates and scale are the scale factors of X and Y axis respectively.
+        """
+        qimg_label_map = QImage(filenameLabels)
+        qimg_label_map = qimg_label_map.convertToFormat(QImage.Format_RGB32)
+        label_map = utils.qimageToNumpyArray(qimg_label_map)
 
-        # label map rescaling (if necessary)
-        w_rescaled = round(qimg_label_map.width() * scale[0])
-        h_rescaled = round(qimg_label_map.height() * scale[1])
-        qimg_label_map = qimg_label_map.scaled(w_rescaled, h_rescaled, Qt.IgnoreAspectRatio, Qt.FastTransformation)
- 
-        # scores map rescaling (if necessary)
-        w_rescaled = round(qimg_scores_map.width() * scale[0])
-        h_rescaled = round(qimg_scores_map.height() * scale[1])
-        qimg_scores_map = qimg_scores_map.scaled(w_rescaled, h_rescaled, Qt.IgnoreAspectRatio, Qt.FastTransformation)
+        return self.import_label_map_arrays(label_map, None, labels_dictionary, offset, scale, progress, create_holes)
 
+    def import_label_map_arrays(self, label_map, max_scores, labels_dictionary, offset, scale, progress, create_holes=False):
+        """
+        It imports a label map given as a RGB array (H x W x 3) and create the corresponding blobs.
+        The max scores (H x W, in percentage) give the confidence of the blobs, they can be None.
+        The offset is stored as a [top, left] coordinates and scale are the scale factors of X and Y axis respectively.
+        """
 
-        label_map = utils.qimageToNumpyArray(qimg_label_map)
+        # label map rescaling (if necessary)
+        label_map = rescaleMap(label_map, scale)
         label_map = label_map.astype(np.int32)
-        
-        max_scores = utils.qimageToNumpyArray(qimg_scores_map)
-        
-        im = Imagee.fromarray(max_scores[:,:,0])
 
-        max_scores = max_scores[:,:,0]
+        # scores map rescaling (if necessary)
+        if max_scores is not None:
+            max_scores = rescaleMap(max_scores.astype(np.uint8), scale)
 
         # RGB -> label code association (ok, it is a dirty trick but it saves time...)
         label_coded = label_map[:, :, 0] + (label_map[:, :, 1] << 8) + (label_map[:, :, 2] << 16)
 
         labels, num_labels = measure.label(label_coded, connectivity=1, return_num=True)
-        
-        acum_scores = [0] * (num_labels+1)
-        count_num_scores = [0] * (num_labels+1)
-        for i in range(len(labels)):
-            for j in range(len(labels[i])):
-                label = labels[i][j]
-                acum_scores[label] += max_scores[i][j]
-                count_num_scores[label] += 1
+
+        return self.blobsFromLabelImage(label_coded, labels, num_labels, labels_dictionary, offset, progress,
+                                        create_holes, max_scores=max_scores)
+
+    def blobsFromLabelImage(self, label_coded, labels, num_labels, labels_dictionary, offset, progress,
+                            create_holes=False, max_scores=None):
+        """
+        It creates the blobs of the connected regions of a labelled image. The class of each region is found
+        through the RGB code of its pixels; if the scores are given the confidence is the average score of the region.
+        """
+
+        color_codes = labelColorCodes(labels_dictionary)
+
+        # per-region sum and count of the scores computed in one pass
+        if max_scores is not None:
+            flat_labels = labels.ravel()
+            acum_scores = np.bincount(flat_labels, weights=max_scores.ravel(), minlength=num_labels+1)
+            count_num_scores = np.bincount(flat_labels, minlength=num_labels+1)
 
         too_much_small_area = 50
-        region_big = None
 
         offset_x = offset[1]
         offset_y = offset[0]
         created_blobs = []
         num_iter = 0
-        total_iter = len(measure.regionprops(labels))
-        
+        regions = measure.regionprops(labels)
+        total_iter = len(regions)
+
         modul = total_iter
         if total_iter > 25:
             modul = int(total_iter/25)
 
-        for region in measure.regionprops(labels):
+        # the areas and the centroids of all the regions are computed in one pass over the labels
+        (areas, sum_x, sum_y) = labelsMoments(labels, num_labels)
+        boxes = []
+
+        for region in regions:
             if num_iter % modul == 0:
                 updateProgressBar(progress, "Loading label image: ", num_iter, total_iter)
-            if region.area > too_much_small_area:
+            if areas[region.label] > too_much_small_area:
 
-                id = len(self.seg_blobs)
-
-                blob = Blob(region, offset_x, offset_y, self.getFreeId())
+                blob = Blob(region, offset_x, offset_y, self.getFreeId(), geometry=False)
 
                 # assign class
                 row = region.coords[0, 0]
                 col = region.coords[0, 1]
-                color = label_map[row, col]
-                for key in labels_dictionary.keys():
-                    c = labels_dictionary[key].fill
-                    if c[0] == color[0] and c[1] == color[1] and c[2] == color[2]:
-                        blob.class_name = labels_dictionary[key].name
+                class_name = color_codes.get(int(label_coded[row, col]))
+                if class_name is not None:
+                    blob.class_name = class_name
+                    if max_scores is not None:
                         index = region.label
                         blob.confidence = int(acum_scores[index] / count_num_scores[index])
-                        break
+
                 if create_holes or blob.class_name != 'Empty':
                     created_blobs.append(blob)
+                    boxes.append((region.label, region.bbox[0], region.bbox[1]))
 
             num_iter += 1
+
+        # same values of Blob.updateUsingMask: the centroid is computed in the bounding box and then moved
+        for (blob, perimeter, (label, top, left)) in zip(created_blobs, blobsPerimeters(created_blobs), boxes):
+            area = areas[label]
+            cx = (sum_x[label] - area * left) / area
+            cy = (sum_y[label] - area * top) / area
+            blob.setCentroid(cx + (left + offset_x), cy + (top + offset_y))
+            blob.area = float(area)
+            blob.perimeter = float(perimeter)
+
         updateProgressBar(progress, "Loading label image: ", num_iter, total_iter)
         return created_blobs
 
-    def import_label_mapNoScores(self, filenameLabels, labels_dictionary, offset, scale, progress, create_holes=False):
+    def import_label_map_tiled(self, filenameLabels, labels_dictionary, offset, scale, progress, create_holes=False,
+                               strip_height=1024):
         """
-        It imports a label map and create the corresponding blobs without Scores.
-        The offset is stored as a [top, left] coordinates and scale are the scale factors of X and Y axis respectively.
+        It imports a label map reading it in horizontal strips, so the memory used is bounded by the size of the strips
+        (and of the regions crossing them) instead of the size of the map. The regions crossing the strips are merged
+        with a union-find. The blobs created are the same of import_label_mapNoScores.
         """
-        qimg_label_map = QImage(filenameLabels)
-        qimg_label_map = qimg_label_map.convertToFormat(QImage.Format_RGB32)
-
 
+        color_codes = labelColorCodes(labels_dictionary)
+        too_much_small_area = 50
 
-        # label map rescaling (if necessary)
-        w_rescaled = round(qimg_label_map.width() * scale[0])
-        h_rescaled = round(qimg_label_map.height() * scale[1])
-        qimg_label_map = qimg_label_map.scaled(w_rescaled, h_rescaled, Qt.IgnoreAspectRatio, Qt.FastTransformation)
+        offset_x = offset[1]
+        offset_y = offset[0]
 
+        src = rio.open(filenameLabels)
 
-        label_map = utils.qimageToNumpyArray(qimg_label_map)
-        label_map = label_map.astype(np.int32)
-        
+        # label map rescaling (if necessary), the rows and the columns of the map are sampled as Qt does
+        w_rescaled = round(src.width * scale[0])
+        h_rescaled = round(src.height * scale[1])
+        cols = nearestIndices(src.width, w_rescaled)
+        rows = nearestIndices(src.height, h_rescaled)
 
-        # RGB -> label code association (ok, it is a dirty trick but it saves time...)
-        label_coded = label_map[:, :, 0] + (label_map[:, :, 1] << 8) + (label_map[:, :, 2] << 16)
+        pieces = {}                 # piece id -> (top, left, mask, code, first pixel) of a region of a strip
+        components = DisjointSet()  # pieces of the same region
+        members = {}                # root piece -> pieces of the region
+        created_blobs = []
 
-        labels, num_labels = measure.label(label_coded, connectivity=1, return_num=True)
+        last_codes = None
+        last_pieces = None
+        next_piece = 1
 
-        too_much_small_area = 50
-        region_big = None
+        total_iter = int(np.ceil(h_rescaled / strip_height))
+        for num_iter, top in enumerate(range(0, h_rescaled, strip_height)):
 
-        offset_x = offset[1]
-        offset_y = offset[0]
-        created_blobs = []
-        num_iter = 0
-        total_iter = len(measure.regionprops(labels))
-        
-        modul = total_iter
-        if total_iter > 25:
-            modul = int(total_iter/25)
+            updateProgressBar(progress, "Loading label image: ", num_iter, total_iter)
 
-        for region in measure.regionprops(labels):
-            if num_iter % modul == 0:
-                updateProgressBar(progress, "Loading label image: ", num_iter, total_iter)
-            if region.area > too_much_small_area:
+            strip_rows = rows[top:top + strip_height]
+            window = Window(0, int(strip_rows[0]), src.width, int(strip_rows[-1] - strip_rows[0] + 1))
+            rgb = readRGBWindow(src, window)
+            rgb = rgb[:, strip_rows - strip_rows[0]][:, :, cols]
 
-                id = len(self.seg_blobs)
+            # RGB -> label code association
+            label_coded = rgb[0].astype(np.int32) + (rgb[1].astype(np.int32) << 8) + (rgb[2].astype(np.int32) << 16)
+            del rgb
 
-                blob = Blob(region, offset_x, offset_y, self.getFreeId())
+            labels, num_labels = measure.label(label_coded, connectivity=1, return_num=True)
 
-                # assign class
+            for region in measure.regionprops(labels):
+                id = region.label + next_piece - 1
                 row = region.coords[0, 0]
                 col = region.coords[0, 1]
-                color = label_map[row, col]
-                for key in labels_dictionary.keys():
-                    c = labels_dictionary[key].fill
-                    if c[0] == color[0] and c[1] == color[1] and c[2] == color[2]:
-                        blob.class_name = labels_dictionary[key].name
-                        index = region.label
-                        break
-                if create_holes or blob.class_name != 'Empty':
-                    created_blobs.append(blob)
-
-            num_iter += 1
-        updateProgressBar(progress, "Loading label image: ", num_iter, total_iter)
-        return created_blobs
+                pieces[id] = (region.bbox[0] + top, region.bbox[1], region.image, int(label_coded[row, col]), (row + top, col))
+                components.add(id)
+                members[id] = [id]
+
+            first_pieces = labels[0] + (next_piece - 1) * (labels[0] > 0)
+
+            # merge the pieces touching the seam with the previous strip
+            if last_pieces is not None:
+                same = (last_codes == label_coded[0]) & (last_pieces > 0)
+                pairs = np.unique(np.stack([last_pieces[same], first_pieces[same]], axis=1), axis=0)
+                for (a, b) in pairs:
+                    ra = components.find(int(a))
+                    rb = components.find(int(b))
+                    if ra != rb:
+                        root = components.union(ra, rb)
+                        other = rb if root == ra else ra
+                        members[root].extend(members.pop(other))
+
+            last_codes = label_coded[-1].copy()
+            last_pieces = labels[-1] + (next_piece - 1) * (labels[-1] > 0)
+            next_piece += num_labels
+            del labels, label_coded
+
+            # the regions not touching the bottom of the strip are complete
+            open_roots = set()
+            if top + strip_height < h_rescaled:
+                open_roots = set(components.find(int(id)) for id in np.unique(last_pieces[last_pieces > 0]))
+
+            for root in [root for root in members.keys() if root not in open_roots]:
+                ids = members.pop(root)
+                region_pieces = [pieces.pop(id) for id in ids]
+                components.forget(ids)
+
+                area = sum(np.count_nonzero(piece[2]) for piece in region_pieces)
+                if area > too_much_small_area:
+                    (mask, mask_top, mask_left) = jointPieces(region_pieces)
+                    region = measure.regionprops(mask)[0]
+                    blob = Blob(region, offset_x + mask_left, offset_y + mask_top, self.getFreeId())
+
+                    class_name = color_codes.get(region_pieces[0][3])
+                    if class_name is not None:
+                        blob.class_name = class_name
+
+                    if create_holes or blob.class_name != 'Empty':
+                        first_pixel = min(piece[4] for piece in region_pieces)
+                        created_blobs.append((first_pixel, blob))
+
+        src.close()
+        updateProgressBar(progress, "Loading label image: ", total_iter, total_iter)
+
+        # same order of the regions of the whole map
+        created_blobs.sort(key=lambda item: item[0])
+        return [blob for (first_pixel, blob) in created_blobs]
 
     def export_data_table(self, project, image, filename):
 
+        # the genets are computed the first time they are needed
+        project.genet.sync()
+
         working_area = project.working_area
         scale_factor = image.pixelSize()
         date = image.acquisition_date
@@ -959,6 +1206,9 @@ class Annotation(QObject):
 
     def export_W3C(self, project, image, filename):
 
+        # the genets are computed the first time they are needed
+        project.genet.sync()
+
         working_area = project.working_area
         scale_factor = image.pixelSize()
         date = image.acquisition_date
@@ -1078,6 +1328,147 @@ window.my.target.selector
         label_map = self.create_label_map(size, labels_dictionary=project.labels, working_area=project.working_area)
         label_map.save(filename, 'png')
 
+def labelColorCodes(labels_dictionary):
+    """
+    It returns the table RGB code -> class name of the given labels (the first label with a given color wins).
+    """
+    color_codes = {}
+    for key in labels_dictionary.keys():
+        c = labels_dictionary[key].fill
+        code = int(c[0]) + (int(c[1]) << 8) + (int(c[2]) << 16)
+        if code not in color_codes:
+            color_codes[code] = labels_dictionary[key].name
+    return color_codes
+
+def labelMapPalette(labels_dictionary):
+    """
+    It returns the palette (N x 3 uint8) of the class indices of a label map and the table class name -> index.
+    The index 0 is black (background and borders), the labels with the same color share the same index.
+    The Empty blobs are always white, whatever the color of the Empty label.
+    """
+    colors = [(0, 0, 0), (255, 255, 255)]
+    color_index = { "Empty": 1 }
+    for key in labels_dictionary.keys():
+        if key == "Empty":
+            continue
+        color = tuple(int(c) for c in labels_dictionary[key].fill)
+        if color not in colors:
+            colors.append(color)
+        color_index[key] = colors.index(color)
+    return (np.array(colors, dtype=np.uint8), color_index)
+
+def drawLabelTile(blobs, classes, boxes, tile_box):
+    """
+    It draws the class indices of a tile (top, left, width, height) of a label map.
+    classes are the indices of the blobs (shifted by one, 0 is the background), boxes their bounding boxes
+    (top, left, bottom, right) clipped to the map. A pixel of a blob becomes a border (0) if it is 4-connected
+    to a blob of the same color drawn after it and it falls in the bounding box of that blob.
+    """
+    (top, left, w, h) = tile_box
+
+    # blob indices of the tile with a margin of 1 pixel, -1 is the background
+    owner = np.full((h + 2, w + 2), -1, dtype=np.int32)
+    (otop, oleft, obottom, oright) = (top - 1, left - 1, top + h + 1, left + w + 1)
+
+    selected = np.nonzero((boxes[:, 0] < obottom) & (boxes[:, 2] > otop) &
+                          (boxes[:, 1] < oright) & (boxes[:, 3] > oleft))[0]
+    for i in selected:
+        blob = blobs[i]
+        (rtop, rleft) = (max(boxes[i, 0], otop), max(boxes[i, 1], oleft))
+        (rbottom, rright) = (min(boxes[i, 2], obottom), min(boxes[i, 3], oright))
+        view = owner[rtop - otop:rbottom - otop, rleft - oleft:rright - oleft]
+        origin = np.array([rleft, rtop])
+        points = blob.contour.round().astype(np.int32) - origin
+
+        if len(blob.inner_contours) == 0:
+            fillPoly(view, pts=[points], color=int(i))
+        else:
+            mask = np.zeros(view.shape, np.uint8)
+            fillPoly(mask, pts=[points], color=1)
+            for inner_contour in blob.inner_contours:
+                fillPoly(mask, pts=[inner_contour.round().astype(np.int32) - origin], color=0)
+            view[mask > 0] = i
+
+    inner = owner[1:-1, 1:-1]
+    border = np.zeros((h, w), dtype=bool)
+    for (dy, dx) in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+        neighbour = owner[1 + dy:h + 1 + dy, 1 + dx:w + 1 + dx]
+        (rows, cols) = np.nonzero((neighbour > inner) & (inner >= 0))
+        if len(rows) == 0:
+            continue
+        after = neighbour[rows, cols]
+        before = inner[rows, cols]
+        (y, x) = (rows + top, cols + left)
+        inside = (y >= boxes[after, 0]) & (y < boxes[after, 2]) & (x >= boxes[after, 1]) & (x < boxes[after, 3])
+        same = classes[after + 1] == classes[before + 1]
+        border[rows[inside & same], cols[inside & same]] = True
+
+    tile = classes[inner + 1]
+    tile[border] = 0
+    return tile
+
+def nearestIndices(size, size_rescaled):
+    """
+    Indices of the samples of a nearest neighbour rescaling of size elements to size_rescaled (same of Qt).
+    """
+    step = int(size * 65536 / size_rescaled)
+    indices = (step // 2 + np.arange(size_rescaled, dtype=np.int64) * step) >> 16
+    return np.minimum(indices, size - 1)
+
+def readRGBWindow(src, window):
+    """
+    Read a window of an opened raster as a 3 x H x W uint8 RGB array.
+    """
+    if src.count >= 3:
+        data = src.read([1, 2, 3], window=window)
+    else:
+        band = src.read(1, window=window)
+        try:
+            colormap = src.colormap(1)
+            lut = np.zeros((max(256, max(colormap.keys()) + 1), 3), dtype=np.uint8)
+            for index, color in colormap.items():
+                lut[index] = color[:3]
+            data = lut[band].transpose(2, 0, 1)
+        except ValueError:
+            data = np.stack([band, band, band])
+
+    if data.dtype == np.uint16:
+        data = data >> 8
+    return data.astype(np.uint8)
+
+def jointPieces(pieces):
+    """
+    Paint the masks of the pieces (top, left, mask, ...) of a region. It returns the mask and its top, left position.
+    """
+    top = min(piece[0] for piece in pieces)
+    left = min(piece[1] for piece in pieces)
+    bottom = max(piece[0] + piece[2].shape[0] for piece in pieces)
+    right = max(piece[1] + piece[2].shape[1] for piece in pieces)
+
+    mask = np.zeros((bottom - top, right - left), dtype=np.uint8)
+    for piece in pieces:
+        (h, w) = piece[2].shape
+        mask[piece[0] - top:piece[0] - top + h, piece[1] - left:piece[1] - left + w] |= piece[2].astype(np.uint8)
+
+    return (mask, top, left)
+
+def rescaleMap(img, scale):
+    """
+    Rescale a map (H x W x 3 or H x W, uint8) by the scale factors of the X and Y axis using the Qt sampling.
+    """
+    w_rescaled = round(img.shape[1] * scale[0])
+    h_rescaled = round(img.shape[0] * scale[1])
+    if w_rescaled == img.shape[1] and h_rescaled == img.shape[0]:
+        return img
+
+    if img.ndim == 2:
+        rgb = np.repeat(img[:, :, np.newaxis], 3, axis=2)
+        return rescaleMap(rgb, scale)[:, :, 0]
+
+    qimg = utils.rgbToQImage(img)
+    qimg = qimg.scaled(w_rescaled, h_rescaled, Qt.IgnoreAspectRatio, Qt.FastTransformation)
+    return utils.qimageToNumpyArray(qimg)
+
 def updateProgressBar(progress_bar, prefix_message, num_iter, total_iter):
     """
     Update progress bar according to the number of iterations done.
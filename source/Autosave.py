@@ -0,0 +1,212 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from source.Blob import Blob
+from source.Annotation import Annotation
+from source.Shape import Shape
+from source.Genet import Genet
+from source.Project import ProjectEncoder
+from source import ProjectStorage
+
+
+class BlobSnapshot(object):
+    """
+    Immutable copy of the attributes of a blob that are saved in the project (the Qt objects are not copied).
+    The dictionary of the blob is created on demand, by the autosave worker, and it is kept for the next autosave.
+    """
+
+    def __init__(self, blob):
+
+        self.source_contour = blob.contour
+        self.source_inner_contours = list(blob.inner_contours)
+
+        self.id = blob.id
+        self.class_name = blob.class_name
+        self.instance_name = blob.instance_name
+        self.blob_name = blob.blob_name
+        self.note = blob.note
+        self.confidence = blob.confidence
+        self.data = blob.data.copy()
+        self.area = blob.area
+        self.perimeter = blob.perimeter
+        self.bbox = np.array(blob.bbox)
+        self.centroid = np.array(blob.centroid)
+
+        self.contour = self.readOnly(blob.contour)
+        self.inner_contours = [self.readOnly(inner_contour) for inner_contour in blob.inner_contours]
+
+        self.dict = None
+
+    def readOnly(self, array):
+        array = np.array(array)
+        array.setflags(write=False)
+        return array
+
+    def matches(self, blob):
+        """
+        It returns True if the blob has not been changed since this snapshot has been taken.
+        """
+        if blob.contour is not self.source_contour or len(blob.inner_contours) != len(self.source_inner_contours):
+            return False
+
+        for (inner_contour, source) in zip(blob.inner_contours, self.source_inner_contours):
+            if inner_contour is not source:
+                return False
+
+        return (self.id == blob.id and self.class_name == blob.class_name and
+                self.instance_name == blob.instance_name and self.blob_name == blob.blob_name and
+                self.note == blob.note and self.confidence == blob.confidence and self.data == blob.data and
+                self.area == blob.area and self.perimeter == blob.perimeter and
+                np.array_equal(self.bbox, blob.bbox) and np.array_equal(self.centroid, blob.centroid))
+
+    # the same serialization of the blobs
+    toPoints = Blob.toPoints
+
+    def save(self):
+        if self.dict is None:
+            self.dict = Blob.toDict(self)
+        return self.dict
+
+
+class SnapshotEncoder(ProjectEncoder):
+
+    def default(self, obj):
+        if isinstance(obj, BlobSnapshot):
+            return obj.save()
+        return ProjectEncoder.default(self, obj)
+
+
+class Autosave(QObject):
+    """
+    Background autosave. The project is copied on the GUI thread in a snapshot that does not share any mutable
+    object with the project (only the changed blobs are copied, see BlobSnapshot), then the snapshot is
+    serialized and written by a worker thread. A new autosave is skipped if the previous one is still running.
+    """
+
+    started = pyqtSignal(str)
+    skipped = pyqtSignal(str)
+    finished = pyqtSignal(str, float)
+    failed = pyqtSignal(str)
+
+    # emitted by the worker thread, it is delivered to the GUI thread
+    completed = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(Autosave, self).__init__(parent)
+
+        self.completed.connect(self.onCompleted)
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.future = None
+        self.encoder = ProjectEncoder()
+        self.snapshots = {}          # blob -> BlobSnapshot of the last autosave
+
+    def isRunning(self):
+        return self.future is not None and not self.future.done()
+
+    def save(self, project, filename):
+        """
+        It starts the autosave of the project. It returns False if the previous autosave has not finished yet.
+        """
+        if self.isRunning():
+            self.skipped.emit(filename)
+            return False
+
+        binary = ProjectStorage.isBinaryProject(filename)
+        key = os.path.abspath(filename)
+
+        start = time.perf_counter()
+        snapshots = {}
+        layers = []
+        data = self.snapshot(project.__dict__, snapshots, layers if binary else None)
+        del data["saved_layers"]
+        self.snapshots = snapshots
+        elapsed = time.perf_counter() - start
+
+        if binary:
+            saved = dict(project.saved_layers.get(key, {}))
+            self.future = self.executor.submit(self.writeBinary, filename, data, layers, saved)
+        else:
+            self.future = self.executor.submit(self.writeJson, filename, data)
+
+        self.future.add_done_callback(lambda future: self.completed.emit((future, project, key, filename, elapsed)))
+        self.started.emit(filename)
+        return True
+
+    def wait(self):
+        if self.future is not None:
+            self.future.exception()
+
+    def snapshot(self, obj, snapshots, layers):
+        """
+        It copies the containers and converts the project objects to their saved form, the blobs are replaced by
+        their snapshots (reusing the ones of the previous autosave for the blobs not changed).
+        """
+        if isinstance(obj, Blob):
+            snapshot = self.snapshots.get(obj)
+            if snapshot is None or not snapshot.matches(obj):
+                snapshot = BlobSnapshot(obj)
+            snapshots[obj] = snapshot
+            return snapshot
+
+        if isinstance(obj, Annotation):
+            if layers is None:
+                return self.snapshot(obj.save(), snapshots, layers)
+
+            # the records of a layer never used are not changed until the layer is hydrated, they are
+            # converted by the worker (see ProjectStorage.layerToColumns)
+            data = self.snapshot(obj.save(blobs=False), snapshots, layers)
+            blobs = obj.pendingBlobs()
+            if blobs is None:
+                blobs = self.snapshot(obj.seg_blobs, snapshots, layers)
+            name = ProjectStorage.layerFilename(obj)
+            layers.append((name, obj.revision, blobs))
+            data["seg_blobs_file"] = name
+            return data
+
+        if isinstance(obj, dict):
+            return {key: self.snapshot(value, snapshots, layers) for key, value in obj.items()}
+
+        if isinstance(obj, (list, tuple)):
+            return [self.snapshot(value, snapshots, layers) for value in obj]
+
+        # the shapes cannot be edited, they are serialized by the worker
+        if obj is None or isinstance(obj, (str, int, float, bool, Shape)):
+            return obj
+
+        if isinstance(obj, Genet):
+            return {}
+
+        return self.snapshot(self.encoder.default(obj), snapshots, layers)
+
+    def writeJson(self, filename, data):
+
+        text = json.dumps(data, cls=SnapshotEncoder, indent=1)
+        ProjectStorage.replaceFile(filename, lambda f: f.write(text.encode("utf-8")))
+        return None
+
+    def writeBinary(self, filename, data, layers, saved):
+
+        manifest = json.dumps(data, cls=SnapshotEncoder, indent=1)
+        return ProjectStorage.saveBinaryProject(filename, manifest, layers, saved)
+
+    def onCompleted(self, result):
+
+        (future, project, key, filename, elapsed) = result
+
+        exception = future.exception()
+        if exception is not None:
+            self.failed.emit(filename + ": " + str(exception))
+            return
+
+        states = future.result()
+        if states is not None:
+            project.saved_layers[key] = states
+
+        self.finished.emit(filename, elapsed)
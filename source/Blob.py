@@ -19,23 +19,339 @@
 
 import math
 import copy
+import zlib
 import numpy as np
 
 from skimage import measure
 from scipy import ndimage as ndi
 from PyQt5.QtGui import QPainterPath, QPolygonF
-from PyQt5.QtCore import QPointF
 
 from skimage.morphology import square, binary_dilation, binary_erosion
 from skimage.measure import points_in_poly
 
-from cv2 import fillPoly
+from cv2 import fillPoly, approxPolyDP
 
 import source.Mask as Mask
 from source import utils
+from source.MaskCache import MaskCache
 
 import time
 
+# backend used to extract the contours from the blob masks:
+#   "fast"    -> a single marching squares pass, the holes are derived from the outer level
+#   "skimage" -> two marching squares passes, one for the outer contour and one for the holes
+CONTOUR_BACKEND = "fast"
+
+# masks of the blobs of the project, bit-packed, with a LRU memory budget (see Blob.getMask)
+mask_cache = MaskCache()
+
+# the outer contour is extracted at level 0.6, the holes at level 0.4
+OUTER_LEVEL = 0.6
+INNER_LEVEL = 0.4
+
+# min number of points in a small hole
+HOLE_THRESHOLD = 20
+
+# segments shorter than this are simplified without numpy
+SHORT_SEGMENT = 16
+
+# tolerance (in pixels) of the simplified contours of the level of detail 1, it doubles at each level
+LOD_TOLERANCE = 0.5
+LOD_LEVELS = 8
+
+
+def contoursOffsets(contours):
+    """
+    It stacks a list of contours in a single array, it returns the points and the index of the first point of each contour.
+    """
+    lengths = np.array([contour.shape[0] for contour in contours], dtype=np.int64)
+    starts = np.zeros(len(contours), dtype=np.int64)
+    starts[1:] = np.cumsum(lengths)[:-1]
+    points = np.concatenate(contours).astype(np.float64)
+    return points, starts, lengths
+
+def nextPoints(points, starts, lengths):
+    """
+    It returns, for each point, the following point of its (closed) contour.
+    """
+    index = np.arange(1, points.shape[0] + 1)
+    index[starts + lengths - 1] = starts
+    return points[index]
+
+def contoursPerimeter(contours):
+    """
+    It returns the perimeters of a list of closed contours, computed in a single vectorized pass.
+    """
+    if len(contours) == 0:
+        return np.zeros(0)
+
+    points, starts, lengths = contoursOffsets(contours)
+    delta = nextPoints(points, starts, lengths) - points
+    segments = np.sqrt(delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1])
+    return np.add.reduceat(segments, starts)
+
+def blobsPerimeters(blobs):
+    """
+    It returns the perimeters of a list of blobs (outer and inner contours), computed in a single pass over
+    the contours of all the blobs.
+    """
+    contours = []
+    counts = np.zeros(len(blobs), dtype=np.int64)
+    for i, blob in enumerate(blobs):
+        contours.append(blob.contour)
+        contours.extend(blob.inner_contours)
+        counts[i] = 1 + len(blob.inner_contours)
+
+    if len(contours) == 0:
+        return np.zeros(0)
+
+    starts = np.zeros(len(blobs), dtype=np.int64)
+    starts[1:] = np.cumsum(counts)[:-1]
+    return np.add.reduceat(contoursPerimeter(contours), starts)
+
+def labelsMoments(labels, num_labels, strip_height=1024):
+    """
+    It returns the areas (number of pixels) and the sums of the x and of the y coordinates of the pixels of the
+    regions of a labelled image, indexed by label. The image is scanned by strips of rows to bound the memory used.
+    """
+    (h, w) = labels.shape
+    areas = np.zeros(num_labels + 1)
+    sum_x = np.zeros(num_labels + 1)
+    sum_y = np.zeros(num_labels + 1)
+    cols = np.arange(w, dtype=np.float64)
+    for top in range(0, h, strip_height):
+        strip = labels[top:top + strip_height].ravel()
+        rows = np.arange(top, min(top + strip_height, h), dtype=np.float64)
+        areas += np.bincount(strip, minlength=num_labels + 1)
+        sum_x += np.bincount(strip, weights=np.tile(cols, rows.shape[0]), minlength=num_labels + 1)
+        sum_y += np.bincount(strip, weights=np.repeat(rows, w), minlength=num_labels + 1)
+    return areas, sum_x, sum_y
+
+def maskGeometry(mask):
+    """
+    It returns the area (number of pixels) and the centroid (x, y) of a mask, in mask coordinates.
+    """
+    mask = mask != 0
+    rows = np.count_nonzero(mask, axis=1)
+    cols = np.count_nonzero(mask, axis=0)
+    area = rows.sum()
+    cx = np.dot(cols, np.arange(cols.shape[0], dtype=np.float64)) / area
+    cy = np.dot(rows, np.arange(rows.shape[0], dtype=np.float64)) / area
+    return float(area), cx, cy
+
+def largestContour(contours):
+    """
+    It returns the index of the contour with the largest bounding box (area).
+    """
+    max_area = 0
+    longest = 0
+    for i, contour in enumerate(contours):
+        cbox = Mask.pointsBox(contour, 0)
+        area = cbox[2]*cbox[3]
+        if area > max_area:
+            max_area = area
+            longest = i
+    return longest
+
+def changeContourLevel(contour):
+    """
+    It converts a contour of a binary mask extracted at OUTER_LEVEL into the same contour at INNER_LEVEL.
+    Each vertex lies on a pixel edge between a 0 and a 1, at a distance of level from the 0 pixel,
+    so only the fractional coordinate changes: base + 0.6 becomes base + 0.4 and vice versa.
+    """
+    base = np.floor(contour)
+    fraction = contour - base
+
+    # the same expression used by marching squares, to obtain exactly the same values
+    towards_one = (INNER_LEVEL - 0.0) / (1.0 - 0.0)
+    towards_zero = (INNER_LEVEL - 1.0) / (0.0 - 1.0)
+
+    result = contour.copy()
+    high = fraction > 0.5
+    low = (fraction > 0.0) & ~high
+    result[high] = base[high] + towards_one
+    result[low] = base[low] + towards_zero
+    return result
+
+def approximatePolygon(coords, tolerance):
+    """
+    Douglas-Peucker simplification, it gives the same result of skimage.measure.approximate_polygon.
+    The marching squares contours split into many tiny segments, so the segments without inner points
+    are skipped and the short ones are processed without numpy, avoiding its per-call overhead.
+    """
+    n = coords.shape[0]
+    chain = np.zeros(n, 'bool')
+    chain[0] = True
+    chain[-1] = True
+    dists = np.zeros(n)
+    points = coords.tolist()
+
+    pos_stack = [(0, n - 1)]
+    while len(pos_stack) > 0:
+        start, end = pos_stack.pop()
+        if end - start < 2:
+            continue
+
+        r0, c0 = points[start]
+        r1, c1 = points[end]
+        dr = r1 - r0
+        dc = c1 - c0
+        segment_angle = -np.arctan2(dr, dc)
+        sin_angle = float(np.sin(segment_angle))
+        cos_angle = float(np.cos(segment_angle))
+        segment_dist = c0 * sin_angle + r0 * cos_angle
+
+        if end - start <= SHORT_SEGMENT:
+            max_dist = -1.0
+            new_end = start
+            for i in range(start + 1, end):
+                r, c = points[i]
+                dr0 = r - r0
+                dc0 = c - c0
+                dr1 = r - r1
+                dc1 = c - c1
+                # perpendicular distance if the point projects inside the segment, otherwise euclidean distance
+                if dr0 * dr + dc0 * dc > 0 and -dr1 * dr - dc1 * dc > 0:
+                    dist = abs(r * cos_angle + c * sin_angle - segment_dist)
+                else:
+                    dist = min(math.sqrt(dc0 * dc0 + dr0 * dr0), math.sqrt(dc1 * dc1 + dr1 * dr1))
+                if dist > max_dist:
+                    max_dist = dist
+                    new_end = i
+            split = max_dist > tolerance
+        else:
+            segment_coords = coords[start + 1: end, :]
+            segment_dists = dists[start + 1: end]
+            dr0 = segment_coords[:, 0] - r0
+            dc0 = segment_coords[:, 1] - c0
+            dr1 = segment_coords[:, 0] - r1
+            dc1 = segment_coords[:, 1] - c1
+            perp = np.logical_and(dr0 * dr + dc0 * dc > 0, -dr1 * dr - dc1 * dc > 0)
+            eucl = np.logical_not(perp)
+            segment_dists[perp] = np.abs(segment_coords[perp, 0] * cos_angle + segment_coords[perp, 1] * sin_angle - segment_dist)
+            segment_dists[eucl] = np.minimum(np.sqrt(dc0[eucl] ** 2 + dr0[eucl] ** 2), np.sqrt(dc1[eucl] ** 2 + dr1[eucl] ** 2))
+            split = np.any(segment_dists > tolerance)
+            new_end = start + int(np.argmax(segment_dists)) + 1
+
+        if split:
+            pos_stack.append((new_end, end))
+            pos_stack.append((start, new_end))
+            chain[new_end] = True
+
+    return coords[chain, :]
+
+def isBinary(mask):
+
+    if mask.dtype == bool:
+        return True
+    return bool(np.all((mask == 0) | (mask == 1)))
+
+def findContours(img_padded, backend=None):
+    """
+    It extracts the outer contour and the inner contours (holes) of a padded mask, in (row, col) coordinates.
+    It returns the pair (outer contour, list of inner contours).
+    """
+    if backend is None:
+        backend = CONTOUR_BACKEND
+
+    contours = measure.find_contours(img_padded, OUTER_LEVEL)
+    number_of_contours = len(contours)
+
+    if number_of_contours == 0:
+        raise Exception("Empty contour")
+
+    if number_of_contours == 1:
+        if backend == "fast":
+            coords = approximatePolygon(contours[0], tolerance=0.2)
+        else:
+            coords = measure.approximate_polygon(contours[0], tolerance=0.2)
+        return (coords, [])
+
+    # the contours of a binary mask have the same topology at every level between 0 and 1,
+    # hence the inner contours can be obtained without running marching squares again
+    if backend == "fast" and isBinary(img_padded):
+        inner_contours = [changeContourLevel(contour) for contour in contours]
+    else:
+        inner_contours = measure.find_contours(img_padded, INNER_LEVEL)
+
+    # divide the contours in OUTER contour and INNER contours
+    outer = contours[largestContour(contours)]
+
+    inner_longest = largestContour(inner_contours)
+    holes = [contour for i, contour in enumerate(inner_contours) if i != inner_longest and contour.shape[0] > HOLE_THRESHOLD]
+
+    return (outer, holes)
+
+def levelOfDetail(scale):
+    """
+    It returns the level of detail of the contours drawn with the given scale (screen pixels per map pixel).
+    Level 0 is the full resolution, at level k > 0 the contours are simplified with a tolerance of
+    LOD_TOLERANCE * 2^(k-1) map pixels, that is always less than LOD_TOLERANCE screen pixels.
+    """
+    if scale >= 1.0:
+        return 0
+    if scale <= 0.0:
+        return LOD_LEVELS
+    return min(int(math.floor(math.log2(1.0 / scale))) + 1, LOD_LEVELS)
+
+def toQPolygonF(points, offset=0.0):
+    """
+    It creates a QPolygonF from a (N x 2) array of points, the coordinates are copied directly in its buffer.
+    """
+    n = points.shape[0]
+    polygon = QPolygonF(n)
+    if n > 0:
+        buffer = polygon.data()
+        buffer.setsize(n * 2 * 8)
+        np.frombuffer(buffer, dtype=np.float64).reshape(n, 2)[:] = points + offset
+    return polygon
+
+def contoursToPath(contour, inner_contours):
+    """
+    It creates the QPainterPath of the given contours. The holes are added as subpaths and they are left
+    empty by the odd-even fill rule of the path (much faster than subtracting them).
+    """
+    # working with mask the center of the pixels is in 0, 0
+    # if drawing the center of the pixel is 0.5, 0.5
+    path = QPainterPath()
+    path.addPolygon(toQPolygonF(contour, 0.5))
+    path.closeSubpath()
+    for inner_contour in inner_contours:
+        path.addPolygon(toQPolygonF(inner_contour, 0.5))
+        path.closeSubpath()
+    return path
+
+def simplifyContour(contour, tolerance):
+    """
+    Douglas-Peucker simplification of a closed contour (computed by OpenCV, it is only used for drawing).
+    """
+    points = np.ascontiguousarray(contour, dtype=np.float32).reshape(-1, 1, 2)
+    return approxPolyDP(points, tolerance, True).reshape(-1, 2)
+
+def simplifiedContours(contour, inner_contours, tolerance):
+    """
+    It simplifies the contours of a blob with the given tolerance, the holes smaller than the tolerance are removed.
+    """
+    if contour.shape[0] > 3:
+        contour = simplifyContour(contour, tolerance)
+
+    holes = []
+    for inner_contour in inner_contours:
+        if inner_contour.shape[0] > 3 and np.ptp(inner_contour, axis=0).max() > tolerance:
+            holes.append(simplifyContour(inner_contour, tolerance))
+
+    return (contour, holes)
+
+def toMapCoordinates(contour, padding, bbox):
+    """
+    It converts a contour from the (row, col) coordinates of the padded mask to the (x, y) coordinates of the map.
+    """
+    points = contour[:, ::-1] - padding
+    points[:, 0] += bbox[1]
+    points[:, 1] += bbox[0]
+    return points
+
+
 class Blob(object):
     """
     Blob data. A blob is a group of pixels.
@@ -43,7 +359,12 @@ class Blob(object):
     It is stored as an outer contour (the border) plus a list of inner contours (holes).
     """
 
-    def __init__(self, region, offset_x, offset_y, id):
+    def __init__(self, region, offset_x, offset_y, id, geometry=True):
+        """
+        The blob of a region (see skimage.measure.regionprops) placed at the given offset. If geometry is False
+        only the contours are created, the area, the centroid and the perimeter are left to the caller
+        (see Annotation.blobsFromLabelImage).
+        """
         self.version = 0
         self.id = int(id)
         self.id_item = None
@@ -68,15 +389,18 @@ class Blob(object):
         self.inner_contours = []
         self.qpath = None
         self.qpath_gitem = None
+        # simplified paths of the blob, level of detail -> QPainterPath (see lodPath)
+        self.lod_paths = {}
 
 
         if region:
 
             # extract properties
 
-            self.centroid = np.array(region.centroid)
-            self.centroid[0] += offset_x
-            self.centroid[1] += offset_y
+            if geometry:
+                self.centroid = np.array(region.centroid)
+                self.centroid[0] += offset_x
+                self.centroid[1] += offset_y
 
             # Bounding box (min_row, min_col, max_row, max_col).
             # Pixels belonging to the bounding box are in the half-open
@@ -96,7 +420,7 @@ class Blob(object):
             input_mask = region.image.astype(int)
             self.contour = np.zeros((2, 2))
             self.inner_contours = []
-            self.updateUsingMask(self.bbox, input_mask)
+            self.updateUsingMask(self.bbox, input_mask, geometry)
 
             # a string with a progressive number to identify the instance
             self.instance_name = "coral" + str(id)
@@ -136,6 +460,7 @@ class Blob(object):
 
         blob.qpath_gitem = None
         blob.qpath = None
+        blob.lod_paths = {}
 
         return blob
 
@@ -146,9 +471,11 @@ class Blob(object):
         #save and later restore qobjects
         path = self.qpath
         pathitem = self.qpath_gitem
+        lod_paths = self.lod_paths
         #no deep copy for qobjects
         self.qpath = None
         self.qpath_gitem = None
+        self.lod_paths = {}
 
         blob = copy.deepcopy(self)
         blob.contour = self.contour.copy()
@@ -160,6 +487,7 @@ class Blob(object):
         blob.qpath_gitem = None
         self.qpath = path
         self.qpath_gitem = pathitem
+        self.lod_paths = lod_paths
         #restore deepcopy (also to the newly created Blob!
         blob.__deepcopy__ = self.__deepcopy__ = deepcopy_method
         return blob
@@ -171,11 +499,30 @@ class Blob(object):
         self.id = id
         self.blob_name = "c-{:d}-{:.1f}x-{:.1f}y".format(self.id, xc, yc)
 
+    def maskSignature(self):
+        """
+        It returns the signature of the geometry of the blob, used to recognize the stale cached masks.
+        """
+        crc = zlib.crc32(np.ascontiguousarray(self.contour).tobytes())
+        for inner_contour in self.inner_contours:
+            crc = zlib.crc32(np.ascontiguousarray(inner_contour).tobytes(), crc)
+        bbox = tuple([int(value) for value in self.bbox])
+        return (self.version, bbox, len(self.inner_contours), crc)
+
+    def invalidateMask(self):
+        mask_cache.remove(id(self))
+
     def getMask(self):
         """
         It creates the mask from the contour and returns it.
+        The mask is cached (see MaskCache), the returned mask is always a new array.
         """
 
+        signature = self.maskSignature()
+        mask = mask_cache.get(id(self), signature)
+        if mask is not None:
+            return mask
+
         r = self.bbox[3]
         c = self.bbox[2]
         origin = np.array([int(self.bbox[1]), int(self.bbox[0])])
@@ -189,14 +536,17 @@ class Blob(object):
             points = inner_contour.round().astype(int)
             fillPoly(mask, pts=[points - origin], color=(0, 0, 0))
 
+        mask_cache.put(id(self), signature, mask)
+
         return mask
 
 
-    def updateUsingMask(self, bbox, mask):
+    def updateUsingMask(self, bbox, mask, geometry=True):
         self.createContourFromMask(mask, bbox)
-        self.calculatePerimeter()
-        self.calculateCentroid(mask, bbox)
-        self.calculateArea(mask)
+        if geometry:
+            self.calculatePerimeter()
+            self.calculateCentroid(mask, bbox)
+            self.calculateArea(mask)
         self.bbox = Mask.pointsBox(self.contour,4)
 
     def createFromClosedCurve(self, lines, erode = True):
@@ -230,6 +580,7 @@ class Blob(object):
 
         # NOTE: The mask is expected to be cropped around its bbox (!!) (see the __init__)
 
+        self.invalidateMask()
         self.inner_contours.clear()
 
         # we need to pad the mask to avoid to break the contour that touches the borders
@@ -237,73 +588,14 @@ class Blob(object):
 
         img_padded = np.pad(mask, (PADDED_SIZE, PADDED_SIZE), mode="constant", constant_values=(0, 0))
 
-        contours = measure.find_contours(img_padded, 0.6)
-        inner_contours = measure.find_contours(img_padded, 0.4)
-        number_of_contours = len(contours)
-
-        threshold = 20 #min number of points in a small hole
-
-        if number_of_contours > 1:
-
-            # search the contour with the largest bounding box (area)
-            max_area = 0
-            longest = 0
-            for i, contour in enumerate(contours):
-                cbox = Mask.pointsBox(contour, 0)
-                area = cbox[2]*cbox[3]
-                if area > max_area:
-                    max_area = area
-                    longest = i
-
-            max_area = 0
-            inner_longest = 0
-            for i, contour in enumerate(inner_contours):
-                cbox = Mask.pointsBox(contour, 0)
-                area = cbox[2]*cbox[3]
-                if area > max_area:
-                    max_area = area
-                    inner_longest = i
-
-            # divide the contours in OUTER contour and INNER contours
-            for i, contour in enumerate(contours):
-                if i == longest:
-                    self.contour = np.array(contour)
-
-            for i, contour in enumerate(inner_contours):
-                if i != inner_longest:
-                    if contour.shape[0] > threshold:
-                        coordinates = np.array(contour)
-                        self.inner_contours.append(coordinates)
-
-            # adjust the coordinates of the outer contour
-            # (NOTE THAT THE COORDINATES OF THE BBOX ARE IN THE GLOBAL MAP COORDINATES SYSTEM)
-            for i in range(self.contour.shape[0]):
-                ycoor = self.contour[i, 0]
-                xcoor = self.contour[i, 1]
-                self.contour[i, 0] = xcoor - PADDED_SIZE + bbox[1]
-                self.contour[i, 1] = ycoor - PADDED_SIZE + bbox[0]
-
-            # adjust coordinates of the INNER contours
-            for j, contour in enumerate(self.inner_contours):
-                for i in range(contour.shape[0]):
-                    ycoor = contour[i, 0]
-                    xcoor = contour[i, 1]
-                    self.inner_contours[j][i, 0] = xcoor - PADDED_SIZE + bbox[1]
-                    self.inner_contours[j][i, 1] = ycoor - PADDED_SIZE + bbox[0]
-        elif number_of_contours == 1:
+        (contour, inner_contours) = findContours(img_padded)
+
+        # adjust the coordinates of the outer and of the INNER contours
+        # (NOTE THAT THE COORDINATES OF THE BBOX ARE IN THE GLOBAL MAP COORDINATES SYSTEM)
+        self.contour = toMapCoordinates(contour, PADDED_SIZE, bbox)
+        for inner_contour in inner_contours:
+            self.inner_contours.append(toMapCoordinates(inner_contour, PADDED_SIZE, bbox))
 
-            coords = measure.approximate_polygon(contours[0], tolerance=0.2)
-            self.contour = np.array(coords)
-
-            # adjust the coordinates of the outer contour
-            # (NOTE THAT THE COORDINATES OF THE BBOX ARE IN THE GLOBAL MAP COORDINATES SYSTEM)
-            for i in range(self.contour.shape[0]):
-                ycoor = self.contour[i, 0]
-                xcoor = self.contour[i, 1]
-                self.contour[i, 0] = xcoor - PADDED_SIZE + bbox[1]
-                self.contour[i, 1] = ycoor - PADDED_SIZE + bbox[0]
-        else:
-            raise Exception("Empty contour")
         #TODO optimize the bbox
         self.bbox = bbox
 
@@ -379,72 +671,46 @@ class Blob(object):
 
     def setupForDrawing(self):
         """
-        Create the QPolygon and the QPainterPath according to the blob's contours.
+        Create the QPainterPath according to the blob's contours.
         """
+        self.qpath = contoursToPath(self.contour, self.inner_contours)
+        self.lod_paths = {}
 
-        # QPolygon to draw the blob
-        #working with mask the center of the pixels is in 0, 0
-        #if drawing the center of the pixel is 0.5, 0.5
-        qpolygon = QPolygonF()
-        for i in range(self.contour.shape[0]):
-            qpolygon << QPointF(self.contour[i, 0] + 0.5, self.contour[i, 1] + 0.5)
-
-        self.qpath = QPainterPath()
-        self.qpath.addPolygon(qpolygon)
-
-        for inner_contour in self.inner_contours:
-            qpoly_inner = QPolygonF()
-            for i in range(inner_contour.shape[0]):
-                qpoly_inner << QPointF(inner_contour[i, 0] + 0.5, inner_contour[i, 1] + 0.5)
+    def lodPath(self, level):
+        """
+        It returns the QPainterPath of the blob at the given level of detail (see levelOfDetail).
+        The simplified paths are created when needed and cached until the blob is set up again for drawing.
+        """
+        if level == 0 or self.qpath is None:
+            return self.qpath
 
-            path_inner = QPainterPath()
-            path_inner.addPolygon(qpoly_inner)
-            self.qpath = self.qpath.subtracted(path_inner)
+        path = self.lod_paths.get(level)
+        if path is None:
+            tolerance = LOD_TOLERANCE * (1 << (level - 1))
+            (contour, inner_contours) = simplifiedContours(self.contour, self.inner_contours, tolerance)
+            path = contoursToPath(contour, inner_contours)
+            self.lod_paths[level] = path
+        return path
 
     #bbox is used to place the mask!
     def calculateCentroid(self, mask, bbox):
-        m = measure.moments(mask)
-        c = np.array((m[0, 1] / m[0, 0], m[1, 0] / m[0, 0]))
+        (area, cx, cy) = maskGeometry(mask)
+
+        #centroid is (x, y) while the mask is (y, x) and bbox is yx
+        self.setCentroid(cx + bbox[1], cy + bbox[0])
 
-        #centroid is (x, y) while measure returns (y,x and bbox is yx)
-        self.centroid  = np.array((c[0] + bbox[1], c[1]+ bbox[0]))
+    def setCentroid(self, x, y):
+        self.centroid  = np.array((x, y))
         self.blob_name = "c-{:d}-{:.1f}x-{:.1f}y".format(self.id, self.centroid[0], self.centroid[1])
 
     def calculateContourPerimeter(self, contour):
-
-        #self.perimeter = measure.perimeter(mask) instead?
-
-
-        # perimeter of the outer contour
-        px1 = contour[0, 0]
-        py1 = contour[0, 1]
-        N = contour.shape[0]
-        pxlast = contour[N-1, 0]
-        pylast = contour[N-1, 1]
-        perim = math.sqrt((px1-pxlast)*(px1-pxlast) + (py1-pylast)*(py1-pylast))
-        for i in range(1, contour.shape[0]):
-            px2 = contour[i, 0]
-            py2 = contour[i, 1]
-
-            d = math.sqrt((px1 - px2)*(px1-px2) + (py1-py2)*(py1-py2))
-            perim += d
-
-            px1 = px2
-            py1 = py2
-
-        return perim
+        return float(contoursPerimeter([contour])[0])
 
     def calculatePerimeter(self):
-        #tole = 2
-        #simplified = measure.approximate_polygon(self.contour, tolerance=tole)
-        self.perimeter = self.calculateContourPerimeter(self.contour)
-
-        for contour in self.inner_contours:
-            #simplified = measure.approximate_polygon(contour, tolerance=tole)
-            self.perimeter += self.calculateContourPerimeter(contour)
+        self.perimeter = float(blobsPerimeters([self])[0])
 
     def calculateArea(self, mask):
-        self.area = mask.sum().astype(float)
+        self.area = float(np.count_nonzero(mask))
 
 
 
@@ -500,8 +766,7 @@ class Blob(object):
     def toContour(self, p):
 
         if type(p) is str:
-            p = map(int, p.split(' '))
-            c = np.fromiter(p, dtype=int)
+            c = np.fromstring(p, dtype=int, sep=' ')
         else:
             c = np.asarray(p)
 
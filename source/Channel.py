@@ -21,6 +21,7 @@ from PyQt5.QtGui import QImage
 from PyQt5.QtGui import QImageReader
 import rasterio as rio
 from source import utils
+from source.TilePyramid import TilePyramid, imageSize, TILED_IMAGE_MIN_PIXELS
 import numpy as np
 
 class Channel(object):
@@ -31,13 +32,40 @@ class Channel(object):
         self.qimage = None            # cached QImage (to speed up visualization)
         self.float_map = None         # map of 32-bit floating point (e.g. to store high precision depth values)
         self.nodata = None            # invalid value
+        self.pyramid = None           # tiled pyramid, used to visualize the very large RGB images
+
+    def isTiled(self):
+        """
+        It returns True if the channel is big enough to be visualized as a tiled pyramid.
+        """
+        if self.type != "RGB":
+            return False
+
+        size = imageSize(self.filename)
+        return size is not None and size[0] * size[1] >= TILED_IMAGE_MIN_PIXELS
+
+    def loadPyramid(self, logfile=None):
+        """
+        Open the tiled pyramid of the image, it is built (and stored next to the image) the first time.
+        It returns None if the image cannot be read.
+        """
+        if self.pyramid is None:
+            pyramid = TilePyramid(self.filename)
+            if pyramid.load(logfile):
+                self.pyramid = pyramid
+
+        return self.pyramid
 
     def loadData(self):
         """
         Load the image data. The QImage is cached to speed up visualization.
         """
 
-        if self.type == "RGB":
+        # the full resolution level of the pyramid does not need to be decoded
+        if self.type == "RGB" and self.pyramid is not None:
+            self.qimage = self.pyramid.toQImage()
+
+        elif self.type == "RGB":
             reader = QImageReader(self.filename)
             self.qimage = reader.read()
             if self.qimage.isNull():
@@ -2,10 +2,25 @@ from source.Blob import Blob
 import numpy as np
 from source.Blob import Blob
 from source.Mask import intersectMask
+import source.Mask as Mask
+from source.SpatialIndex import SpatialIndex
+from collections import Counter
 import pandas as pd
 
 
+COLUMNS = ['Genet', 'Blob1', 'Blob2', 'Area1', 'Area2', 'Class', 'Action', 'Split\Fuse']
+
+# type of the numpy array of each column
+COLUMN_TYPES = {'Genet': np.int64, 'Blob1': np.int64, 'Blob2': np.int64, 'Area1': np.float64, 'Area2': np.float64,
+                'Class': object, 'Action': object, 'Split\Fuse': object}
+
+
 class Correspondences(object):
+    """
+    Table of the correspondences between the blobs of two annotated images.
+    The table is stored by columns (numpy arrays, see COLUMNS), the blob ids are indexed to find their rows.
+    The DataFrame (data) is created only when it is requested, i.e. by the table of the UI and for the export.
+    """
 
     def __init__(self, img_source, source_annotations, img_target, target_annotations, correspondences = None):
 
@@ -18,7 +33,150 @@ class Correspondences(object):
         self.dead = []
         self.born = []
         self.threshold = 1.05
-        self.data = pd.DataFrame(data = correspondences, columns=['Genet', 'Blob1', 'Blob2', 'Area1', 'Area2', 'Class', 'Action', 'Split\Fuse'])
+
+        self.columns = {}
+        self.version = 0             # incremented at each change of the table
+        self.frame = None            # cached DataFrame of the table
+        self.rows_by_blob1 = None    # blob id -> rows (lazy)
+        self.rows_by_blob2 = None
+        self.setRows(correspondences if correspondences is not None else [])
+
+    # ---- columnar store ----
+
+    def setRows(self, rows):
+        """
+        It replaces the content of the table with a list of rows (lists ordered as COLUMNS).
+        """
+        self.columns = self.rowsToColumns(rows)
+        self.changed()
+
+    def rowsToColumns(self, rows):
+
+        columns = {}
+        for i, name in enumerate(COLUMNS):
+            values = [row[i] for row in rows]
+            if COLUMN_TYPES[name] is object:
+                array = np.empty(len(values), dtype=object)
+                array[:] = values
+            else:
+                array = np.array(values, dtype=COLUMN_TYPES[name]).reshape(-1)
+            columns[name] = array
+        return columns
+
+    def appendRows(self, rows):
+        """
+        It adds many rows (lists ordered as COLUMNS) at once.
+        """
+        if len(rows) == 0:
+            return
+
+        new_columns = self.rowsToColumns(rows)
+        for name in COLUMNS:
+            self.columns[name] = np.concatenate([self.columns[name], new_columns[name]])
+        self.changed()
+
+    def deleteRows(self, rows):
+        """
+        It removes the given rows (a list of positions or a boolean mask).
+        """
+        keep = np.ones(self.rowCount(), dtype=bool)
+        keep[rows] = False
+        self.keepRows(keep)
+
+    def keepRows(self, keep):
+
+        if np.all(keep):
+            return
+        for name in COLUMNS:
+            self.columns[name] = self.columns[name][keep]
+        self.changed()
+
+    def rowCount(self):
+        return self.columns['Blob1'].shape[0]
+
+    def changed(self):
+        """
+        It invalidates the cached DataFrame and the blob index after a change of the table.
+        """
+        self.version += 1
+        self.frame = None
+        self.rows_by_blob1 = None
+        self.rows_by_blob2 = None
+
+    def buildIndex(self, name):
+
+        index = {}
+        for row, id in enumerate(self.columns[name].tolist()):
+            index.setdefault(id, []).append(row)
+        return index
+
+    def rowsOf(self, id, is_source):
+        """
+        It returns the rows where the blob appears (as Blob1 if is_source, as Blob2 otherwise).
+        """
+        if is_source:
+            if self.rows_by_blob1 is None:
+                self.rows_by_blob1 = self.buildIndex('Blob1')
+            return self.rows_by_blob1.get(id, [])
+        else:
+            if self.rows_by_blob2 is None:
+                self.rows_by_blob2 = self.buildIndex('Blob2')
+            return self.rows_by_blob2.get(id, [])
+
+    def setValue(self, row, column, value):
+        """
+        It changes a single value of the table (it is used by the table of the UI).
+        """
+        name = COLUMNS[column]
+        self.columns[name][row] = value
+        if self.frame is not None:
+            self.frame.iloc[row, column] = value
+        if name == 'Blob1' or name == 'Blob2':
+            self.version += 1
+            self.rows_by_blob1 = None
+            self.rows_by_blob2 = None
+
+    def links(self):
+        """
+        It returns the set of the matched pairs (source id, target id), born and dead rows excluded.
+        """
+        blob1 = self.columns['Blob1']
+        blob2 = self.columns['Blob2']
+        matched = (blob1 >= 0) & (blob2 >= 0)
+        return set(zip(blob1[matched].tolist(), blob2[matched].tolist()))
+
+    def rows(self):
+        """
+        It returns the content of the table as a list of rows, with python values.
+        """
+        columns = [self.columns[name].tolist() for name in COLUMNS]
+        return [list(row) for row in zip(*columns)]
+
+    def refreshFrame(self, names):
+        """
+        It copies the given columns into the cached DataFrame (if any), the UI table keeps showing the same object.
+        """
+        if self.frame is not None:
+            for name in names:
+                self.frame[name] = self.columns[name]
+
+    @property
+    def data(self):
+        if self.frame is None:
+            self.frame = pd.DataFrame({name: self.columns[name] for name in COLUMNS}, columns=COLUMNS)
+        return self.frame
+
+    @data.setter
+    def data(self, frame):
+        self.setRows(frame.values.tolist())
+
+    # ---- blobs lookup ----
+
+    def sourceBlobs(self):
+        return [self.source_annotations.blobById(id) for id in self.columns['Blob1'].tolist()]
+
+    def targetBlobs(self):
+        return [self.target_annotations.blobById(id) for id in self.columns['Blob2'].tolist()]
 
     def area_in_sq_cm(self, area, is_source):
 
@@ -31,103 +189,88 @@ class Correspondences(object):
 
     def isGenetInfoAvailable(self):
 
-        if len(self.data.index) < 2:
+        if self.rowCount() < 2:
             return False
 
-        if self.data.loc[1, 'Genet'] >= 0:
+        if self.columns['Genet'][1] >= 0:
             return True
         else:
             return False
 
     def updateGenets(self):
 
-        for index, row in self.data.iterrows():
-            id1 = int(row['Blob1'])
-            id2 = int(row['Blob2'])
-            blob1 = self.source_annotations.blobById(id1)
-            blob2 = self.target_annotations.blobById(id2)
-
+        genet = self.columns['Genet']
+        for row, (blob1, blob2) in enumerate(zip(self.sourceBlobs(), self.targetBlobs())):
             if blob1 is not None:
                 if blob1.genet is not None:
-                    self.data.loc[index, 'Genet'] = blob1.genet
+                    genet[row] = blob1.genet
             else:
                 if blob2.genet is not None:
-                    self.data.loc[index, 'Genet'] = blob2.genet
+                    genet[row] = blob2.genet
+
+        self.refreshFrame(['Genet'])
 
     def updateAreas(self, use_surface_area=False):
 
-        for index, row in self.data.iterrows():
-            id1 = int(row['Blob1'])
-            id2 = int(row['Blob2'])
-            action = row['Action']
-            blob1 = self.source_annotations.blobById(id1)
-            blob2 = self.target_annotations.blobById(id2)
+        blobs1 = self.sourceBlobs()
+        blobs2 = self.targetBlobs()
 
+        for row, (blob1, blob2) in enumerate(zip(blobs1, blobs2)):
             if blob1 is None and blob2 is None:
                 print("BOOM")
+            else:
+                self.columns['Class'][row] = blob1.class_name if blob1 is not None else blob2.class_name
 
-            self.data.loc[index, 'Class'] = blob1.class_name if blob1 is not None else blob2.class_name
+        def pixelAreas(blobs):
+            if use_surface_area:
+                return np.array([blob.surface_area if blob is not None else 0.0 for blob in blobs], dtype=np.float64)
+            return np.array([blob.area if blob is not None else 0.0 for blob in blobs], dtype=np.float64)
 
-            area1 = 0
-            if blob1 is not None:
-                area_pixel = blob1.area
-                if use_surface_area:
-                    area_pixel = blob1.surface_area
-                area1 = self.area_in_sq_cm(area_pixel, True)
-            self.data.loc[index, 'Area1'] = area1
+        area1 = self.area_in_sq_cm(pixelAreas(blobs1), True)
+        area2 = self.area_in_sq_cm(pixelAreas(blobs2), False)
+        self.columns['Area1'] = area1
+        self.columns['Area2'] = area2
 
-            area2 = 0
-            if blob2 is not None:
-                area_pixel = blob2.area
-                if use_surface_area:
-                    area_pixel = blob2.surface_area
-                area2 = self.area_in_sq_cm(area_pixel, False)
-            self.data.loc[index, 'Area2'] = area2
-
-            # update grow/shrink information
-            if action == "grow" or action == "shrink" or action == "same":
-                if area2 > area1*self.threshold:
-                    self.data.loc[index, 'Action'] = "grow"
-                elif area2 < area1 / self.threshold:
-                    self.data.loc[index, 'Action'] = "shrink"
-                else:
-                    self.data.loc[index, 'Action'] = "same"
+        # update grow/shrink information
+        action = self.columns['Action']
+        comparable = np.isin(action, ["grow", "shrink", "same"])
+        action[comparable & (area2 > area1*self.threshold)] = "grow"
+        action[comparable & (area2 <= area1*self.threshold) & (area2 < area1 / self.threshold)] = "shrink"
+        action[comparable & (area2 <= area1*self.threshold) & (area2 >= area1 / self.threshold)] = "same"
+
+        self.refreshFrame(['Area1', 'Area2', 'Class', 'Action'])
 
     def setSurfaceAreaValues(self):
 
-        for index, row in self.data.iterrows():
-            id1 = int(row['Blob1'])
-            id2 = int(row['Blob2'])
-            blob1 = self.source_annotations.blobById(id1)
-            blob2 = self.target_annotations.blobById(id2)
+        for row, (blob1, blob2) in enumerate(zip(self.sourceBlobs(), self.targetBlobs())):
             if blob1 is not None:
-                self.data.loc[index, 'Area1'] = self.area_in_sq_cm(blob1.area, True)
+                self.columns['Area1'][row] = self.area_in_sq_cm(blob1.area, True)
             if blob2 is not None:
-                self.data.loc[index, 'Area2'] = self.area_in_sq_cm(blob2.area, False)
+                self.columns['Area2'][row] = self.area_in_sq_cm(blob2.area, False)
+
+        self.refreshFrame(['Area1', 'Area2'])
 
     def save(self):
-        return { "source": self.source.id, "source_annotations": self.source_annotations.id, "target": self.target.id, "target_annotations": self.target_annotations.id, "correspondences": self.data.values.tolist() }
+        return { "source": self.source.id, "source_annotations": self.source_annotations.id, "target": self.target.id, "target_annotations": self.target_annotations.id, "correspondences": self.rows() }
 
     def sort_data(self):
 
-        self.data.sort_values(by=['Action', 'Blob1', 'Blob2'], inplace=True, ignore_index=True)
+        action = self.columns['Action'].astype(str)
+        order = np.lexsort((self.columns['Blob2'], self.columns['Blob1'], action))
+        for name in COLUMNS:
+            self.columns[name] = self.columns[name][order]
+        self.changed()
 
     def checkTable(self):
         """
         Table may contain inconsistencies. This function check and remove them.
         """
 
-        inconsistencies = False
-        current_table = self.data.copy()
-        for index, row in current_table.iterrows():
-            id1 = int(row['Blob1'])
-            id2 = int(row['Blob2'])
-            blob1 = self.source_annotations.blobById(id1)
-            blob2 = self.target_annotations.blobById(id2)
+        missing = [blob1 is None and blob2 is None for blob1, blob2 in zip(self.sourceBlobs(), self.targetBlobs())]
+        missing = np.array(missing, dtype=bool)
 
-            if blob1 is None and blob2 is None:
-                self.data.drop(index, inplace=True)
-                inconsistencies = True
+        inconsistencies = bool(np.any(missing))
+        self.keepRows(~missing)
 
         return inconsistencies
 
@@ -144,8 +287,7 @@ class Correspondences(object):
             for ll in lst:
                 ll.insert(0, -1)
 
-        columns = self.data.columns
-        self.data = pd.DataFrame(lst, columns=columns)
+        self.setRows(lst)
 
         self.checkTable()
 
@@ -157,35 +299,36 @@ class Correspondences(object):
     def addBlob(self, image, blob):
 
         if self.source == image:
-            if blob.id not in self.data.Blob1.values:
+            if len(self.rowsOf(blob.id, True)) == 0:
                 self.set([blob], [])
         else:
-            if blob.id not in self.data.Blob2.values:
+            if len(self.rowsOf(blob.id, False)) == 0:
                 self.set([], [blob])
 
     def removeBlob(self, image, blob):
         if self.source == image:
             self.set([blob], [])
-            self.data = self.data[self.data['Blob1'] != blob.id]
+            self.keepRows(self.columns['Blob1'] != blob.id)
         else:
             self.set([], [blob])
-            self.data = self.data[self.data['Blob2'] != blob.id]
-
-        self.data.reset_index(drop=True, inplace=True)
+            self.keepRows(self.columns['Blob2'] != blob.id)
 
     def updateBlob(self, image, old_blob, new_blob):
         if old_blob.class_name != new_blob.class_name:
             if self.source == image:
-                set(self, [new_blob], [])
+                self.set([new_blob], [])
             else:
-                set(self, [], [new_blob])
+                self.set([], [new_blob])
             return
         if self.source == image:
-            self.data.loc[self.data["Blob1"] == old_blob.id, "Blob1"] = new_blob.id
-            self.data.loc[self.data["Blob1"] == old_blob.id, "Area1"] = self.area_in_sq_cm(new_blob.area, False)
+            rows = self.columns['Blob1'] == old_blob.id
+            self.columns['Blob1'][rows] = new_blob.id
+            self.columns['Area1'][rows] = self.area_in_sq_cm(new_blob.area, True)
         else:
-            self.data.loc[self.data["Blob2"] == old_blob.id, "Blob2"] = new_blob.id
-            self.data.loc[self.data["Blob2"] == old_blob.id, "Area2"] = self.area_in_sq_cm(new_blob.area, False)
+            rows = self.columns['Blob2'] == old_blob.id
+            self.columns['Blob2'][rows] = new_blob.id
+            self.columns['Area2'][rows] = self.area_in_sq_cm(new_blob.area, False)
+        self.changed()
 
     def set(self, sourceblobs, targetblobs):
 
@@ -210,53 +353,45 @@ class Correspondences(object):
             action = "same"
             #TODO consider morph!
 
+        source_ids = [b.id for b in sourceblobs]
+        target_ids = [b.id for b in targetblobs]
+        in_source = np.isin(self.columns['Blob1'], source_ids)
+        in_target = np.isin(self.columns['Blob2'], target_ids)
+
         #orphaned nodes: not in sourceblob, but had some connections in  targetblobs (dead now) and viceversa
         #they will become born or dead
-        targetorphaned = self.data[self.data['Blob1'].isin([b.id for b in sourceblobs])]['Blob2']
-        sourceorphaned = self.data[self.data['Blob2'].isin([b.id for b in targetblobs])]['Blob1']
-
-        targetorphaned = list(set(targetorphaned) - set([b.id for b in targetblobs]))
-        sourceorphaned = list(set(sourceorphaned) - set([b.id for b in sourceblobs]))
+        targetorphaned = list(set(self.columns['Blob2'][in_source].tolist()) - set(target_ids))
+        sourceorphaned = list(set(self.columns['Blob1'][in_target].tolist()) - set(source_ids))
 
         #remove all correspondences where orphaned
-        self.data = self.data[self.data['Blob1'].isin([b.id for b in sourceblobs]) == False]
-        self.data = self.data[self.data['Blob2'].isin([b.id for b in targetblobs]) == False]
+        self.keepRows(~(in_source | in_target))
 
+        new_rows = []
         for id in targetorphaned:
             if id < 0: # born and dead result in orphaned
                 continue
             #we need to check if the orphaned has other relationships.
-            relatives = self.data[self.data['Blob2'] == id]
-            if len(relatives):
+            if len(self.rowsOf(id, False)) > 0:
                 continue
             target = self.target_annotations.blobById(id)
-            row = [-1, -1, target.id, 0.0, self.area_in_sq_cm(target.area, False), target.class_name, "born", type]
-            df = pd.DataFrame([row], columns=self.data.columns)
-            self.data = self.data.append(df)
+            new_rows.append([-1, -1, target.id, 0.0, self.area_in_sq_cm(target.area, False), target.class_name, "born", type])
 
         for id in sourceorphaned:
             if id < 0:
                 continue
             #we need to check if the orphaned has other relationships.
-            relatives = self.data[self.data['Blob1'] == id]
-            if len(relatives):
+            if len(self.rowsOf(id, True)) > 0:
                 continue
             source = self.source_annotations.blobById(id)
-            row = [-1, source.id, -1, self.area_in_sq_cm(source.area, True), 0.0, source.class_name, "dead", type]
-            df = pd.DataFrame([row], columns=self.data.columns)
-            self.data = self.data.append(df)
+            new_rows.append([-1, source.id, -1, self.area_in_sq_cm(source.area, True), 0.0, source.class_name, "dead", type])
 
         if len(sourceblobs) == 0:
             target = targetblobs[0]
-            row = [-1, -1, target.id, 0.0, self.area_in_sq_cm(target.area, False), target.class_name, action, type]
-            df = pd.DataFrame([row], columns=self.data.columns)
-            self.data = self.data.append(df)
+            new_rows.append([-1, -1, target.id, 0.0, self.area_in_sq_cm(target.area, False), target.class_name, action, type])
 
         elif len(targetblobs) == 0:
             source = sourceblobs[0]
-            row = [-1, source.id, -1, self.area_in_sq_cm(source.area, True), 0.0, source.class_name, action, type]
-            df = pd.DataFrame([row], columns=self.data.columns)
-            self.data = self.data.append(df)
+            new_rows.append([-1, source.id, -1, self.area_in_sq_cm(source.area, True), 0.0, source.class_name, action, type])
 
         else:
 
@@ -271,10 +406,9 @@ class Correspondences(object):
                         target_area = self.area_in_sq_cm(target.area, False)
 
                     class_name = source.class_name if source.id >= 0 else target.class_name
-                    row = [-1, source.id, target.id, source_area, target_area, class_name, action, type]
-                    df = pd.DataFrame([row], columns=self.data.columns)
-                    self.data = self.data.append(df)
+                    new_rows.append([-1, source.id, target.id, source_area, target_area, class_name, action, type])
 
+        self.appendRows(new_rows)
         self.sort_data()
 
 
@@ -291,20 +425,19 @@ class Correspondences(object):
         rows = []                # involved rows
 
         # find all blobs in the target connected to the blob
-        linked = self.data[self.data[source] == blobid]
-        for index, row in linked.iterrows():
-            targetid = row[target]
+        for row in self.rowsOf(blobid, is_source):
+            targetid = int(self.columns[target][row])
             if targetid >= 0:
                 targetcluster.append(targetid)
-            rows.append(index)
+            rows.append(row)
 
         # find all the connected in the source connected to the selected targets
-        linked = self.data.loc[self.data[target].isin(targetcluster)]
-        for index, row in linked.iterrows():
-            sourceid = row[source]
-            if sourceid >= 0:
-                sourcecluster.append(sourceid)
-            rows.append(index)
+        for targetid in targetcluster:
+            for row in self.rowsOf(targetid, not is_source):
+                sourceid = int(self.columns[source][row])
+                if sourceid >= 0:
+                    sourcecluster.append(sourceid)
+                rows.append(row)
 
         if not is_source:
             sourcecluster, targetcluster = targetcluster, sourcecluster
@@ -321,67 +454,71 @@ class Correspondences(object):
         born = []
         dead = []
         for i in indexes:
-            row = self.data.iloc[i]
-            if row["Blob1"] >= 0:
-                dead.append(row["Blob1"])
-            if row["Blob2"] >= 0:
-                born.append(row["Blob2"])
-
-        # delete rows from the dataframe
-        self.data.drop(indexes, inplace=True)
-
-        # reindexing
-        self.data.reset_index(drop=True, inplace=True)
+            if self.columns["Blob1"][i] >= 0:
+                dead.append(int(self.columns["Blob1"][i]))
+            if self.columns["Blob2"][i] >= 0:
+                born.append(int(self.columns["Blob2"][i]))
 
-        count = len(self.data.index)
+        # delete rows from the table
+        self.deleteRows(indexes)
 
+        new_rows = []
         for i in set(dead):
             blob = self.source_annotations.blobById(i)
-            row = [-1, blob.id, -1, self.area_in_sq_cm(blob.area, True), 0.0, blob.class_name, "dead", "none"]
-            df = pd.DataFrame([row], columns=self.data.columns)
-            self.data = self.data.append(df)
+            new_rows.append([-1, blob.id, -1, self.area_in_sq_cm(blob.area, True), 0.0, blob.class_name, "dead", "none"])
 
         for i in set(born):
             blob = self.target_annotations.blobById(i)
-            row = [-1, -1, blob.id, 0.0, self.area_in_sq_cm(blob.area, False), blob.class_name, "dead", "none"]
-            df = pd.DataFrame([row], columns=self.data.columns)
-            self.data = self.data.append(df)
+            new_rows.append([-1, -1, blob.id, 0.0, self.area_in_sq_cm(blob.area, False), blob.class_name, "dead", "none"])
 
+        self.appendRows(new_rows)
         self.sort_data()
 
 
     def autoMatch(self, blobs1, blobs2):
         self.correspondences.clear()
+
+        # the candidate pairs are the blobs of the same class with intersecting bounding boxes,
+        # found with a spatial index of the target blobs of each class
+        indexes = {}
+        for blob2 in blobs2:
+            if blob2.class_name != 'Empty':
+                indexes.setdefault(blob2.class_name, SpatialIndex()).insert(blob2)
+
+        # each blob is rasterized at most once
+        masks = {}
+
+        def blobMask(blob):
+            if blob not in masks:
+                mask = blob.getMask()
+                masks[blob] = (mask, np.count_nonzero(mask))
+            return masks[blob]
+
         for blob1 in blobs1:
-            for blob2 in blobs2:
-                # use bb to quickly calculate intersection
-                x1 = max(blob1.bbox[0], blob2.bbox[0])
-                y1 = max(blob1.bbox[1], blob2.bbox[1])
-                x2 = min(blob1.bbox[0] + blob1.bbox[3], blob2.bbox[0] + blob2.bbox[3])
-                y2 = min(blob1.bbox[1] + blob1.bbox[2], blob2.bbox[1] + blob2.bbox[2])
-                # compute the area of intersection rectangle
-                interArea = abs(max((x2 - x1, 0)) * max((y2 - y1), 0))
-
-                if interArea != 0 and blob2.class_name == blob1.class_name and blob1.class_name != 'Empty':
-                    # this is the get mask function for the outer contours, I put it here using two different if conditions so getMask just runs just on intersections
-                    mask1 = Blob.getMask(blob1)
-                    sizeblob1 = np.count_nonzero(mask1)
-                    mask2 = Blob.getMask(blob2)
-                    sizeblob2 = np.count_nonzero(mask2)
-                    minblob = min(sizeblob1, sizeblob2)
-                    mask, bbox = intersectMask(mask1, blob1.bbox, mask2, blob2.bbox)
-                    intersectionArea = np.count_nonzero(mask)
-
-                    if (intersectionArea < (0.6 * minblob)):
-                        continue
-                    if (sizeblob2 > sizeblob1 * self.threshold):
-                        self.correspondences.append([-1, blob1.id, blob2.id, blob1.area, blob2.area, blob1.class_name, 'grow', 'none'])
-
-                    elif (sizeblob2 < sizeblob1 / self.threshold):
-                        self.correspondences.append([-1, blob1.id, blob2.id, blob1.area, blob2.area, blob1.class_name, 'shrink', 'none'])
-
-                    else:
-                        self.correspondences.append([-1, blob1.id, blob2.id, blob1.area, blob2.area, blob1.class_name, 'same', 'none'])
+            index = indexes.get(blob1.class_name)
+            if index is None:
+                continue
+
+            candidates = index.rectQuery(blob1.bbox)
+            if len(candidates) == 0:
+                continue
+
+            mask1, sizeblob1 = blobMask(blob1)
+            for blob2 in candidates:
+                mask2, sizeblob2 = blobMask(blob2)
+                minblob = min(sizeblob1, sizeblob2)
+                intersectionArea = Mask.intersectionArea(mask1, blob1.bbox, mask2, blob2.bbox)
+
+                if (intersectionArea < (0.6 * minblob)):
+                    continue
+                if (sizeblob2 > sizeblob1 * self.threshold):
+                    self.correspondences.append([-1, blob1.id, blob2.id, blob1.area, blob2.area, blob1.class_name, 'grow', 'none'])
+
+                elif (sizeblob2 < sizeblob1 / self.threshold):
+                    self.correspondences.append([-1, blob1.id, blob2.id, blob1.area, blob2.area, blob1.class_name, 'shrink', 'none'])
+
+                else:
+                    self.correspondences.append([-1, blob1.id, blob2.id, blob1.area, blob2.area, blob1.class_name, 'same', 'none'])
 
 
         # operates on the correspondences found and update them
@@ -395,25 +532,19 @@ class Correspondences(object):
 
     def assignSplit(self):
 
-        mylist = []
-        for i in range(0, len(self.correspondences)):
-            mylist.append(int(self.correspondences[i][1]))
-        splitted = sorted(set([i for i in mylist if mylist.count(i) > 1]))
+        counts = Counter([int(correspondence[1]) for correspondence in self.correspondences])
 
         for i in range(0, len(self.correspondences)):
-            if int(self.correspondences[i][1]) in splitted:
+            if counts[int(self.correspondences[i][1])] > 1:
                 self.correspondences[i][7] = 'split'
 
 
     def assignFuse(self):
 
-        mylist = []
-        for i in range(0, len(self.correspondences)):
-            mylist.append(int(self.correspondences[i][2]))
-        fused = sorted(set([i for i in mylist if mylist.count(i) > 1]))
+        counts = Counter([int(correspondence[2]) for correspondence in self.correspondences])
 
         for i in range(0, len(self.correspondences)):
-            if int(self.correspondences[i][2]) in fused:
+            if counts[int(self.correspondences[i][2])] > 1:
                 self.correspondences[i][7] = 'fuse'
 
 
@@ -422,22 +553,12 @@ class Correspondences(object):
         # """
         # Deads are all the blobs that are in project 1 but don't match with any blobs of project 2
         # """
-        all_blobs = []
-        existing = []
-        missing = []
-
-        for i in range(0, len(blobs1)):
-            all_blobs.append(int(blobs1[i].id))
+        existing = set([int(correspondence[1]) for correspondence in self.correspondences])
 
-        for j in range(0, len(self.correspondences)):
-            existing.append(int(self.correspondences[j][1]))
-
-        missing = [i for i in all_blobs if i not in existing]
-
-        for id in missing:
-            index = all_blobs.index(id)
-            if blobs1[index].class_name != 'Empty':
-                self.dead.append([-1, id, -1,  blobs1[index].area, 0.0, blobs1[index].class_name, 'dead', 'none'])
+        for blob in blobs1:
+            id = int(blob.id)
+            if id not in existing and blob.class_name != 'Empty':
+                self.dead.append([-1, id, -1,  blob.area, 0.0, blob.class_name, 'dead', 'none'])
 
 
     def assignBorn(self, blobs2):
@@ -447,19 +568,9 @@ class Correspondences(object):
         # MAYBE NOW MOVED MIGHT BE EXCHANGED FOR NEW BORN
         # """
 
-        all_blobs = []
-        existing = []
-        missing = []
-
-        for i in range(0, len(blobs2)):
-            all_blobs.append(int(blobs2[i].id))
-
-        for j in range(0, len(self.correspondences)):
-            existing.append(int(self.correspondences[j][2]))
-
-        missing = [i for i in all_blobs if i not in existing]
+        existing = set([int(correspondence[2]) for correspondence in self.correspondences])
 
-        for id in missing:
-            index = all_blobs.index(id)
-            if blobs2[index].class_name != 'Empty':
-                self.born.append([-1, -1, id, 0.0, blobs2[index].area, blobs2[index].class_name, 'born', 'none'])
+        for blob in blobs2:
+            id = int(blob.id)
+            if id not in existing and blob.class_name != 'Empty':
+                self.born.append([-1, -1, id, 0.0, blob.area, blob.class_name, 'born', 'none'])
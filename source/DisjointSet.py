@@ -0,0 +1,63 @@
+class DisjointSet(object):
+    """
+    Disjoint-set (union-find) structure with path compression and union by rank.
+    The elements can be any hashable object, they are added on the fly.
+    """
+
+    def __init__(self):
+
+        self.parent = {}
+        self.rank = {}
+
+    def __contains__(self, x):
+        return x in self.parent
+
+    def add(self, x):
+
+        if x not in self.parent:
+            self.parent[x] = x
+            self.rank[x] = 0
+
+    def find(self, x):
+        """
+        It returns the representative of the set containing x (x is added if it is not present).
+        """
+        self.add(x)
+
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+
+        # path compression
+        while self.parent[x] != root:
+            next = self.parent[x]
+            self.parent[x] = root
+            x = next
+
+        return root
+
+    def union(self, x, y):
+        """
+        Merge the sets containing x and y. It returns the representative of the merged set.
+        """
+        rx = self.find(x)
+        ry = self.find(y)
+        if rx == ry:
+            return rx
+
+        if self.rank[rx] < self.rank[ry]:
+            rx, ry = ry, rx
+
+        self.parent[ry] = rx
+        if self.rank[rx] == self.rank[ry]:
+            self.rank[rx] += 1
+
+        return rx
+
+    def forget(self, elements):
+        """
+        Remove the given elements. They must be whole sets, otherwise the remaining elements could lose their root.
+        """
+        for x in elements:
+            self.parent.pop(x, None)
+            self.rank.pop(x, None)
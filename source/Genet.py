@@ -11,13 +11,29 @@ from source.Blob import Blob
 
 from source.Mask import jointBox
 from source.Annotation import Annotation
+from source.DisjointSet import DisjointSet
 
 class Genet:
+    """
+    The genets are the connected components of the graph of the blobs linked by the correspondences.
+    They are kept in a disjoint-set structure whose elements are the pairs (annotations, blob id), updated
+    incrementally when blobs or correspondences change. Each blob has a label (a progressive number,
+    assigned in order of image, layer and id); the genet of a component is the smallest label of its blobs.
+    The genets are computed the first time they are needed. The layers not used yet (see Annotation.hydrate)
+    and not linked by correspondences are not loaded: a range of labels is reserved for their blobs.
+    """
 
     def __init__(self, project):
         self.project = project;
-        self.updateGenets()
-        pass
+
+        self.sets = DisjointSet()
+        self.members = {}       # root -> set of keys of the component
+        self.labels = {}        # key -> label
+        self.next_label = 0
+        self.links = {}         # correspondences -> set of the (id1, id2) pairs already linked
+        self.versions = {}      # correspondences -> version of the table when its links were read
+        self.reserved = {}      # lazy layer -> (first label, number of labels) reserved for its blobs
+        self.built = False
 
     # check all blobs and all corrispondences and compute the connected components.
     # will preserve existing genets ids, if possible
@@ -25,59 +41,305 @@ class Genet:
     #propagate all genets to the second map (ensure consistency.
 
 
-    def updateGenets(self):
-        #this array will be used for remapping when enforcing connected components
-        genets = []
-
-        #assign remap for blobs with assigned genets
-        # for img in self.project.images:
-        #     for b in img.annotations.seg_blobs:
-        #         if hasattr(b, 'genet') and b.genet is not None:
-        #             while len(genets) <= b.genet:
-        #                 genets.append(len(genets))
-        #             genets[b.genet] = b.genet
-        #             print("Image ", img.name, "Blob ", b.id, " has genet ", b.genet)
-
-        #assign genets to blobs with no assigned genet
-        count = len(genets)
+    def layers(self):
+        layers = []
         for img in self.project.images:
             for annotations in img.annotationLayers:
+                layers.append(annotations)
+        return layers
+
+    def tables(self):
+        if self.project.correspondences is None:
+            return []
+        return list(self.project.correspondences.values())
+
+    def build(self):
+        if not self.built:
+            self.updateGenets()
+
+    def tableLayers(self):
+        layers = set()
+        for corr in self.tables():
+            layers.add(corr.source_annotations)
+            layers.add(corr.target_annotations)
+        return layers
+
+    def registerLayer(self, annotations):
+        """
+        It adds the blobs of a layer hydrated after the genets have been computed, using its reserved labels.
+        """
+        (first, count) = self.reserved.pop(annotations)
+
+        ids = sorted([blob.id for blob in annotations.seg_blobs])
+        for i, id in enumerate(ids):
+            key = (annotations, id)
+            if i < count:
+                self.labels[key] = first + i
+                self.sets.add(key)
+                self.members[key] = set([key])
+            else:
+                self.addKey(key)
+
+        self.assignGenets(set([self.sets.find((annotations, id)) for id in ids]))
+
+        # the links of the tables created in the meanwhile have been ignored
+        for corr in self.tables():
+            if corr.source_annotations is annotations or corr.target_annotations is annotations:
+                self.links.pop(corr, None)
+                self.versions.pop(corr, None)
+                self.refreshLinks(corr)
+
+    def registerLayers(self):
+
+        table_layers = self.tableLayers()
+        for annotations in list(self.reserved.keys()):
+            if annotations.isHydrated() or annotations in table_layers:
+                self.registerLayer(annotations)
+
+    def addKey(self, key):
+
+        self.labels[key] = self.next_label
+        self.next_label += 1
+        self.sets.add(key)
+        self.members[key] = set([key])
+
+    def link(self, key1, key2):
+
+        root1 = self.sets.find(key1)
+        root2 = self.sets.find(key2)
+        if root1 == root2:
+            return
+
+        root = self.sets.union(root1, root2)
+        other = root2 if root == root1 else root1
+        self.members[root].update(self.members.pop(other))
+
+    def linkTable(self, corr, pairs):
+        """
+        It links the blobs of the given pairs (id1, id2) of a correspondences table.
+        """
+        for id1, id2 in pairs:
+            key1 = (corr.source_annotations, id1)
+            key2 = (corr.target_annotations, id2)
+            if key1 in self.labels and key2 in self.labels:
+                self.link(key1, key2)
+
+    def componentGenet(self, root):
+        return min([self.labels[member] for member in self.members[root]])
+
+    def componentGenets(self):
+        """
+        It returns the genet of each component (root -> genet).
+        """
+        return {root: self.componentGenet(root) for root in self.members.keys()}
+
+    def genetOf(self, key):
+        """
+        It returns the genet of the blob (annotations, id), None if it is unknown.
+        """
+        if key not in self.sets:
+            return None
+        return self.componentGenet(self.sets.find(key))
+
+    def assignGenets(self, roots):
+        """
+        It writes the genets of the given components into their blobs (and in the genet index of the annotations).
+        """
+        for root in roots:
+            members = self.members[root]
+            genet = self.componentGenet(root)
+            for (annotations, id) in members:
+                blob = annotations.blobById(id)
+                if blob is not None and blob.genet != genet:
+                    annotations.setBlobGenet(blob, genet)
+
+    def updateGenets(self):
+        """
+        It recomputes all the genets from scratch.
+        """
+        self.sets = DisjointSet()
+        self.members = {}
+        self.labels = {}
+        self.next_label = 0
+        self.links = {}
+        self.versions = {}
+        self.reserved = {}
+
+        table_layers = self.tableLayers()
+        for annotations in self.layers():
+            if annotations.isHydrated() or annotations in table_layers:
                 sorted_blobs = sorted(annotations.seg_blobs, key=lambda x: x.id)
                 for b in sorted_blobs:
-                    b.genet = count
-                    genets.append(count)
-                    count += 1
-
-        #remap all the correspondending blobs using genets[]
-        for corrs in self.project.correspondences.values():
-            for index, row in corrs.data.iterrows():
-                id1 = int(row['Blob1'])
-                id2 = int(row['Blob2'])
-                if id1 == -1 or id2 == -1:  #born or dead corals
-                    continue
-                blob1 = corrs.source_annotations.blobById(id1)
-                blob2 = corrs.target_annotations.blobById(id2)
-
-                while blob1.genet != genets[blob1.genet]:
-                    blob1.genet = genets[blob1.genet]
-
-                if blob1.genet != blob2.genet:
-                    #print("Genet: ", blob2.genet, "mapped to", blob1.genet)
-
-                    g = blob2.genet
-                    while True: #if g is remapped also those needs to be remapped
-                        destination = genets[g]
-                        genets[g] = blob1.genet
-                        if destination == g:
-                            break
-                        g = destination
-
-        for img in self.project.images:
-            for annotations in img.annotationLayers:
-                for b in annotations.seg_blobs:
-                    while b.genet != genets[b.genet]:  #follow the link to the
-                        b.genet = genets[b.genet]
-                    #print("Image ", img.name, "Blob ", b.id, " has genet ", b.genet)
+                    self.addKey((annotations, b.id))
+            else:
+                count = annotations.blobCount()
+                self.reserved[annotations] = (self.next_label, count)
+                self.next_label += count
+
+        for corr in self.tables():
+            self.links[corr] = corr.links()
+            self.versions[corr] = corr.version
+            self.linkTable(corr, self.links[corr])
+
+        genets = self.componentGenets()
+        for annotations in self.layers():
+            if annotations in self.reserved:
+                continue
+            for b in annotations.seg_blobs:
+                b.genet = genets[self.sets.find((annotations, b.id))]
+            annotations.updateGenetIndex()
+
+        self.built = True
+
+    def updateComponents(self, keys):
+        """
+        It recomputes the components containing the given keys (the other genets are not touched).
+        """
+        affected = set()
+        for key in keys:
+            if key in self.sets:
+                affected.update(self.members[self.sets.find(key)])
+            else:
+                affected.add(key)
+
+        # the components are removed and built again from the current correspondences
+        for key in affected:
+            if key in self.sets and self.sets.find(key) in self.members:
+                del self.members[self.sets.find(key)]
+        self.sets.forget([key for key in affected if key in self.sets])
+
+        alive = [key for key in affected if key in self.labels]
+        for key in alive:
+            self.sets.add(key)
+            self.members[key] = set([key])
+
+        for (annotations, id) in alive:
+            for corr in self.tables():
+                if corr.source_annotations is annotations:
+                    partners = [int(corr.columns['Blob2'][row]) for row in corr.rowsOf(id, True)]
+                    self.linkTable(corr, [(id, partner) for partner in partners if partner >= 0])
+                if corr.target_annotations is annotations:
+                    partners = [int(corr.columns['Blob1'][row]) for row in corr.rowsOf(id, False)]
+                    self.linkTable(corr, [(partner, id) for partner in partners if partner >= 0])
+
+        self.assignGenets(set([self.sets.find(key) for key in alive]))
+
+    def updateLinks(self, corr):
+        """
+        It updates the genets after a change of a correspondences table, only the blobs whose links changed are considered.
+        """
+        self.build()
+        self.registerLayers()
+        self.refreshLinks(corr)
+
+    def refreshLinks(self, corr):
+
+        if self.versions.get(corr) == corr.version and corr in self.links:
+            return
+
+        links = corr.links()
+        changed = links.symmetric_difference(self.links.get(corr, set()))
+        self.links[corr] = links
+        self.versions[corr] = corr.version
+
+        keys = set()
+        for id1, id2 in changed:
+            keys.add((corr.source_annotations, id1))
+            keys.add((corr.target_annotations, id2))
+        if len(keys) > 0:
+            self.updateComponents(keys)
+
+    def updateLayerLinks(self, annotations):
+
+        for corr in self.tables():
+            if corr.source_annotations is annotations or corr.target_annotations is annotations:
+                self.refreshLinks(corr)
+
+    def addBlob(self, annotations, blob):
+
+        # nothing to update until the genets are computed
+        if not self.built:
+            return
+        self.registerLayers()
+
+        key = (annotations, blob.id)
+        if key not in self.labels:
+            self.addKey(key)
+        self.updateComponents([key])
+        self.updateLayerLinks(annotations)
+
+    def removeBlob(self, annotations, blob):
+
+        if not self.built:
+            return
+        self.registerLayers()
+
+        key = (annotations, blob.id)
+        if annotations.blobById(blob.id) is None:
+            self.labels.pop(key, None)
+        self.updateComponents([key])
+        self.updateLayerLinks(annotations)
+
+    def updateBlob(self, annotations, old_blob, new_blob):
+
+        if not self.built:
+            return
+        self.registerLayers()
+
+        if old_blob.id != new_blob.id:
+            self.removeBlob(annotations, old_blob)
+            self.addBlob(annotations, new_blob)
+            return
+
+        key = (annotations, new_blob.id)
+        self.updateComponents([key])
+        self.updateLayerLinks(annotations)
+
+    def sync(self):
+        """
+        It brings the genets up to date with the blobs and the correspondences of the project, changes made
+        without notifying the genets (i.e. undo, import) are found comparing the current blobs with the known ones.
+        """
+        self.build()
+        self.registerLayers()
+
+        current = set()
+        for annotations in self.layers():
+            if annotations in self.reserved:
+                continue
+            for blob in annotations.seg_blobs:
+                current.add((annotations, blob.id))
+
+        known = set(self.labels.keys())
+        removed = known - current
+        added = current - known
+
+        for key in removed:
+            del self.labels[key]
+        for key in sorted(added, key=lambda key: key[1]):
+            self.addKey(key)
+
+        tables = self.tables()
+        for corr in list(self.links.keys()):
+            if corr not in tables:
+                del self.links[corr]
+                del self.versions[corr]
+
+        if len(removed) > 0 or len(added) > 0:
+            self.updateComponents(removed | added)
+
+        for corr in tables:
+            self.refreshLinks(corr)
+
+        # blobs replaced outside the project (i.e. undo) could have lost their genet
+        genets = self.componentGenets()
+        for annotations in self.layers():
+            if annotations in self.reserved:
+                continue
+            for blob in annotations.seg_blobs:
+                genet = genets[self.sets.find((annotations, blob.id))]
+                if blob.genet != genet:
+                    annotations.setBlobGenet(blob, genet)
 
 
     #ox and oy are the origin of bbox of the blob, dx and dy is a translation in svg.
@@ -96,7 +358,13 @@ class Genet:
             path += str(round(x, 1)) + " " + str(round(y, 1))
         return path
 
+    def hydrateAll(self):
+        for annotations in self.layers():
+            annotations.hydrate()
+
     def exportCSV(self, filename):
+        self.hydrateAll()
+        self.sync()
         fields = ['genet']
 
         working_area = self.project.working_area
@@ -118,8 +386,9 @@ class Genet:
             self.blobs.append(blobs)
 
             for blob in blobs:
-                if not blob.genet in lines:
-                    lines[blob.genet] = { }
+                genet = self.genetOf((img.annotations, blob.id))
+                if not genet in lines:
+                    lines[genet] = { }
         data = []
         #compact and sort lines.
         count = 0
@@ -134,7 +403,7 @@ class Genet:
         for i,img in enumerate(self.project.images):
             scale_factor = img.pixelSize()
             for blob in self.blobs[i]:
-                line = lines[blob.genet]
+                line = lines[self.genetOf((img.annotations, blob.id))]
                 row = line['row']
                 area = round(blob.area * (scale_factor) * (scale_factor) / 100, 2)
                 data[row][count] += blob.class_name + "  "
@@ -153,6 +422,8 @@ class Genet:
 
 
     def exportSVG(self, filename):
+        self.hydrateAll()
+        self.sync()
         #remap genets to lines and find bbox per genet.
         lines = {}
         working_area = self.project.working_area
@@ -167,10 +438,11 @@ class Genet:
             self.blobs.append(blobs)
 
             for blob in blobs:
-                if not blob.genet in lines:
-                    lines[blob.genet] = { 'box': blob.bbox }
+                genet = self.genetOf((img.annotations, blob.id))
+                if not genet in lines:
+                    lines[genet] = { 'box': blob.bbox }
                 else:
-                    lines[blob.genet]['box'] = jointBox([lines[blob.genet]['box'], blob.bbox])
+                    lines[genet]['box'] = jointBox([lines[genet]['box'], blob.bbox])
 
         #compact and sort lines.
         count = 0
@@ -195,7 +467,7 @@ class Genet:
                 '<tspan x="' + str(dx + side/2) + '" font-size="18px" dy="1.6em">' + img.acquisition_date + '</tspan></text>'
 
             for blob in self.blobs[i]:
-                line = lines[blob.genet]
+                line = lines[self.genetOf((img.annotations, blob.id))]
                 box = line['box']
                 row = line['row']
                 scale = side / max(box[2], box[3])
@@ -222,20 +494,5 @@ class Genet:
         f.close()
 
 
-    # update blob with a new genet first empty genet (starting from 1)
-    def addBlob(self, blob):
-        return 1
-
-    #a blob was removed update genet
-    def removeBlob(self, image_id, blob):
-        #if not genet, retunr
-        #if genet count = 1 free genet
-        #look for correspondences, we might need to split a graph in 2 or more.
-        pass
-
-    def updateBlobs(self, blobs):
-        #check connectivity for all the blobs and update the genets.
-        pass
-
     def save(self):
         return {}
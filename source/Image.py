@@ -35,11 +35,8 @@ class Image(object):
         else:
             for annotations in annotationLayers:
                 annotationFilled = Annotation.get_annotation_type(annotations)
-                for seg_blob in annotations["seg_blobs"]:
-                    blob = Blob(None, 0, 0, 0)
-                    blob.fromDict(seg_blob)
-                    annotationFilled.addBlob(blob)
-                
+                # the blobs are created when the layer is used
+                annotationFilled.setPendingBlobs(annotations["seg_blobs"])
                 self.annotationLayers.append(annotationFilled)
 
         self.layers = []
@@ -18,9 +18,11 @@
 # for more details.                                               
 
 import os
+import time
 import numpy as np
 import pickle as pkl
 import cv2
+from concurrent.futures import ThreadPoolExecutor
 
 # PYTORCH
 import torch
@@ -33,10 +35,19 @@ from models.dataloaders import helpers as helpers
 from models.deeplab import DeepLab
 
 from PyQt5.QtCore import QCoreApplication, Qt, QObject, pyqtSlot, pyqtSignal
-from PyQt5.QtGui import QPainter, QImage, QColor, QPixmap, qRgb, qRed, qGreen, qBlue
+from PyQt5.QtGui import QColor, QPixmap, qRgb, qRed, qGreen, qBlue
 
 from source import utils
 
+# modes of aggregation of the scores of the shifted crops of a tile (see MapClassifier.aggregateScores):
+# "average" of the output of the softmax or "bayesian" fusion of the scores
+AGGREGATION_MODES = ["average", "bayesian"]
+
+def checkAggregation(aggregation):
+    if aggregation not in AGGREGATION_MODES:
+        raise Exception("Unknown aggregation mode '" + str(aggregation) + "', it must be one of: " +
+                        ", ".join(AGGREGATION_MODES) + ".")
+
 
 class MapClassifier(QObject):
     """
@@ -86,6 +97,12 @@ class MapClassifier(QObject):
 
         self.temp_dir = "temp"
 
+        # results of the classification of the working area
+        self.label_map = None          # H x W x 3 (RGB) colored predictions
+        self.scores_dtype = np.float32
+        self.memmap_scores = False     # if True the scores are kept in a memory-mapped file in the temp folder
+        self.save_temp_files = False   # debug: save the tiles and the assembled results in the temp folder
+
 
     def _load_classifier(self, modelName):
 
@@ -141,23 +158,30 @@ class MapClassifier(QObject):
 
 
     def run(self, TILE_SIZE, AGGREGATION_WINDOW_SIZE, AGGREGATION_STEP, prediction_threshold=0.5,
-            save_scores = False, autocolor = False,  autolevel = False):
+            save_scores = False, autocolor = False,  autolevel = False, batch_size = 9, aggregation = "average",
+            prior = None):
         """
         :param TILE_SIZE: Base tile. This corresponds to the INPUT SIZE of the network.
         :param AGGREGATION_WINDOW_SIZE: Size of the center window considered for the aggregation.
         :param AGGREGATION_STEP: Step, in pixels, to calculate the different scores.
+        :param batch_size: Number of crops given to the network in a single forward pass. Each tile has 9 shifted
+                           crops, if the batch size is greater than 9 several tiles are processed together.
+        :param aggregation: Aggregation of the scores of the shifted crops, "average" or "bayesian".
+        :param prior: Prior probabilities of the classes used by the Bayesian fusion (None = uniform).
         :return:
         """
 
+        checkAggregation(aggregation)
+
         # create a temporary folder to store the processing
-        if not os.path.exists(self.temp_dir):
+        if (self.save_temp_files or self.memmap_scores) and not os.path.exists(self.temp_dir):
             os.mkdir(self.temp_dir)
 
         # prepare for running..
-        DELTA_CROP = int((TILE_SIZE - AGGREGATION_WINDOW_SIZE) / 2)
         tile_cols = int(self.wa_width / AGGREGATION_WINDOW_SIZE) + 1
         tile_rows = int(self.wa_height / AGGREGATION_WINDOW_SIZE) + 1
 
+        device = None
         if torch.cuda.is_available():
             device = torch.device("cuda")
             self.net.to(device)
@@ -169,200 +193,240 @@ class MapClassifier(QObject):
         tiles_number = tile_rows * tile_cols
 
         self.processing_step = 0
-        self.total_processing_steps = 19 * tiles_number
+        self.total_processing_steps = 10 * tiles_number
 
-        for row in range(tile_rows):
+        self.timings = { "preprocessing": 0.0, "inference": 0.0, "aggregation": 0.0, "assembly": 0.0 }
+
+        # the results are written directly in the canvases of the working area
+        self.label_map = np.zeros((self.wa_height, self.wa_width, 3), dtype=np.uint8)
+        self.scores = None
+        if save_scores is True:
+            shape = (self.nclasses, self.wa_height, self.wa_width)
+            if self.memmap_scores is True:
+                filename = os.path.join(self.temp_dir, "scores.mmap")
+                self.scores = np.memmap(filename, dtype=self.scores_dtype, mode='w+', shape=shape)
+            else:
+                self.scores = np.zeros(shape, dtype=self.scores_dtype)
+
+        # tiles are processed in groups, the crops of a group are classified together
+        tiles = [(row, col) for row in range(tile_rows) for col in range(tile_cols)]
+        tiles_per_batch = max(1, batch_size // 9)
+        groups = [tiles[i:i + tiles_per_batch] for i in range(0, len(tiles), tiles_per_batch)]
+
+        # the preprocessing of the next group runs in a worker thread while the network classifies the current one
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.prepareTiles, groups[0], TILE_SIZE, AGGREGATION_WINDOW_SIZE,
+                                 AGGREGATION_STEP, autocolor, autolevel)
+
+        for index, group in enumerate(groups):
 
             if self.flagStopProcessing is True:
                 break
 
-            for col in range(tile_cols):
+            (crops, elapsed) = future.result()
+            self.timings["preprocessing"] += elapsed
 
-                if self.flagStopProcessing is True:
-                    break
+            if index + 1 < len(groups):
+                future = executor.submit(self.prepareTiles, groups[index + 1], TILE_SIZE, AGGREGATION_WINDOW_SIZE,
+                                         AGGREGATION_STEP, autocolor, autolevel)
 
-                scores = np.zeros((9, self.nclasses, TILE_SIZE, TILE_SIZE))
+            start = time.perf_counter()
+            scores = self.inference(crops, batch_size, device)
+            self.timings["inference"] += time.perf_counter() - start
 
-                k = 0
-                for i in range(-1,2):
-                    for j in range(-1,2):
+            if self.flagStopProcessing is True:
+                break
 
-                        top = self.wa_top - DELTA_CROP + row * AGGREGATION_WINDOW_SIZE + i * AGGREGATION_STEP
-                        left = self.wa_left - DELTA_CROP + col * AGGREGATION_WINDOW_SIZE + j * AGGREGATION_STEP
-                        img_np = utils.cropImage(self.input_image, [top, left, TILE_SIZE, TILE_SIZE])
+            for k, (row, col) in enumerate(group):
 
-                        if autocolor is True and autolevel is False:
-                            img_np = utils.whiteblance(img_np)
+                start = time.perf_counter()
+                preds_avg = self.aggregateScores(scores[9*k:9*(k+1)], tile_sz=TILE_SIZE,
+                                                 center_window_size=AGGREGATION_WINDOW_SIZE, step=AGGREGATION_STEP,
+                                                 aggregation=aggregation, prior=prior)
+                self.timings["aggregation"] += time.perf_counter() - start
 
-                        if autolevel is True and autocolor is False:
-                            img_np = utils.autolevel(img_np, 1.0)
+                values_t, predictions_t = torch.max(torch.from_numpy(preds_avg), 0)
+                preds = predictions_t.cpu().numpy()
+                values_t = values_t.cpu().numpy()
+                unc_matrix = values_t < prediction_threshold
+                preds[unc_matrix] = self.background_index  # assign background
 
-                        if autolevel is True and autocolor is True:
-                            white = utils.whiteblance(img_np)
-                            white = white.astype(np.uint8)
-                            img_np = utils.autolevel(white, 1.0)
+                resimg = np.zeros((preds.shape[0], preds.shape[1], 3), dtype='uint8')
+                for label_index in range(self.nclasses):
+                    resimg[preds == label_index, :] = self.label_colors[label_index]
 
-                        # if i == 0 and j == 0:
-                        # tilename = "RGB_r=" + str(row) + "_c=" + str(col) + "_i=" + str(i) + "_j=" + str(j) + ".png"
-                        # filename = os.path.join(self.temp_dir, tilename)
-                        # tile =utils.rgbToQImage(img_np)
-                        # tile.save(filename)
+                start = time.perf_counter()
+                self.storeTile(row, col, AGGREGATION_WINDOW_SIZE, resimg, preds_avg)
+                self.timings["assembly"] += time.perf_counter() - start
 
-                        img_np = img_np.astype(np.float32)
-                        img_np = img_np / 255.0
+                self.processing_step += 1
+                self.updateProgress.emit( (100.0 * self.processing_step) / self.total_processing_steps )
+                QCoreApplication.processEvents()
 
-                        # H x W x C --> C x H x W
-                        img_np = img_np.transpose(2, 0, 1)
+        executor.shutdown(wait=True)
 
-                        # Normalization (average subtraction)
-                        img_np[0] = img_np[0] - self.average_norm[0]
-                        img_np[1] = img_np[1] - self.average_norm[1]
-                        img_np[2] = img_np[2] - self.average_norm[2]
+        if self.save_temp_files is True:
+            self.saveResults()
 
-                        with torch.no_grad():
+        torch.cuda.empty_cache()
+        del self.net
+        self.net = None
 
-                            img_tensor = torch.from_numpy(img_np)
-                            input = img_tensor.unsqueeze(0)
+    def timingsReport(self):
+        """
+        It returns the time spent by each stage of the last classification (see run), as a text.
+        """
+        return ", ".join(key + " " + "{:.2f}".format(value) for key, value in self.timings.items())
 
-                            if torch.cuda.is_available():
-                                input = input.to(device)
+    def prepareTiles(self, tiles, TILE_SIZE, AGGREGATION_WINDOW_SIZE, AGGREGATION_STEP, autocolor, autolevel):
+        """
+        It prepares the input of the network for the given tiles, i.e. for each tile the 9 shifted crops,
+        color corrected and normalized. It returns the crops (N x 3 x TILE_SIZE x TILE_SIZE) and the time spent.
+        """
+
+        start = time.perf_counter()
+
+        DELTA_CROP = int((TILE_SIZE - AGGREGATION_WINDOW_SIZE) / 2)
+        average_norm = np.array(self.average_norm[:3], dtype=np.float32).reshape(3, 1, 1)
+
+        crops = np.zeros((9 * len(tiles), 3, TILE_SIZE, TILE_SIZE), dtype=np.float32)
+
+        k = 0
+        for (row, col) in tiles:
+            for i in range(-1,2):
+                for j in range(-1,2):
 
-                            outputs = self.net(input)
+                    top = self.wa_top - DELTA_CROP + row * AGGREGATION_WINDOW_SIZE + i * AGGREGATION_STEP
+                    left = self.wa_left - DELTA_CROP + col * AGGREGATION_WINDOW_SIZE + j * AGGREGATION_STEP
+                    img_np = utils.cropImage(self.input_image, [top, left, TILE_SIZE, TILE_SIZE])
 
-                            scores[k] = outputs[0].cpu().numpy()
-                            k = k + 1
+                    if autocolor is True and autolevel is False:
+                        img_np = utils.whiteblance(img_np)
 
-                            self.processing_step += 1
-                            self.updateProgress.emit( (100.0 * self.processing_step) / self.total_processing_steps )
-                            QCoreApplication.processEvents()
+                    if autolevel is True and autocolor is False:
+                        img_np = utils.autolevel(img_np, 1.0)
+
+                    if autolevel is True and autocolor is True:
+                        white = utils.whiteblance(img_np)
+                        white = white.astype(np.uint8)
+                        img_np = utils.autolevel(white, 1.0)
+
+                    # H x W x C --> C x H x W, normalization (average subtraction)
+                    crop = crops[k]
+                    crop[:] = img_np.transpose(2, 0, 1)
+                    crop /= 255.0
+                    crop -= average_norm
+
+                    k = k + 1
+
+        return crops, time.perf_counter() - start
+
+    def inference(self, crops, batch_size, device):
+        """
+        It classifies the crops (N x 3 x H x W) in batches of batch_size crops and returns the scores (N x C x H x W)
+        as a tensor on the inference device.
+        """
+
+        scores = torch.zeros((crops.shape[0], self.nclasses, crops.shape[2], crops.shape[3]), dtype=torch.float32,
+                             device=device)
+
+        with torch.no_grad():
+
+            for start in range(0, crops.shape[0], batch_size):
 
                 if self.flagStopProcessing is True:
                     break
 
-                # import matplotlib.pyplot as plt
-                # for k in range(9):
-                #     plt.imshow(scores[k,0,513-256:513+256, 513-256:513+256])
-                #     filename = "C:\\temp\\predPorite_r=" + str(row) + "_c=" + str(col) + "-" + str(k) + ".png"
-                #     plt.savefig(filename)
-                #     plt.close('all')
-                #     plt.imshow(scores[k,1,513-256:513+256, 513-256:513+256])
-                #     filename = "C:\\temp\\predBack_r=" + str(row) + "_c=" + str(col) + "-" + str(k) + ".png"
-                #     plt.savefig(filename)
-                #     plt.close('all')
-                #
-                # por = scores[:,0,513-256:513+256, 513-256:513+256]
-                # por = np.average(por, axis=0)
-                # plt.imshow(por)
-                # filename = "C:\\temp\\por_r=" + str(row) + "_c=" + str(col) + ".png"
-                # plt.savefig(filename)
-                #
-                # back = scores[:,1,513-256:513+256, 513-256:513+256]
-                # back = np.average(back, axis=0)
-                # plt.imshow(back)
-                # filename = "C:\\temp\\backg_r=" + str(row) + "_c=" + str(col) + ".png"
-                # plt.savefig(filename)
-
-                preds_avg = self.aggregateScores(scores, tile_sz=TILE_SIZE,
-                                                     center_window_size=AGGREGATION_WINDOW_SIZE, step=AGGREGATION_STEP)
-
-                values_t, predictions_t = torch.max(torch.from_numpy(preds_avg), 0)
-                preds = predictions_t.cpu().numpy()
-                values_t = values_t.cpu().numpy()
-                unc_matrix = values_t < prediction_threshold
-                preds[unc_matrix] = self.background_index  # assign background
+                input = torch.from_numpy(crops[start:start + batch_size])
 
-                resimg = np.zeros((preds.shape[0], preds.shape[1], 3), dtype='uint8')
-                for label_index in range(self.nclasses):
-                    resimg[preds == label_index, :] = self.label_colors[label_index]
+                if device is not None:
+                    input = input.to(device)
 
-                tilename = str(row) + "_" + str(col) + ".png"
-                filename = os.path.join(self.temp_dir, tilename)
-                utils.rgbToQImage(resimg).save(filename)
+                outputs = self.net(input)
 
-                if save_scores is True:
-                    tilename = str(row) + "_" + str(col) + ".dat"
-                    filename = os.path.join(self.temp_dir, tilename)
-                    fileobject = open(filename, 'wb')
-                    pkl.dump(preds_avg, fileobject)
-                    fileobject.close()
+                n = outputs.shape[0]
+                scores[start:start + n] = outputs
 
-                self.processing_step += 1
+                self.processing_step += n
                 self.updateProgress.emit( (100.0 * self.processing_step) / self.total_processing_steps )
                 QCoreApplication.processEvents()
 
-        self.assembleTiles(tile_rows, tile_cols, AGGREGATION_WINDOW_SIZE, ass_scores= save_scores)
-        torch.cuda.empty_cache()
-        del self.net
-        self.net = None
+        return scores
 
     def loadScores(self):
+        """
+        The scores are kept in memory by run(), they are loaded from the temp folder only if they are missing.
+        """
 
+        if self.scores is not None:
+            return
+
+        # run() saves the scores in the temp folder only if save_temp_files is enabled
         filename = os.path.join(self.temp_dir, "assembled_scores.dat")
+        if not os.path.exists(filename):
+            raise Exception("The scores of the classification are not available: run the classifier first "
+                            "(the scores are saved in " + filename + " only if save_temp_files is enabled).")
+
         fileobject = open(filename, 'rb')
         self.scores = pkl.load(fileobject)
         fileobject.close()
 
-    def assembleTiles(self, tile_rows, tile_cols, AGGREGATION_WINDOW_SIZE, ass_scores = False):
-
-        # put tiles together
+    def maxScores(self):
+        """
+        It returns the max score of each pixel of the working area (in percentage) as a H x W uint8 array.
+        """
 
-        W = AGGREGATION_WINDOW_SIZE * tile_cols
-        H = AGGREGATION_WINDOW_SIZE * tile_rows
+        max_scores = np.max(self.scores, 0) * 100
+        return max_scores.astype(np.uint8)
 
-        if ass_scores is True:
-            AWS = AGGREGATION_WINDOW_SIZE
-            assembled_scores = np.zeros((self.nclasses, H, W))
-            for r in range(tile_rows):
-                for c in range(tile_cols):
-                    tilename = str(r) + "_" + str(c) + ".dat"
-                    filename = os.path.join(self.temp_dir, tilename)
+    def storeTile(self, row, col, AGGREGATION_WINDOW_SIZE, resimg, scores):
+        """
+        Copy the classification of a tile (colored predictions and scores) into the working area canvases.
+        """
 
-                    fileobject = open(filename, 'rb')
-                    scores = pkl.load(fileobject)
-                    fileobject.close()
+        AWS = AGGREGATION_WINDOW_SIZE
+        yoffset = row * AWS
+        xoffset = col * AWS
 
-                    xoffset = c * AGGREGATION_WINDOW_SIZE
-                    yoffset = r * AGGREGATION_WINDOW_SIZE
+        # the classified area can exceed the working area
+        h = min(AWS, self.wa_height - yoffset)
+        w = min(AWS, self.wa_width - xoffset)
 
-                    assembled_scores[:, yoffset: yoffset + AWS, xoffset: xoffset + AWS] = scores[:, 0:AWS, 0:AWS]
+        if h > 0 and w > 0:
+            self.label_map[yoffset:yoffset + h, xoffset:xoffset + w] = resimg[0:h, 0:w]
+            if self.scores is not None:
+                self.scores[:, yoffset:yoffset + h, xoffset:xoffset + w] = scores[:, 0:h, 0:w]
 
-            working_area_scores = np.zeros((self.nclasses, self.wa_height, self.wa_width))
-            working_area_scores = assembled_scores[:, 0:self.wa_height, 0: self.wa_width]
+        if self.save_temp_files is True:
+            tilename = str(row) + "_" + str(col) + ".png"
+            filename = os.path.join(self.temp_dir, tilename)
+            utils.rgbToQImage(resimg).save(filename)
 
-            filename = os.path.join(self.temp_dir, "assembled_scores.dat")
+            tilename = str(row) + "_" + str(col) + ".dat"
+            filename = os.path.join(self.temp_dir, tilename)
             fileobject = open(filename, 'wb')
-            pkl.dump(working_area_scores, fileobject)
+            pkl.dump(scores, fileobject)
             fileobject.close()
 
-        qimglabel = QImage(W, H, QImage.Format_RGB32)
-        painter = QPainter(qimglabel)
-
-        for r in range(tile_rows):
-            for c in range(tile_cols):
-                tilename = str(r) + "_" + str(c) + ".png"
-                filename = os.path.join(self.temp_dir, tilename)
-                qimg = QImage(filename)
-
-                xoffset = c * AGGREGATION_WINDOW_SIZE
-                yoffset = r * AGGREGATION_WINDOW_SIZE
-
-                painter.drawImage(xoffset, yoffset, qimg)
-
-        # detach the qimglabel otherwise the Qt EXPLODES when memory is free
-        painter.end()
-
-        # the classified area can exceed the working area
-        qimgworkingarea = qimglabel.copy(0, 0, self.wa_width, self.wa_height)
+    def saveResults(self):
+        """
+        Save the label map and the scores of the working area in the temp folder (for debug).
+        """
 
         labelfile = os.path.join(self.temp_dir, "labelmap.png")
-        qimgworkingarea.save(labelfile)
+        utils.rgbToQImage(self.label_map).save(labelfile)
+
+        if self.scores is not None:
+            filename = os.path.join(self.temp_dir, "assembled_scores.dat")
+            fileobject = open(filename, 'wb')
+            pkl.dump(np.asarray(self.scores), fileobject)
+            fileobject.close()
 
     def classify(self, tresh):
         """
         Given the output scores (C x H x W) it returns the label map.
         """
 
-        scores_copy= self.scores.copy()
         predictions = np.argmax(self.scores, 0)
         max_scores = np.max(self.scores, 0)
 
@@ -383,16 +447,30 @@ class MapClassifier(QObject):
 
         self.flagStopProcessing = True
 
-    def aggregateScores(self, scores, tile_sz, center_window_size, step):
+    def aggregateScores(self, scores, tile_sz, center_window_size, step, aggregation="average", prior=None):
+        """
+        Calculate the classification scores of the center window of a tile given the scores of its 9 shifted crops,
+        averaging the output of the softmax or using a Bayesian fusion (see AGGREGATION_MODES), with the given
+        prior probabilities of the classes. The computation is done on the device of the scores, which are overwritten.
         """
-        Calcute the classification scores using a Bayesian fusion aggregation.
-        """""
+
+        checkAggregation(aggregation)
+
+        scores = torch.as_tensor(scores)
+        with torch.no_grad():
+            return self._aggregateScores(scores, tile_sz, center_window_size, step, aggregation, prior).cpu().numpy()
+
+    def _aggregateScores(self, scores, tile_sz, center_window_size, step, aggregation, prior):
 
         nscores = scores.shape[0]
         nclasses = scores.shape[1]
 
-        classification_scores = np.zeros((nscores, nclasses, center_window_size, center_window_size))
-        scores_counter = np.zeros((center_window_size, center_window_size), dtype=np.int8)
+        scores = scores.float()
+
+        aggregated = torch.zeros((nclasses, center_window_size, center_window_size), dtype=torch.float32,
+                                 device=scores.device)
+        scores_counter = torch.zeros((center_window_size, center_window_size), dtype=torch.float32,
+                                     device=scores.device)
 
         # aggregation limits
         top = int((tile_sz - center_window_size) / 2)
@@ -427,64 +505,51 @@ class MapClassifier(QObject):
                 x2src = x1src + x2dest - x1dest
                 y2src = y1src + y2dest - y1dest
 
-                classification_scores[k, :, y1dest:y2dest, x1dest:x2dest] = scores[k, :, y1src:y2src, x1src:x2src]
+                window = scores[k, :, y1src:y2src, x1src:x2src]
+
+                if aggregation == "average":
+
+                    # NOTE: SOME APPROACHES AVERAGE THE SCORES DIRECTLY, OTHER ONES AVERAGE THE OUTPUT OF THE SOFTMAX
+                    #       HERE, WE AVERAGE THE OUTPUT OF THE SOFTMAX (computed in-place on the aggregated window only)
+
+                    window -= torch.max(window, dim=0, keepdim=True)[0]
+                    window.exp_()
+                    window /= torch.sum(window, dim=0, keepdim=True)
+
+                aggregated[:, y1dest:y2dest, x1dest:x2dest] += window
                 scores_counter[y1dest:y2dest, x1dest:x2dest] += 1
 
                 k = k + 1
 
-                self.processing_step += 1
-                self.updateProgress.emit( (100.0 * self.processing_step) / self.total_processing_steps )
-                QCoreApplication.processEvents()
+        if aggregation == "bayesian":
+
+            #####   AGGREGATE SCORES USING BAYESIAN FUSION   #############################################
+
+            # NOTE THAT:
+            #                                              _____
+            #                                               | |
+            #               p(y|s_N , s_N-1 , s_0) =  p(y)  | |  p(s_i | y)
+            #                                             i=0..N
+            # CORRESPONDS TO:
+            #                                                          __
+            #                                                      (   \                )
+            #               p(y|s_N , s_N-1 , s_0) =  p(y) SOFTMAX (   /   p(s_i | y))  )
+            #                                                      (   ==               )
+            #                                                        i=0..N
+            #
+            # THIS AVOID NUMERICAL PROBLEMS FOR PRODUCTS WITH MANY TERMS.
+            # (the areas not covered by a crop have null scores)
+
+            result = torch.softmax(aggregated, dim=0)
+
+            if prior is not None:
+                prior = torch.tensor(prior, dtype=torch.float32, device=scores.device).reshape(-1, 1, 1)
+                result = result * prior
+                result = result / torch.sum(result, dim=0, keepdim=True)
+
+        else:
 
-        #####   AGGREGATE SCORES BY AVERAGING THEM   ##################################################
-
-        # NOTE: SOME APPROACHES AVERAGE THE SCORES DIRECTLY, OTHER ONES AVERAGE THE OUTPUT OF THE SOFTMAX
-        #       HERE, WE AVERAGE THE OUTPUT OF THE SOFTMAX
-
-        softmax = torch.nn.Softmax(dim=0)
-
-        classification_scores_avg = np.zeros((nclasses, center_window_size, center_window_size))
-        for i in range(nscores):
-            prob = softmax(torch.from_numpy(classification_scores[i]))
-            classification_scores_avg = classification_scores_avg + prob.numpy()
-
-        classification_scores_avg = classification_scores_avg / nscores
-
-        #classification_scores = np.average(classification_scores, axis=0)
-        #classification_scores_avg = softmax(torch.from_numpy(classification_scores)).cpu().numpy()
-
-
-        #####   AGGREGATE SCORES USING BAYESIAN FUSION   #############################################
-
-        # NOTE THAT:
-        #                                              _____
-        #                                               | |
-        #               p(y|s_N , s_N-1 , s_0) =  p(y)  | |  p(s_i | y)
-        #                                             i=0..N
-        # CORRESPONDS TO:
-        #                                                          __
-        #                                                      (   \                )
-        #               p(y|s_N , s_N-1 , s_0) =  p(y) SOFTMAX (   /   p(s_i | y))  )
-        #                                                      (   ==               )
-        #                                                        i=0..N
-        #
-        # THIS AVOID NUMERICAL PROBLEMS FOR PRODUCTS WITH MANY TERMS.
-
-        # # bayesian aggregation
-        # classification_scores_bayes = np.zeros((nclasses, center_window_size, center_window_size))
-        #
-        # for i in range(nscores):
-        #     classification_scores_bayes = classification_scores_bayes + classification_scores[i]
-        #
-        # classification_scores_bayesian = np.zeros((nclasses, center_window_size, center_window_size))
-        #
-        # res = softmax(torch.from_numpy(classification_scores_bayes))
-        #
-        # # PRIOR probabilities
-        # prior = [0.7, 0.1, 0.1, 0.1]
-        #
-        # for i in range(nclasses):
-        #     classification_scores_bayesian[i] = prior[i] * res[i].numpy()
-
-        return classification_scores_avg
+            # the areas not covered by a crop have null scores, i.e. uniform probabilities
+            result = (aggregated + (nscores - scores_counter) / nclasses) / nscores
 
+        return result
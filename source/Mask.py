@@ -170,6 +170,28 @@ def intersectMask(dmask, dbox, smask, sbox):
     mask = d & s
     return (mask, box)
 
+def intersectionArea(dmask, dbox, smask, sbox):
+    """
+    Number of pixels in common between two masks (the intersection mask is not created).
+    """
+
+    # range is [minx, miny, maxx, maxy], absolute ranges
+    drange = [dbox[0], dbox[1], dbox[0] + dbox[3], dbox[1] + dbox[2]]
+    srange = [sbox[0], sbox[1], sbox[0] + sbox[3], sbox[1] + sbox[2]]
+
+    # intersection
+    range = [max(drange[0], srange[0]), max(drange[1], srange[1]), min(drange[2], srange[2]), min(drange[3], srange[3])]
+
+    # check for intersection
+    if range[2] <= range[0] or range[3] <= range[1]:
+        return 0
+
+    # compute local ranges
+    d = dmask[range[0] - dbox[0]:range[2] - dbox[0], range[1] - dbox[1]:range[3] - dbox[1]]
+    s = smask[range[0] - sbox[0]:range[2] - sbox[0], range[1] - sbox[1]:range[3] - sbox[1]]
+
+    return int(np.count_nonzero(np.logical_and(d, s)))
+
 
 
 """
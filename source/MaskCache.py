@@ -0,0 +1,73 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MaskCache(object):
+    """
+    LRU cache of the blob masks. The masks are stored bit-packed (1 bit per pixel) and the total size
+    of the cached masks is kept under a memory budget (in bytes), shared by all the blobs of the project.
+    Each entry has a signature (see Blob.maskSignature), an entry with a different signature is stale.
+    """
+
+    def __init__(self, budget=256 * 1024 * 1024):
+
+        self.budget = budget
+        self.entries = OrderedDict()   # key -> (signature, shape, packed mask)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, signature):
+        """
+        It returns a new (uint8) copy of the cached mask, None if it is not cached or it is stale.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != signature:
+            if entry is not None:
+                self.remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        (signature, shape, packed) = entry
+        mask = np.unpackbits(packed, count=shape[0] * shape[1])
+        return mask.reshape(shape)
+
+    def put(self, key, signature, mask):
+
+        self.remove(key)
+
+        packed = np.packbits(mask.ravel() != 0)
+        if packed.nbytes > self.budget:
+            return
+
+        self.entries[key] = (signature, mask.shape, packed)
+        self.size += packed.nbytes
+        self.trim(self.budget)
+
+    def remove(self, key):
+
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2].nbytes
+
+    def trim(self, budget):
+        """
+        It drops the least recently used masks until the cache fits the given budget.
+        """
+        while self.size > budget and len(self.entries) > 0:
+            (key, entry) = self.entries.popitem(last=False)
+            self.size -= entry[2].nbytes
+
+    def setBudget(self, budget):
+
+        self.budget = budget
+        self.trim(budget)
+
+    def clear(self):
+
+        self.entries.clear()
+        self.size = 0
@@ -18,10 +18,16 @@
 # for more details.
 
 import os
+import json
+import hashlib
 import math
 import numpy as np
+import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtGui import QPainter, QImage, QPen, QBrush, QColor, qRgb
 from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication
 import random as rnd
 from source import utils
 from skimage.filters import gaussian
@@ -30,6 +36,74 @@ from skimage import measure
 import glob
 import sys
 
+# maximum number of (area, coral) pairs evaluated at once by calculateAreasMetrics
+METRICS_BATCH_SIZE = 4 * 1024 * 1024
+
+# zlib compression level (0-9) of the exported tiles
+TILE_PNG_COMPRESSION = 6
+
+# file (in the dataset folder) describing the tiles exported, an interrupted export is resumed only if it matches
+TILES_MANIFEST = "tiles.json"
+
+
+def imageBuffer(qimg):
+	"""
+	It returns the pixels of a RGB32 QImage as a (H x W x 4) uint8 numpy array (B, G, R, A), without copying them.
+	"""
+	bits = qimg.constBits()
+	bits.setsize(qimg.bytesPerLine() * qimg.height())
+	pixels = np.frombuffer(bits, dtype=np.uint8).reshape(qimg.height(), qimg.bytesPerLine() // 4, 4)
+	return pixels[:, :qimg.width()]
+
+def cropTile(buffer, top, left, size):
+	"""
+	It returns the (size x size x 3) BGR crop of the buffer (see imageBuffer) at (top, left). The crop is a view of
+	the buffer if it falls inside it, otherwise it is a copy with the parts outside the buffer black (as QImage.copy).
+	"""
+	(h, w) = buffer.shape[:2]
+	if top >= 0 and left >= 0 and top + size <= h and left + size <= w:
+		return buffer[top:top + size, left:left + size, :3]
+
+	crop = np.zeros((size, size, 3), dtype=np.uint8)
+	(t, l) = (max(top, 0), max(left, 0))
+	(b, r) = (min(top + size, h), min(left + size, w))
+	if b > t and r > l:
+		crop[t - top:b - top, l - left:r - left] = buffer[t:b, l:r, :3]
+	return crop
+
+def bufferDigest(buffer):
+	"""
+	It returns a digest of the pixels of an image buffer (see imageBuffer).
+	"""
+	h = hashlib.sha1()
+	for row in range(0, buffer.shape[0], 1024):
+		h.update(np.ascontiguousarray(buffer[row:row + 1024]).data)
+	return h.hexdigest()
+
+def readTilesManifest(filename):
+	"""
+	It returns the manifest of the tiles written in a dataset folder (see NewDataset.export_tiles), None if missing.
+	"""
+	try:
+		with open(filename, "r") as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+def saveTile(filename, crop, compression):
+	"""
+	It encodes a BGR crop as PNG and writes it. The file is written with a temporary name and then renamed,
+	so an existing tile is always complete.
+	"""
+	ok, data = cv2.imencode(".png", crop, [cv2.IMWRITE_PNG_COMPRESSION, compression])
+	if not ok:
+		raise IOError("Cannot encode the tile " + filename)
+
+	temp_filename = filename + ".tmp"
+	with open(temp_filename, "wb") as f:
+		f.write(data.tobytes())
+	os.replace(temp_filename, filename)
+
 
 class NewDataset(object):
 	"""
@@ -355,133 +429,175 @@ class NewDataset(object):
 		return scores
 
 
-	def findAreas(self, target_classes):
+	def calculateAreasMetrics(self, areas, target_classes):
 		"""
-		Find the validation and test areas with landscape metrics similar to the ones of the entire map.
+		Vectorized version of calculateMetrics, it calculates the metrics of many areas at once.
+		The areas are stored as a (N x 4) array of (top, left, width, height).
+		The coverage is taken from the summed-area table of each class, the corals inside each area
+		(see checkBlobInside) are found for batches of areas at once.
+		It returns three (N x number of classes) arrays: number, coverage and PSCV.
 		"""
 
-		area_info = []
+		areas = np.asarray(areas, dtype=np.int64).reshape(-1, 4)
+		top = areas[:, 0]
+		left = areas[:, 1]
+		bottom = top + areas[:, 3]
+		right = left + areas[:, 2]
+		A = (areas[:, 2] * areas[:, 3]).astype(np.float64)
 
-		map_w = self.ortho_image.width()
-		map_h = self.ortho_image.height()
+		number = np.zeros((areas.shape[0], len(target_classes)))
+		coverage = np.zeros((areas.shape[0], len(target_classes)))
+		PSCV = np.zeros((areas.shape[0], len(target_classes)))
 
-		area_w = int(math.sqrt(0.15) * map_w)
-		area_h = int(math.sqrt(0.15) * map_h)
+		# the areas are clipped to the labels like in computeExactCoverage
+		(label_h, label_w) = self.labels.shape
+		(t, b) = (np.clip(top, 0, label_h), np.clip(bottom, 0, label_h))
+		(l, r) = (np.clip(left, 0, label_w), np.clip(right, 0, label_w))
 
-		landscape_number, landscape_coverage, landscape_PSCV = self.calculateMetrics([0, 0, map_w, map_h], target_classes)
+		sat = np.zeros((label_h + 1, label_w + 1), dtype=np.int32)
+		for i, class_name in enumerate(target_classes):
 
-		# calculate normalization factor
-		numbers = []
-		coverages = []
-		PSCVs = []
-		sn = []
-		sc = []
-		sP = []
-		for i in range(5000):
+			np.cumsum(np.cumsum(self.labels == i + 1, axis=0, dtype=np.int32), axis=1, out=sat[1:, 1:])
+			coverage[:, i] = (sat[b, r] - sat[t, r] - sat[b, l] + sat[t, l]) / A
 
-			aspect_ratio_factor = factor = rnd.uniform(0.4, 2.5)
-			w = int(area_w / aspect_ratio_factor)
-			h = int(area_h * aspect_ratio_factor)
-			px = rnd.randint(0, map_w - w - 1)
-			py = rnd.randint(0, map_h - h - 1)
+			blobs = [blob for blob in self.blobs if blob.class_name == class_name]
+			if self.frequencies[i] <= 0.0 or len(blobs) == 0:
+				continue
 
-			area_bbox = [py, px, w, h]
-			area_number, area_coverage, area_PSCV = self.calculateMetrics(area_bbox, target_classes)
-			s1, s2, s3 = self.rangeScore(area_number, area_coverage, area_PSCV, landscape_number, landscape_coverage, landscape_PSCV)
+			bboxes = np.array([blob.bbox for blob in blobs], dtype=np.int64)
+			blob_areas = np.array([blob.area for blob in blobs], dtype=np.float64)
+			bbox_areas = bboxes[:, 2] * bboxes[:, 3]
+			mean_area = np.mean(blob_areas)
 
-			numbers.append(area_number)
-			coverages.append(area_coverage)
-			PSCVs.append(area_PSCV)
+			batch = max(1, METRICS_BATCH_SIZE // len(blobs))
+			for start in range(0, areas.shape[0], batch):
+				rows = slice(start, start + batch)
 
-			sn.append(s1)
-			sc.append(s2)
-			sP.append(s3)
+				# a coral is counted if and only if it is inside the given area for 3/4
+				x_left = np.maximum(left[rows, np.newaxis], bboxes[:, 1])
+				y_top = np.maximum(top[rows, np.newaxis], bboxes[:, 0])
+				x_right = np.minimum(right[rows, np.newaxis], bboxes[:, 1] + bboxes[:, 2])
+				y_bottom = np.minimum(bottom[rows, np.newaxis], bboxes[:, 0] + bboxes[:, 3])
+				intersection = np.where((x_right >= x_left) & (y_bottom >= y_top), (x_right - x_left) * (y_bottom - y_top), 0)
+				inside = (intersection / bbox_areas > 3.0 / 4.0).astype(np.float64)
 
-			if i % 50 == 0:
-				sys.stdout.write("\rFinding biologically representative areas (pass 1/2)... %.2f %%" % ((i * 100.0) / 5000.0))
+				count = inside.sum(axis=1)
+				number[rows, i] = count
 
-		sn = np.array(sn)
-		sc = np.array(sc)
-		sP = np.array(sP)
-		self.sn_min = np.min(sn, axis=0)
-		self.sn_max = np.max(sn, axis=0)
-		self.sc_min = np.min(sc, axis=0)
-		self.sc_max = np.max(sc, axis=0)
-		self.sP_min = np.min(sP, axis=0)
-		self.sP_max = np.max(sP, axis=0)
+				# Patch Size Coefficient of Variation (PSCV), the areas are centered for numerical accuracy
+				counted = count > 0
+				mean_areas = inside[counted] @ (blob_areas - mean_area) / count[counted]
+				var_areas = inside[counted] @ ((blob_areas - mean_area) ** 2) / count[counted] - mean_areas ** 2
+				mean_areas += mean_area
+				PSCV[np.arange(areas.shape[0])[rows][counted], i] = (100.0 * np.sqrt(np.maximum(var_areas, 0.0))) / mean_areas
 
-		for i in range(10000):
+		return number, coverage, PSCV
+
+
+	def calculateAreasNormalizedScores(self, s1, s2, s3, landscape_number):
+		"""
+		Vectorized version of calculateNormalizedScore, s1, s2, s3 are the (N x number of classes) terms
+		of the score (see rangeScore). The scores not defined are set to zero.
+		"""
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			sn = (s1 - self.sn_min) / (self.sn_max - self.sn_min)
+			sc = (s2 - self.sc_min) / (self.sc_max - self.sc_min)
+			sP = (s3 - self.sP_min) / (self.sP_max - self.sP_min)
+
+		scores = np.where(landscape_number > 0, (sn + sc + sP) / 3.0, 0.0)
+		scores[np.isnan(scores)] = 0.0
+		return scores
+
+
+	def randomAreas(self, count, area_w, area_h, map_w, map_h):
+		"""
+		It returns count random areas (top, left, width, height), as a (count x 4) array, with a random aspect ratio.
+		"""
 
-			aspect_ratio_factor = factor = rnd.uniform(0.4, 2.5)
+		areas = []
+		for i in range(count):
+
+			aspect_ratio_factor = rnd.uniform(0.4, 2.5)
 			w = int(area_w / aspect_ratio_factor)
 			h = int(area_h * aspect_ratio_factor)
-
 			px = rnd.randint(0, map_w - w - 1)
 			py = rnd.randint(0, map_h - h - 1)
 
-			area_bbox = [py, px, w, h]
-
-			area_number, area_coverage, area_PSCV = self.calculateMetrics(area_bbox, target_classes)
-			scores = self.calculateNormalizedScore(area_number, area_coverage, area_PSCV, landscape_number, landscape_coverage, landscape_PSCV)
-
-			for jj, score in enumerate(scores):
-				if math.isnan(score):
-					scores[jj] = 0.0
+			areas.append([py, px, w, h])
 
-			aggregated_score = sum(scores) / len(scores)
+		return np.array(areas, dtype=np.int64).reshape(-1, 4)
 
-			area_info.append((area_bbox, scores, aggregated_score))
 
-			if i % 50 == 0:
-				sys.stdout.write("\rFinding biologically representative areas (pass 2/2)... %.2f %%" % ((i * 100.0) / 10000.0))
+	def findAreas(self, target_classes, normalization_samples=5000, samples=10000):
+		"""
+		Find the validation and test areas with landscape metrics similar to the ones of the entire map.
+		The metrics of the random candidates are evaluated all at once, see calculateAreasMetrics.
+		"""
 
+		map_w = self.ortho_image.width()
+		map_h = self.ortho_image.height()
 
-		area_info.sort(key=lambda x:x[2])
-		val_area = area_info[0][0]
+		area_w = int(math.sqrt(0.15) * map_w)
+		area_h = int(math.sqrt(0.15) * map_h)
 
-		print("*** VALIDATION AREA ***")
-		area_number, area_coverage, area_PSCV = self.calculateMetrics(val_area, target_classes)
-		scoresNorm = self.calculateNormalizedScore(area_number, area_coverage, area_PSCV, landscape_number,
-											   landscape_coverage, landscape_PSCV)
-		lc = [value * 100.0 for value in landscape_coverage]
-		ac = [value * 100.0 for value in area_coverage]
-
-		for i, score in enumerate(scoresNorm):
-			if math.isnan(score):
-				scoresNorm[i] = 0.0
-		print(scoresNorm)
-		print("Normalized score:", sum(scoresNorm) / len(scoresNorm))
-		print("Number of corals per class (landscape):", landscape_number)
-		print("Coverage of corals per class (landscape):", lc)
-		print("PSCV per class (landscape): ", landscape_PSCV)
-		print("Number of corals per class (selected area):", area_number)
-		print("Coverage of corals per class (selected area):", ac)
-		print("PSCV of corals per class (selected area):", area_PSCV)
-
-		for i in range(len(area_info)):
-			intersection = self.bbox_intersection(val_area, area_info[i][0])
-			if intersection < 10.0:
-				test_area = area_info[i][0]
+		# the first candidates are used only to calculate the normalization factors
+		candidates = np.concatenate([[[0, 0, map_w, map_h]],
+									 self.randomAreas(normalization_samples, area_w, area_h, map_w, map_h),
+									 self.randomAreas(samples, area_w, area_h, map_w, map_h)])
+
+		print("Finding biologically representative areas...")
+		number, coverage, PSCV = self.calculateAreasMetrics(candidates, target_classes)
+
+		landscape_number = number[0]
+		landscape_coverage = coverage[0]
+		landscape_PSCV = PSCV[0]
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			sn = np.abs((number / landscape_number) * 100.0 - 15.0)
+		sc = np.abs((coverage - landscape_coverage) * 100.0)
+		sP = np.abs(PSCV - landscape_PSCV)
+		valid = landscape_number > 0
+		sn = np.where(valid, sn, 0.0)
+		sc = np.where(valid, sc, 0.0)
+		sP = np.where(valid, sP, 0.0)
+
+		normalization = slice(1, 1 + normalization_samples)
+		self.sn_min = np.min(sn[normalization], axis=0)
+		self.sn_max = np.max(sn[normalization], axis=0)
+		self.sc_min = np.min(sc[normalization], axis=0)
+		self.sc_max = np.max(sc[normalization], axis=0)
+		self.sP_min = np.min(sP[normalization], axis=0)
+		self.sP_max = np.max(sP[normalization], axis=0)
+
+		scores = self.calculateAreasNormalizedScores(sn, sc, sP, landscape_number)
+		aggregated_scores = np.sum(scores, axis=1) / scores.shape[1]
+
+		first = 1 + normalization_samples
+		order = first + np.argsort(aggregated_scores[first:], kind="stable")
+
+		val_index = order[0]
+		test_index = None
+		for index in order:
+			if self.bbox_intersection(candidates[val_index], candidates[index]) < 10.0:
+				test_index = index
 				break
 
-		print("*** TEST AREA ***")
-		area_number, area_coverage, area_PSCV = self.calculateMetrics(test_area, target_classes)
-		scoresNorm = self.calculateNormalizedScore(area_number, area_coverage, area_PSCV, landscape_number,
-											   landscape_coverage, landscape_PSCV)
 		lc = [value * 100.0 for value in landscape_coverage]
-		ac = [value * 100.0 for value in area_coverage]
-
-		for i, score in enumerate(scoresNorm):
-			if math.isnan(score):
-				scoresNorm[i] = 0.0
-		print(scoresNorm)
-		print("Normalized score:", sum(scoresNorm) / len(scoresNorm))
-		print("Number of corals per class (landscape):", landscape_number)
-		print("Coverage of corals per class (landscape):", lc)
-		print("PSCV per class (landscape): ", landscape_PSCV)
-		print("Number of corals per class (selected area):", area_number)
-		print("Coverage of corals per class (selected area):", ac)
-		print("PSCV of corals per class (selected area):", area_PSCV)
+		for title, index in (("*** VALIDATION AREA ***", val_index), ("*** TEST AREA ***", test_index)):
+			print(title)
+			ac = [value * 100.0 for value in coverage[index]]
+			print(scores[index].tolist())
+			print("Normalized score:", aggregated_scores[index])
+			print("Number of corals per class (landscape):", landscape_number.astype(int).tolist())
+			print("Coverage of corals per class (landscape):", lc)
+			print("PSCV per class (landscape): ", landscape_PSCV.tolist())
+			print("Number of corals per class (selected area):", number[index].astype(int).tolist())
+			print("Coverage of corals per class (selected area):", ac)
+			print("PSCV of corals per class (selected area):", PSCV[index].tolist())
+
+		val_area = candidates[val_index].tolist()
+		test_area = candidates[test_index].tolist()
 
 		return val_area, test_area
 
@@ -673,103 +789,78 @@ class NewDataset(object):
 		return samples
 
 
-	def cleanTrainingTiles(self, training_tiles):
+	def bucketTiles(self, tiles, cell):
 		"""
-		If a training tile intersect a validation or a test tile it is removed.
+		It groups the tiles (x, y) in a uniform grid with the given cell size.
+		It returns the dictionary (row, col) -> list of tiles.
 		"""
 
-		cleaned_tiles = []
-		bbox1 = [0, 0, 0, 0]
-		bbox2 = [0, 0, 0, 0]
-		size = self.crop_size + 4
-		half_size = int(size / 2)
+		buckets = {}
+		for tile in tiles:
+			key = (int(math.floor(tile[1] / cell)), int(math.floor(tile[0] / cell)))
+			buckets.setdefault(key, []).append(tile)
 
-		for tile in training_tiles:
-
-			bbox1[0] = tile[1] - half_size
-			bbox1[1] = tile[0] - half_size
-			bbox1[2] = half_size * 2
-			bbox1[3] = half_size * 2
+		return buckets
 
-			flag = True
-			for vtile in self.validation_tiles:
 
-				bbox2[0] = vtile[1] - half_size
-				bbox2[1] = vtile[0] - half_size
-				bbox2[2] = half_size * 2
-				bbox2[3] = half_size * 2
+	def checkTileOverlap(self, tile, buckets, half_size):
+		"""
+		It returns True if the given tile intersects one of the tiles grouped in the buckets for more than 10%.
+		The cells of the buckets are as large as the tiles (see bucketTiles), so only the neighbouring cells are checked.
+		"""
 
-				area = self.bbox_intersection(bbox1, bbox2)
-				area_perc = (100.0*area) / float(bbox1[2] * bbox1[3])
-				if area_perc > 10.0:
-					flag = False
-					break
+		size = half_size * 2
+		bbox1 = [tile[1] - half_size, tile[0] - half_size, size, size]
+		bbox2 = [0, 0, size, size]
 
-			if flag is True:
-				for ttile in self.test_tiles:
+		row = int(math.floor(tile[1] / size))
+		col = int(math.floor(tile[0] / size))
+		for r in range(row - 1, row + 2):
+			for c in range(col - 1, col + 2):
+				for other in buckets.get((r, c), []):
 
-					bbox2[0] = ttile[1] - half_size
-					bbox2[1] = ttile[0] - half_size
-					bbox2[2] = half_size * 2
-					bbox2[3] = half_size * 2
+					bbox2[0] = other[1] - half_size
+					bbox2[1] = other[0] - half_size
 
 					area = self.bbox_intersection(bbox1, bbox2)
 					area_perc = (100.0 * area) / float(bbox1[2] * bbox1[3])
 					if area_perc > 10.0:
-						flag = False
-						break
+						return True
 
-			if flag is True:
-				cleaned_tiles.append(tile)
-
-		return cleaned_tiles
+		return False
 
 
-	def cleaningValidationTiles(self, validation_tiles):
+	def cleanTrainingTiles(self, training_tiles):
 		"""
-		It can be required by the oversampling.
+		If a training tile intersect a validation or a test tile it is removed.
 		"""
 
-		cleaned_tiles = []
-		bbox1 = [0, 0, 0, 0]
-		bbox2 = [0, 0, 0, 0]
 		size = self.crop_size + 4
-		half_size = size / 2
-
-		for vtile in validation_tiles:
+		half_size = int(size / 2)
 
-			bbox1[0] = vtile[1] - half_size
-			bbox1[1] = vtile[0] - half_size
-			bbox1[2] = half_size * 2
-			bbox1[3] = half_size * 2
+		buckets = self.bucketTiles(self.validation_tiles + self.test_tiles, half_size * 2)
 
-			flag = True
-			for ttile in self.training_tiles:
+		cleaned_tiles = []
+		for tile in training_tiles:
+			if not self.checkTileOverlap(tile, buckets, half_size):
+				cleaned_tiles.append(tile)
 
-				bbox2[0] = ttile[1] - half_size
-				bbox2[1] = ttile[0] - half_size
-				bbox2[2] = half_size * 2
-				bbox2[3] = half_size * 2
+		return cleaned_tiles
 
-				area = self.bbox_intersection(bbox1, bbox2)
-				area_perc = (100.0*area) / float(bbox1[2] * bbox1[3])
-				if area_perc > 10.0:
-					flag = False
 
-			if flag is True:
-				for tile in self.test_tiles:
+	def cleaningValidationTiles(self, validation_tiles):
+		"""
+		It can be required by the oversampling.
+		"""
 
-					bbox2[0] = tile[1] - half_size
-					bbox2[1] = tile[0] - half_size
-					bbox2[2] = half_size * 2
-					bbox2[3] = half_size * 2
+		size = self.crop_size + 4
+		half_size = size / 2
 
-					area = self.bbox_intersection(bbox1, bbox2)
-					area_perc = (100.0 * area) / float(bbox1[2] * bbox1[3])
-					if area_perc > 10.0:
-						flag = False
+		buckets = self.bucketTiles(self.training_tiles + self.test_tiles, half_size * 2)
 
-			if flag is True:
+		cleaned_tiles = []
+		for vtile in validation_tiles:
+			if not self.checkTileOverlap(vtile, buckets, half_size):
 				cleaned_tiles.append(vtile)
 
 		return cleaned_tiles
@@ -1045,103 +1136,93 @@ class NewDataset(object):
 			self.validation_tiles = self.cleaningValidationTiles(self.validation_tiles)
 
 
-	def export_tiles(self, basename, tilename):
+	def export_tiles(self, basename, tilename, progress_bar=None, workers=None, compression=TILE_PNG_COMPRESSION, resume=False):
 		"""
 		Exports the tiles INSIDE the given areas (val_area and test_area are stored as (top, left, width, height))
 		The training tiles are the ones of the entire map minus the ones inside the test validation and test area.
+		The tiles are cropped as views of the pixels of the images and they are encoded and written by a pool of
+		workers (by default one for each CPU). If resume is True the tiles already written by an export with the
+		same tiles (see TILES_MANIFEST) are skipped, otherwise all the tiles are written again.
 		"""
 
-		##### VALIDATION AREA
+		ortho_image = self.ortho_image
+		if ortho_image.format() != QImage.Format_RGB32:
+			ortho_image = ortho_image.convertToFormat(QImage.Format_RGB32)
+		label_image = self.label_image
+		if label_image.format() != QImage.Format_RGB32:
+			label_image = label_image.convertToFormat(QImage.Format_RGB32)
 
-		basenameVim = os.path.join(basename, os.path.join("validation", "images"))
-		try:
-			os.makedirs(basenameVim)
-		except:
-			pass
+		ortho_buffer = imageBuffer(ortho_image)
+		label_buffer = imageBuffer(label_image)
 
-		basenameVlab = os.path.join(basename, os.path.join("validation", "labels"))
-		try:
-			os.makedirs(basenameVlab)
-		except:
-			pass
+		# the tiles are sampled randomly, the names of the tiles of an export do not match the ones of another;
+		# the digests of the images detect the changes of the map or of the labels
+		manifest = {"tile_size": int(self.tile_size), "tilename": tilename,
+					"image_size": [ortho_image.width(), ortho_image.height()],
+					"image_digest": bufferDigest(ortho_buffer), "label_digest": bufferDigest(label_buffer),
+					"tiles": {}}
 
-		half_tile_size = self.tile_size / 2
+		# VALIDATION AREA, TEST AREA, TRAINING AREA = ENTIRE MAP / (VALIDATION AREA U TEST_AREA)
+		jobs = []
+		for folder, tiles in [("validation", self.validation_tiles), ("test", self.test_tiles), ("training", self.training_tiles)]:
 
-		for i, sample in enumerate(self.validation_tiles):
+			manifest["tiles"][folder] = [[float(sample[0]), float(sample[1])] for sample in tiles]
 
-			cx = sample[0]
-			cy = sample[1]
-			top = cy - half_tile_size
-			left = cx - half_tile_size
-			cropimg = utils.cropQImage(self.ortho_image, [top, left, self.tile_size, self.tile_size])
-			croplabel = utils.cropQImage(self.label_image, [top, left, self.tile_size, self.tile_size])
+			basenameIm = os.path.join(basename, os.path.join(folder, "images"))
+			basenameLab = os.path.join(basename, os.path.join(folder, "labels"))
+			os.makedirs(basenameIm, exist_ok=True)
+			os.makedirs(basenameLab, exist_ok=True)
 
-			filenameRGB = os.path.join(basenameVim, tilename + str.format("_{0:04d}", (i)) + ".png")
-			filenameLabel = os.path.join(basenameVlab, tilename + str.format("_{0:04d}", (i)) + ".png")
+			for i, sample in enumerate(tiles):
+				name = tilename + str.format("_{0:04d}", (i)) + ".png"
+				jobs.append((sample, os.path.join(basenameIm, name), os.path.join(basenameLab, name)))
 
-			cropimg.save(filenameRGB)
-			croplabel.save(filenameLabel)
+		manifest_filename = os.path.join(basename, TILES_MANIFEST)
+		resume = resume and readTilesManifest(manifest_filename) == manifest
 
+		# the tiles of a previous export are removed, so the tiles found by a resume are the ones of this export
+		if not resume:
+			for (sample, filenameRGB, filenameLabel) in jobs:
+				for filename in [filenameRGB, filenameLabel]:
+					if os.path.exists(filename):
+						os.remove(filename)
 
-		##### TEST AREA
+		with open(manifest_filename, "w") as f:
+			json.dump(manifest, f)
 
-		basenameTestIm = os.path.join(basename, os.path.join("test", "images"))
-		try:
-			os.makedirs(basenameTestIm)
-		except:
-			pass
+		if workers is None:
+			workers = os.cpu_count() or 1
 
-		basenameTestLab = os.path.join(basename, os.path.join("test", "labels"))
-		try:
-			os.makedirs(basenameTestLab)
-		except:
-			pass
-
-		for i, sample in enumerate(self.test_tiles):
-
-			cx = sample[0]
-			cy = sample[1]
-			top = cy - half_tile_size
-			left = cx - half_tile_size
-
-			cropimg = utils.cropQImage(self.ortho_image, [top, left, self.tile_size, self.tile_size])
-			croplabel = utils.cropQImage(self.label_image, [top, left, self.tile_size, self.tile_size])
-
-			filenameRGB = os.path.join(basenameTestIm, tilename + str.format("_{0:04d}", (i)) + ".png")
-			filenameLabel = os.path.join(basenameTestLab, tilename + str.format("_{0:04d}", (i)) + ".png")
-
-			cropimg.save(filenameRGB)
-			croplabel.save(filenameLabel)
+		half_tile_size = self.tile_size / 2
 
-		##### TRAINING AREA = ENTIRE MAP / (VALIDATION AREA U TEST_AREA)
+		with ThreadPoolExecutor(max_workers=workers) as executor:
 
-		basenameTrainIm = os.path.join(basename, os.path.join("training", "images"))
-		try:
-			os.makedirs(basenameTrainIm)
-		except:
-			pass
+			# the tiles waiting to be written are limited, to bound the memory used by the crops
+			pending = deque()
+			for i, (sample, filenameRGB, filenameLabel) in enumerate(jobs):
 
-		basenameTrainLab = os.path.join(basename, os.path.join("training", "labels"))
-		try:
-			os.makedirs(basenameTrainLab)
-		except:
-			pass
+				top = int(sample[1] - half_tile_size)
+				left = int(sample[0] - half_tile_size)
 
-		for i, sample in enumerate(self.training_tiles):
+				# the image and the label of a tile are skipped only together
+				if not (resume and os.path.exists(filenameRGB) and os.path.exists(filenameLabel)):
+					for buffer, filename in [(ortho_buffer, filenameRGB), (label_buffer, filenameLabel)]:
+						crop = cropTile(buffer, top, left, self.tile_size)
+						pending.append(executor.submit(saveTile, filename, crop, compression))
 
-			cx = sample[0]
-			cy = sample[1]
-			top = cy - half_tile_size
-			left = cx - half_tile_size
+				while len(pending) > 4 * workers:
+					pending.popleft().result()
 
-			cropimg = utils.cropQImage(self.ortho_image, [top, left, self.tile_size, self.tile_size])
-			croplabel = utils.cropQImage(self.label_image, [top, left, self.tile_size, self.tile_size])
+				if progress_bar is not None and i % 10 == 0:
+					progress_bar.setProgress(round((100.0 * i) / len(jobs)))
+					QApplication.processEvents()
 
-			filenameRGB = os.path.join(basenameTrainIm, tilename + str.format("_{0:04d}", (i)) + ".png")
-			filenameLabel = os.path.join(basenameTrainLab, tilename + str.format("_{0:04d}", (i)) + ".png")
+			while len(pending) > 0:
+				pending.popleft().result()
 
-			cropimg.save(filenameRGB)
-			croplabel.save(filenameLabel)
+		if progress_bar is not None:
+			progress_bar.setProgress(100.0)
+			QApplication.processEvents()
 
 
 	##### SERVICE FUNCTIONS
@@ -17,6 +17,7 @@ from source.Label import Label
 from source.Correspondences import Correspondences
 from source.Genet import Genet
 from source import utils
+from source import ProjectStorage
 from source.Grid import Grid
 from source.RegionAttributes import RegionAttributes
 
@@ -24,17 +25,30 @@ def loadProject(taglab_working_dir, filename, default_dict):
 
     dir = QDir(taglab_working_dir)
     filename = dir.relativeFilePath(filename)
-    f = open(filename, "r")
-    try:
-        data = json.load(f)
-    except json.JSONDecodeError as e:
-        raise Exception(str(e))
 
+    if ProjectStorage.isBinaryProject(filename):
+        try:
+            data = ProjectStorage.loadBinaryProject(filename)
+        except json.JSONDecodeError as e:
+            raise Exception(str(e))
 
+        project = Project(**data)
 
-    project = Project(**data)
+        # the layers just read must not be rewritten by the next save
+        project.saved_layers[os.path.abspath(filename)] = {
+            ProjectStorage.layerFilename(annotations):
+                ProjectStorage.layerState(annotations.revision, annotations.pendingBlobs())
+            for image in project.images for annotations in image.annotationLayers}
+    else:
+        f = open(filename, "r")
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise Exception(str(e))
 
-    f.close()
+        project = Project(**data)
+
+        f.close()
 
     if project.dictionary_name == "":
         project.dictionary_name = "My dictionary"
@@ -113,6 +127,18 @@ class ProjectEncoder(json.JSONEncoder):
             return obj.save()
         return json.JSONEncoder.default(self, obj)
 
+class ManifestEncoder(ProjectEncoder):
+    """
+    Encoder of the manifest of the binary projects: the blobs of each annotation layer are replaced
+    by the name of the file where they are stored.
+    """
+    def default(self, obj):
+        if isinstance(obj, Annotation):
+            data = obj.save(blobs=False)
+            data["seg_blobs_file"] = ProjectStorage.layerFilename(obj)
+            return data
+        return ProjectEncoder.default(self, obj)
+
 class Project(object):
 
     def __init__(self, filename=None, labels={}, images=[], correspondences=None,
@@ -121,6 +147,9 @@ class Project(object):
 
         self.filename = None                                             #filename with path of the project json
 
+        # states of the layers written by the last save of each binary project file (filename -> states)
+        self.saved_layers = {}
+
         # area of the images where the user annotate the data
         # NOTE 1: since the images are co-registered the working area is the same for all the images
         # NOTE 2: the working area is a RECTANGULAR region stored as [top, left, width, height]
@@ -236,11 +265,23 @@ class Project(object):
                     msgBox.setText("Inconsistent correspondences has been found !!\nPlease, Notify this problem to the TagLab developers.")
                     msgBox.exec()
 
-        data = self.__dict__
-        str = json.dumps(data, cls=ProjectEncoder, indent=1)
+        data = self.__dict__.copy()
+        del data["saved_layers"]
 
         if filename is None:
             filename = self.filename
+
+        if ProjectStorage.isBinaryProject(filename):
+            str = json.dumps(data, cls=ManifestEncoder, indent=1)
+            layers = [(ProjectStorage.layerFilename(annotations), annotations.revision, annotations.savedBlobs())
+                      for image in self.images for annotations in image.annotationLayers]
+            key = os.path.abspath(filename)
+            self.saved_layers[key] = ProjectStorage.saveBinaryProject(filename, str, layers,
+                                                                      self.saved_layers.get(key, {}))
+            return
+
+        str = json.dumps(data, cls=ProjectEncoder, indent=1)
+
         f = open(filename, "w")
         f.write(str)
         f.close()
@@ -289,7 +330,7 @@ class Project(object):
         """
         Update the genets information in (1) the regions and (2) in the correspondences' table
         """
-        self.genet.updateGenets()
+        self.genet.sync()
         corr = self.getImagePairCorrespondences(source_img, source_annotations, target_img, target_annotaions)
         corr.updateGenets()
         return corr
@@ -303,6 +344,8 @@ class Project(object):
         for corr in self.findCorrespondences(image):
             corr.addBlob(image, blob)
 
+        self.genet.addBlob(annotations, blob)
+
     def removeBlob(self, image, annotations, blob):
 
         # updata annotations
@@ -312,6 +355,8 @@ class Project(object):
         for corr in self.findCorrespondences(image):
             corr.removeBlob(image, blob)
 
+        self.genet.removeBlob(annotations, blob)
+
     def updateBlob(self, image, annotations, old_blob, new_blob):
 
         # update annotations
@@ -321,6 +366,8 @@ class Project(object):
         for corr in self.findCorrespondences(image):
             corr.updateBlob(image, old_blob, new_blob)
 
+        self.genet.updateBlob(annotations, old_blob, new_blob)
+
     def getImageFromId(self, id):
         for img in self.images:
             if img.id == id:
@@ -371,7 +418,7 @@ class Project(object):
 
         corr = self.getImagePairCorrespondences(source_img, source_annotations, target_img, target_annotaions)
         corr.set(blobs1, blobs2)
-        self.genet.updateGenets()
+        self.genet.updateLinks(corr)
         corr.updateGenets()
 
 
@@ -411,13 +458,13 @@ class Project(object):
         corr.autoMatch(blobs1, blobs2)
 
         lines = corr.correspondences + corr.dead + corr.born
-        corr.data = pd.DataFrame(lines, columns=corr.data.columns)
+        corr.setRows(lines)
         corr.sort_data()
         corr.correspondence = []
         corr.dead = []
         corr.born =[]
 
-        self.genet.updateGenets()
+        self.genet.updateLinks(corr)
         corr.updateGenets()
      
 
@@ -0,0 +1,245 @@
+"""
+Binary storage of a project (.tlp). The project is saved as a JSON manifest with the same structure of the
+JSON project, except for the blobs of the annotation layers. The blobs of each layer are stored column-wise
+in a separate .npz file of the folder <project name>.layers, and the contours are packed in a single int32
+array (with the same precision of the JSON format, 0.1 pixels).
+Each layer file is rewritten only if its content has been changed since the last save.
+"""
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from source.Blob import Blob
+
+BINARY_EXTENSION = ".tlp"
+FORMAT_VERSION = 1
+
+
+def isBinaryProject(filename):
+    return os.path.splitext(filename)[1].lower() == BINARY_EXTENSION
+
+def layersFolder(filename):
+    """
+    It returns the folder where the blobs of the layers of the project are stored.
+    """
+    return os.path.splitext(filename)[0] + ".layers"
+
+def layerFilename(annotations):
+    name = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(annotations.id))
+    return "layer_" + name + ".npz"
+
+def packContours(contours):
+    """
+    It packs a list of contours (N x 2) in a single int32 array of points, plus the offsets of each contour.
+    """
+    counts = np.array([len(c) for c in contours], dtype=np.int64)
+    offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    if len(contours) == 0 or offsets[-1] == 0:
+        return np.zeros((0, 2), dtype=np.int32), offsets
+
+    points = np.concatenate([np.asarray(c, dtype=np.float64).reshape(-1, 2) for c in contours])
+    # same quantization of Blob.toPoints
+    points = (points * 10).astype(np.int32)
+    return points, offsets
+
+def unpackContours(points, offsets):
+
+    contours = points / 10.0
+    return [contours[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+def blobsToColumns(blobs):
+    """
+    It converts the blobs of a layer to a dictionary of numpy arrays (one per attribute).
+    """
+    n = len(blobs)
+    columns = {}
+    columns["version"] = np.array([FORMAT_VERSION], dtype=np.int32)
+    columns["id"] = np.array([blob.id for blob in blobs], dtype=np.int64)
+    columns["bbox"] = np.array([blob.bbox for blob in blobs], dtype=np.int32).reshape(n, 4)
+    columns["centroid"] = np.array([blob.centroid for blob in blobs], dtype=np.float64).reshape(n, 2)
+    columns["area"] = np.array([blob.area for blob in blobs], dtype=np.float64)
+    columns["perimeter"] = np.array([blob.perimeter for blob in blobs], dtype=np.float64)
+
+    (points, offsets) = packContours([blob.contour for blob in blobs])
+    columns["contour_points"] = points
+    columns["contour_offsets"] = offsets
+
+    inner_contours = []
+    inner_counts = np.zeros(n, dtype=np.int64)
+    for i, blob in enumerate(blobs):
+        inner_contours.extend(blob.inner_contours)
+        inner_counts[i] = len(blob.inner_contours)
+    (points, offsets) = packContours(inner_contours)
+    columns["inner_counts"] = inner_counts
+    columns["inner_points"] = points
+    columns["inner_offsets"] = offsets
+
+    columns["records"] = np.frombuffer(blobsRecords(blobs), dtype=np.uint8)
+
+    return columns
+
+def blobsRecords(blobs):
+    """
+    It returns the attributes of the blobs that are not numeric, stored as a JSON text.
+    """
+    records = [[blob.class_name, blob.instance_name, blob.blob_name, blob.note, blob.confidence, blob.data]
+               for blob in blobs]
+    return json.dumps(records, separators=(',', ':')).encode("utf-8")
+
+def columnsToBlobs(columns):
+    """
+    It creates the blobs stored in the given columns (see blobsToColumns).
+    """
+    records = json.loads(columns["records"].tobytes().decode("utf-8"))
+
+    contours = unpackContours(columns["contour_points"], columns["contour_offsets"])
+    inner_contours = unpackContours(columns["inner_points"], columns["inner_offsets"])
+    inner_start = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum(columns["inner_counts"], out=inner_start[1:])
+
+    ids = columns["id"].tolist()
+    bboxes = columns["bbox"].astype(np.int64)
+    centroids = columns["centroid"]
+    areas = columns["area"].tolist()
+    perimeters = columns["perimeter"].tolist()
+
+    blobs = []
+    for i, record in enumerate(records):
+        blob = Blob(None, 0, 0, 0)
+        blob.bbox = bboxes[i].copy()
+        blob.centroid = centroids[i].copy()
+        blob.area = areas[i]
+        blob.perimeter = perimeters[i]
+        blob.contour = contours[i]
+        blob.inner_contours = inner_contours[inner_start[i]:inner_start[i + 1]]
+        (blob.class_name, blob.instance_name, blob.blob_name, blob.note, blob.confidence, blob.data) = record
+        blob.id = int(ids[i])
+        blobs.append(blob)
+
+    return blobs
+
+class LayerColumns(object):
+    """
+    The blobs of a layer read from a binary project, they are created when the layer is used (see Annotation.hydrate).
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def __call__(self):
+        return columnsToBlobs(self.columns)
+
+def layerToColumns(blobs):
+    """
+    It converts the blobs of a layer to columns. The blobs of a layer never used are its records, as loaded:
+    the columns read from a binary project are saved as they are, the records of a JSON project are converted.
+    """
+    if isinstance(blobs, LayerColumns):
+        return blobs.columns
+
+    if callable(blobs):
+        blobs = blobs()
+
+    converted = []
+    for record in blobs:
+        if isinstance(record, dict):
+            blob = Blob(None, 0, 0, 0)
+            blob.fromDict(record)
+            record = blob
+        converted.append(record)
+
+    return blobsToColumns(converted)
+
+def layerState(revision, blobs):
+    """
+    State of a layer, used to detect the layers changed since the last save without serializing their blobs.
+    The revision of the layer changes when a blob is added or removed, the digest of the records detects
+    the attributes edited in place (class, note, ...). The records of a layer never used cannot change.
+    """
+    if isinstance(blobs, LayerColumns):
+        records = blobs.columns["records"].tobytes()
+    elif callable(blobs) or any(isinstance(record, dict) for record in blobs[:1]):
+        return (revision, None)
+    else:
+        records = blobsRecords(blobs)
+
+    return (revision, hashlib.sha1(records).hexdigest())
+
+def replaceFile(filename, write):
+    """
+    It writes a file through a temporary file, so an interrupted save does not corrupt the previous one.
+    """
+    temp = filename + ".tmp"
+    with open(temp, "wb") as f:
+        write(f)
+    os.replace(temp, filename)
+
+def writeLayer(filename, columns):
+    replaceFile(filename, lambda f: np.savez_compressed(f, **columns))
+
+def readLayer(filename):
+
+    with np.load(filename) as data:
+        columns = {key: data[key] for key in data.files}
+
+    version = int(columns["version"][0])
+    if version > FORMAT_VERSION:
+        raise Exception("The layer " + filename + " has been saved by a newer version of TagLab.")
+
+    return columns
+
+def saveBinaryProject(filename, manifest, layers, saved):
+    """
+    It saves a project in the binary format. manifest is the JSON text of the project, where the blobs of each
+    annotation layer are replaced by a reference to its layer file; layers is a list of (layer file, revision,
+    blobs), where the blobs of a layer never used are its records (see layerToColumns);
+    saved is the dictionary (layer file -> state) of the last save on this file.
+    It returns the updated states.
+    """
+    folder = layersFolder(filename)
+    os.makedirs(folder, exist_ok=True)
+
+    states = {}
+    for (name, revision, blobs) in layers:
+        path = os.path.join(folder, name)
+        state = layerState(revision, blobs)
+        if saved.get(name) != state or not os.path.exists(path):
+            writeLayer(path, layerToColumns(blobs))
+        states[name] = state
+
+    replaceFile(filename, lambda f: f.write(manifest.encode("utf-8")))
+
+    # remove the layers deleted from the project
+    for name in os.listdir(folder):
+        if name.startswith("layer_") and name.endswith(".npz") and name not in states:
+            os.remove(os.path.join(folder, name))
+
+    return states
+
+def loadBinaryProject(filename):
+    """
+    It reads a binary project. It returns the project data (as the JSON project, the blobs of each layer are
+    replaced by a function that creates them).
+    """
+    with open(filename, "r") as f:
+        data = json.load(f)
+
+    folder = layersFolder(filename)
+    for image in data.get("images", []):
+        for annotations in image.get("annotationLayers", []):
+            name = annotations.pop("seg_blobs_file", None)
+            if name is None:
+                continue
+            columns = readLayer(os.path.join(folder, name))
+            # the blobs are created when the layer is used (see Annotation.hydrate)
+            annotations["seg_blobs"] = LayerColumns(columns)
+
+    return data
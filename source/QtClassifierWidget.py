@@ -54,6 +54,28 @@ class QtClassifierWidget(QWidget):
         layoutH0.addStretch()
         layoutH0.addWidget(self.lblClassifier)
         layoutH0.addWidget(self.comboClassifier)
+        layoutH0.addSpacing(20)
+
+        # aggregation of the scores of the overlapping tiles (see MapClassifier.aggregateScores)
+        self.lblAggregation = QLabel("Scores aggregation: ")
+
+        self.comboAggregation = QComboBox()
+        self.comboAggregation.addItem("Average")
+        self.comboAggregation.addItem("Bayesian")
+
+        layoutH0.addWidget(self.lblAggregation)
+        layoutH0.addWidget(self.comboAggregation)
+        layoutH0.addSpacing(20)
+
+        # number of crops classified together, each tile has 9 shifted crops
+        self.lblBatchSize = QLabel("Batch size: ")
+
+        self.comboBatchSize = QComboBox()
+        for batch_size in [9, 18, 36, 72]:
+            self.comboBatchSize.addItem(str(batch_size))
+
+        layoutH0.addWidget(self.lblBatchSize)
+        layoutH0.addWidget(self.comboBatchSize)
         layoutH0.addStretch()
 
         self.lblFilename = QLabel("Filename: ")
@@ -404,6 +426,14 @@ class QtClassifierWidget(QWidget):
 
         return self.classifiers[self.comboClassifier.currentIndex()]
 
+    def aggregation(self):
+
+        return self.comboAggregation.currentText().lower()
+
+    def batchSize(self):
+
+        return int(self.comboBatchSize.currentText())
+
     def classes2str(self, classes_dict):
 
         txt = ""
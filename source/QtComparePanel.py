@@ -30,9 +30,10 @@ imdir =imdir.replace('source', '')
 
 class TableModel(QAbstractTableModel):
 
-    def __init__(self, data):
+    def __init__(self, data, correspondences=None):
         super(TableModel, self).__init__()
         self._data = data
+        self._correspondences = correspondences
         self.surface_area_mode_enabled = False
 
     def enableSurfaceAreaMode(self):
@@ -80,7 +81,11 @@ class TableModel(QAbstractTableModel):
 
         if index.isValid() and role == Qt.EditRole:
 
-            self._data.iloc[index.row(), index.column()] = value
+            if self._correspondences is not None:
+                # the change is stored in the correspondences table (it updates also the shown data)
+                self._correspondences.setValue(index.row(), index.column(), value)
+            else:
+                self._data.iloc[index.row(), index.column()] = value
         else:
             return False
 
@@ -392,7 +397,7 @@ height: 0px;
 
         if self.model is None:
 
-            self.model = TableModel(self.data)
+            self.model = TableModel(self.data, self.correspondences)
             self.sortfilter = QSortFilterProxyModel(self)
             self.sortfilter.setSourceModel(self.model)
             self.sortfilter.setSortRole(Qt.UserRole)
@@ -479,6 +484,7 @@ height: 0px;
         self.sortfilter.beginResetModel()
         self.model.beginResetModel()
         self.model._data = corr.data
+        self.model._correspondences = corr
         self.sortfilter.endResetModel()
         self.model.endResetModel()
 
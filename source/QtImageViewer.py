@@ -3,10 +3,14 @@ from PyQt5.QtCore import Qt, QPointF, QRectF, QFileInfo, QDir, pyqtSlot, pyqtSig
 from PyQt5.QtGui import QImage, QPixmap, QPainter, QPainterPath, QPen, QImageReader
 from PyQt5.QtWidgets import QApplication, QGraphicsView, QGraphicsScene, QFileDialog, QGraphicsPixmapItem
 
+from source.QtTiledImageItem import QtTiledImageItem
+
 class QtImageViewer(QGraphicsView):
     """
     Basic PyQt image viewer with pan and zoom capabilities.
     The input image (it must be a QImage) is internally converted into a QPixmap.
+    Very large images can be shown as a tiled pyramid (see setTiledImg), in this case the full image (img_map)
+    is loaded only when it is requested.
     """
 
     viewUpdated = pyqtSignal(QRectF)                  # region visible in percentage
@@ -26,9 +30,15 @@ class QtImageViewer(QGraphicsView):
         self.pixmapitem.setZValue(0)
         self.scene.addItem(self.pixmapitem)
 
+        # tiled image (alternative to the pixmap)
+        self.tileditem = QtTiledImageItem()
+        self.tileditem.setZValue(0)
+        self.scene.addItem(self.tileditem)
+
         # OVERLAY
         self.scene_overlay = QGraphicsScene()
 
+        self.img_loader = None    # function loading the full image of a tiled image
         self.img_map = None
 
         # current image size
@@ -70,12 +80,56 @@ class QtImageViewer(QGraphicsView):
         self.setMouseTracking(True)
         self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
 
+    @property
+    def img_map(self):
+        if self._img_map is None and self.img_loader is not None:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            self._img_map = self.img_loader()
+            QApplication.restoreOverrideCursor()
+        return self._img_map
+
+    @img_map.setter
+    def img_map(self, img):
+        self._img_map = img
+
+    def setTiledImg(self, pyramid, loader, zoomf=0.0):
+        """
+        Set the scene's current image as a tiled pyramid, loader is the function that loads the full image (QImage).
+        For calculating the zoom factor automatically set it to 0.0.
+        """
+
+        self.img_loader = loader
+        self.img_map = None
+
+        self.pixmap = QPixmap()
+        self.pixmapitem.setPixmap(self.pixmap)
+        self.tileditem.setPyramid(pyramid)
+
+        self.imgwidth = pyramid.width()
+        self.imgheight = pyramid.height()
+        if self.imgheight:
+            self.ZOOM_FACTOR_MIN = min(1.0 * self.width() / self.imgwidth, 1.0 * self.height() / self.imgheight)
+
+        if zoomf < 0.0000001:
+
+            self.setSceneRect(QRectF(0, 0, self.imgwidth, self.imgheight))
+
+            pixels_of_border = 10
+            zf1 = (self.viewport().width() - pixels_of_border) / self.imgwidth
+            zf2 = (self.viewport().height() - pixels_of_border) / self.imgheight
+            self.zoom_factor = min(zf1, zf2)
+
+        self.updateViewer()
+
     def setImg(self, img, zoomf=0.0):
         """
         Set the scene's current image (input image must be a QImage)
         For calculating the zoom factor automatically set it to 0.0.
         """
 
+        self.img_loader = None
+        self.tileditem.setPyramid(None)
+
         self.img_map = img
         if type(img) is QImage:
             imageARGB32 = img.convertToFormat(QImage.Format_ARGB32)
@@ -137,6 +191,8 @@ class QtImageViewer(QGraphicsView):
 
     def clear(self):
         self.pixmapitem.setPixmap(QPixmap())
+        self.tileditem.setPyramid(None)
+        self.img_loader = None
         self.img_map = None
 
     def disableScrollBars(self):
@@ -169,9 +225,9 @@ class QtImageViewer(QGraphicsView):
 
     def clampCoords(self, x, y):
 
-        if self.img_map is not None:
-            xc = max(0, min(int(x), self.img_map.width()))
-            yc = max(0, min(int(y), self.img_map.height()))
+        if self.imgwidth > 0:
+            xc = max(0, min(int(x), self.imgwidth))
+            yc = max(0, min(int(y), self.imgheight))
         else:
             xc = 0
             yc = 0
@@ -225,8 +281,8 @@ class QtImageViewer(QGraphicsView):
 
         zf = self.zoom_factor
 
-        xmap = float(self.img_map.width()) * x
-        ymap = float(self.img_map.height()) * y
+        xmap = float(self.imgwidth) * x
+        ymap = float(self.imgheight) * y
 
         view = self.viewportToScene()
         (w, h) = (view.width(), view.height())
@@ -234,8 +290,8 @@ class QtImageViewer(QGraphicsView):
         posx = max(0, xmap - w / 2)
         posy = max(0, ymap - h / 2)
 
-        posx = min(posx, self.img_map.width() - w / 2)
-        posy = min(posy, self.img_map.height() - h / 2)
+        posx = min(posx, self.imgwidth - w / 2)
+        posy = min(posy, self.imgheight - h / 2)
 
         self.horizontalScrollBar().setValue(posx * zf)
         self.verticalScrollBar().setValue(posy * zf)
@@ -22,15 +22,17 @@
 """
 
 import os.path
-from PyQt5.QtCore import Qt, QPoint, QPointF, QRectF, QFileInfo, QDir, pyqtSlot, pyqtSignal, QT_VERSION_STR
+from PyQt5.QtCore import Qt, QPoint, QPointF, QRectF, QFileInfo, QDir, QTimer, pyqtSlot, pyqtSignal, QT_VERSION_STR
 from PyQt5.QtGui import QImage, QPixmap, QPainter, QPainterPath, QPen, QColor, QFont, QBrush
 from PyQt5.QtWidgets import QApplication, QGraphicsView, QGraphicsScene, QFileDialog, QGraphicsItem, QGraphicsSimpleTextItem, QPlainTextEdit,QSizePolicy,QMessageBox
+from PyQt5.QtWidgets import QGraphicsPathItem, QGraphicsPixmapItem, QStyleOptionGraphicsItem
 
 from source.Undo import Undo
 from source.Project import Project
 from source.Image import Image
 from source.Annotation import Annotation
 from source.Annotation import Blob
+from source.Blob import levelOfDetail
 from source.Tools import Tools
 from source.Label import Label
 
@@ -46,6 +48,14 @@ import math
 # 4: selected blobs text
 # 5: pick points and tools
 
+# below this zoom the layers with many blobs are drawn as a single image (the overview) instead of one item per blob
+OVERVIEW_ZOOM = 0.25
+OVERVIEW_MIN_BLOBS = 2000
+OVERVIEW_MAX_SIZE = 8192
+
+# the ids of the blobs are drawn only above this zoom
+IDS_MIN_ZOOM = 0.5
+
 
 
 class TextItem(QGraphicsSimpleTextItem):
@@ -64,6 +74,53 @@ class TextItem(QGraphicsSimpleTextItem):
         return QRectF(b.x()-b.width()/2.0, b.y()-b.height()/2.0, b.width(), b.height())
 
 
+class BlobGroup(QGraphicsItem):
+    """
+    Parent item of the items of the blobs of a class (or of their ids). The visibility, the opacity and the
+    style of the blobs are set once for the whole class. It does not draw anything.
+    """
+    def __init__(self, z):
+        QGraphicsItem.__init__(self)
+        self.pen = QPen(Qt.NoPen)
+        self.brush = QBrush(Qt.NoBrush)
+        self.class_brush = QBrush(Qt.NoBrush)
+        self.setFlag(QGraphicsItem.ItemHasNoContents)
+        self.setZValue(z)
+
+    def boundingRect(self):
+        return QRectF()
+
+    def paint(self, painter, option, widget):
+        pass
+
+
+class BlobItem(QGraphicsPathItem):
+    """
+    Graphics item of a blob. The path of the item is the full resolution one, but the blob is painted
+    with the contours simplified according to the current zoom (see Blob.lodPath).
+    The blobs in a class group are painted with the pen and the brush of the group.
+    """
+    def __init__(self, blob):
+        QGraphicsPathItem.__init__(self, blob.qpath)
+        self.blob = blob
+        # the blob can be hidden on its own, regardless of the visibility of its class (see setBlobVisible)
+        self.hidden = False
+
+    def paint(self, painter, option, widget):
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        path = self.blob.lodPath(levelOfDetail(scale))
+        if path is None:
+            return
+        group = self.parentItem()
+        if group is None:
+            painter.setPen(self.pen())
+            painter.setBrush(self.brush())
+        else:
+            painter.setPen(group.pen)
+            painter.setBrush(group.brush)
+        painter.drawPath(path)
+
+
 class NoteWidget(QPlainTextEdit):
 
     editFinishing = pyqtSignal()
@@ -142,7 +199,7 @@ class QtImageViewerPlus(QtImageViewer):
         # DRAWING SETTINGS
         self.fill_enabled = True
         self.border_enabled = True
-        self.ids_enable = True
+        self.ids_enabled = True
 
         self.show_grid = False
 
@@ -188,6 +245,21 @@ class QtImageViewerPlus(QtImageViewer):
         # working area
         self.working_area_rect = None
 
+        # level of detail: at overview zoom the blobs are drawn by the overview image
+        self.overview = False
+        self.overview_item = None
+        self.overview_dirty = True
+        self.overview_scheduled = False
+        self.ids_drawn = True
+
+        # class name -> (group of the blob items, group of the id items)
+        self.class_groups = {}
+
+        # bulk changes of the blobs (see beginUpdate)
+        self.update_depth = 0
+        self.update_pending = False
+        self.selection_pending = False
+
     def setProject(self, project):
 
         self.project = project
@@ -221,14 +293,18 @@ class QtImageViewerPlus(QtImageViewer):
 
     def setAnnotations(self, annotations):
         self.annotations = annotations
+        self.invalidateOverview()
+        self.updateLevelOfDetail()
 
     def toggleAnnotations(self, enable):
         if self.annotations is not None:
+            self.beginUpdate()
             for blob in self.annotations.seg_blobs:
                 if enable:
                     self.drawBlob(blob)
                 else:
                     self.undrawBlob(blob)
+            self.endUpdate()
 
 
     def updateImageProperties(self):
@@ -249,6 +325,20 @@ class QtImageViewerPlus(QtImageViewer):
 
         self.channel = channel
 
+        # the very large maps are visualized by tiles, the full image is loaded only if a tool needs it
+        if channel.isTiled():
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            pyramid = channel.loadPyramid(self.logfile)
+            QApplication.restoreOverrideCursor()
+
+            if pyramid is not None:
+                loader = lambda: channel.qimage if channel.qimage is not None else channel.loadData()
+                if switch:
+                    self.setTiledImg(pyramid, loader, self.zoom_factor)
+                else:
+                    self.setTiledImg(pyramid, loader)
+                return
+
         if channel.qimage is not None:
             img = channel.qimage
         else:
@@ -302,6 +392,8 @@ class QtImageViewerPlus(QtImageViewer):
             self.working_area_rect = None
 
         self.hideGrid()
+        self.removeOverview()
+        self.removeGroups()
         # undraw and clear current image and channel
         QtImageViewer.clear(self)
         self.image = None
@@ -411,21 +503,14 @@ class QtImageViewerPlus(QtImageViewer):
             self.showGrid()
 
     def enableFill(self):
-        if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
-                brush = self.annotations.classBrushFromName(blob)
-                if blob.qpath_gitem is not None:
-                    blob.qpath_gitem.setBrush(brush)
-
-            self.fill_enabled = True
+        self.fill_enabled = True
+        self.updateGroups()
+        self.invalidateOverview()
 
     def disableFill(self):
-        if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
-                if blob.qpath_gitem is not None:
-                    blob.qpath_gitem.setBrush(QBrush(Qt.NoBrush))
-
-            self.fill_enabled = False
+        self.fill_enabled = False
+        self.updateGroups()
+        self.invalidateOverview()
 
     @pyqtSlot(int)
     def toggleFill(self, checked):
@@ -436,21 +521,14 @@ class QtImageViewerPlus(QtImageViewer):
             self.enableFill()
 
     def enableBorders(self):
-        if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
-                pen = self.border_selected_pen if blob in self.selected_blobs else self.border_pen
-                if blob.qpath_gitem is not None:
-                    blob.qpath_gitem.setPen(pen)
-
         self.border_enabled = True
+        self.updateGroups()
+        self.invalidateOverview()
 
     def disableBorders(self):
-        if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
-                if blob.qpath_gitem is not None:
-                    blob.qpath_gitem.setPen(QPen(Qt.NoPen))
-
         self.border_enabled = False
+        self.updateGroups()
+        self.invalidateOverview()
 
     @pyqtSlot(int)
     def toggleBorders(self, checked):
@@ -461,20 +539,12 @@ class QtImageViewerPlus(QtImageViewer):
             self.enableBorders()
 
     def enableIds(self):
-        if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
-                if blob.id_item is not None:
-                    blob.id_item.setVisible(True)
-
-            self.ids_enabled = True
+        self.ids_enabled = True
+        self.updateGroups()
 
     def disableIds(self):
-        if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
-                if blob.id_item is not None:
-                    blob.id_item.setVisible(False)
-
-            self.ids_enabled = False
+        self.ids_enabled = False
+        self.updateGroups()
 
     @pyqtSlot(int)
     def toggleIds(self, checked):
@@ -571,25 +641,18 @@ class QtImageViewerPlus(QtImageViewer):
             blob.id_item = None
 
         blob.setupForDrawing()
-        pen = self.border_selected_pen if blob in self.selected_blobs else self.border_pen
 
-        brush = self.annotations.classBrushFromName(blob)
-        blob.qpath_gitem = self.scene.addPath(blob.qpath, pen, brush)
-        blob.qpath_gitem.setZValue(1)
-        blob.qpath_gitem.setOpacity(self.transparency_value)
+        blob.qpath_gitem = BlobItem(blob)
 
         font_size = 12
         blob.id_item = TextItem(str(blob.id),  QFont("Roboto", font_size, QFont.Bold))
         blob.id_item.setPos(blob.centroid[0], blob.centroid[1])
         blob.id_item.setTransformOriginPoint(QPointF(blob.centroid[0] + 14.0, blob.centroid[1] + 14.0))
-        blob.id_item.setZValue(2)
         blob.id_item.setBrush(Qt.white)
 
-        if blob in self.selected_blobs:
-            blob.id_item.setOpacity(1.0)
-        else:
-            blob.id_item.setOpacity(0.7)
-        self.scene.addItem(blob.id_item)
+        # the items are added to the scene with their group
+        self.setBlobGroup(blob, blob in self.selected_blobs)
+        self.invalidateOverview()
 
     def undrawBlob(self, blob):
 
@@ -598,19 +661,249 @@ class QtImageViewerPlus(QtImageViewer):
         blob.qpath = None
         blob.qpath_gitem = None
         blob.id_item = None
-        self.scene.invalidate()
+        self.invalidateOverview()
+        self.requestSceneUpdate()
 
     def applyTransparency(self, value):
         self.transparency_value = 1.0 - (value / 100.0)
-        # current annotations
-        if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
-                blob.qpath_gitem.setOpacity(self.transparency_value)
+        self.updateGroups()
+        if self.overview_item is not None:
+            self.overview_item.setOpacity(self.transparency_value)
 
     def redrawAllBlobs(self):
-        if self.annotations is not None: 
-            for blob in self.annotations.seg_blobs:
-                self.drawBlob(blob)
+        """
+        It updates the drawing of the blobs after a change of the colors of the classes.
+        """
+        if self.annotations is not None:
+            for (class_name, (group, id_group)) in self.class_groups.items():
+                if class_name == "Empty" or class_name in self.annotations.labels:
+                    group.class_brush = self.annotations.classBrush(class_name)
+            self.updateGroups()
+            self.invalidateOverview()
+
+    def blobGroups(self, blob):
+        """
+        It returns the groups (blob items, id items) of the class of the blob, they are created the first time.
+        """
+        groups = self.class_groups.get(blob.class_name)
+        if groups is None:
+            groups = (BlobGroup(1), BlobGroup(2))
+            groups[0].class_brush = self.annotations.classBrushFromName(blob)
+            self.scene.addItem(groups[0])
+            self.scene.addItem(groups[1])
+            self.class_groups[blob.class_name] = groups
+            self.styleGroups(blob.class_name, groups)
+        return groups
+
+    def styleGroups(self, class_name, groups):
+        """
+        It applies the current drawing settings to the groups of a class.
+        """
+        (group, id_group) = groups
+
+        label = self.annotations.labels.get(class_name) if self.annotations is not None else None
+        visible = label.visible if label is not None else True
+
+        group.pen = self.border_pen if self.border_enabled else QPen(Qt.NoPen)
+        group.brush = group.class_brush if self.fill_enabled else QBrush(Qt.NoBrush)
+        group.setVisible(visible)
+        # at overview zoom the blobs are drawn by the overview image
+        group.setOpacity(0.0 if self.overview else self.transparency_value)
+
+        id_group.setVisible(visible and self.ids_enabled)
+        id_group.setOpacity(0.7 if self.ids_drawn else 0.0)
+
+    def updateGroups(self):
+        """
+        It applies the current drawing settings to all the groups and to the selected blobs.
+        """
+        for (class_name, groups) in self.class_groups.items():
+            self.styleGroups(class_name, groups)
+
+        for blob in self.selected_blobs:
+            self.setBlobGroup(blob, True)
+
+        self.requestSceneUpdate()
+
+    def removeGroups(self):
+        for (group, id_group) in self.class_groups.values():
+            self.scene.removeItem(group)
+            self.scene.removeItem(id_group)
+        self.class_groups = {}
+
+    def setBlobGroup(self, blob, selected):
+        """
+        It places the items of the blob in the groups of its class. The selected blobs are moved out of the
+        groups, they are drawn above the others with their own style.
+        """
+        item = blob.qpath_gitem
+        id_item = blob.id_item
+        if item is None:
+            return
+
+        (group, id_group) = self.blobGroups(blob)
+
+        if selected:
+            item.setParentItem(None)
+            id_item.setParentItem(None)
+            if item.scene() is None:
+                self.scene.addItem(item)
+                self.scene.addItem(id_item)
+
+            item.setPen(self.border_selected_pen if self.border_enabled else QPen(Qt.NoPen))
+            item.setBrush(group.brush)
+            item.setOpacity(self.transparency_value)
+            item.setZValue(3)
+
+            id_item.setOpacity(1.0 if self.ids_drawn else 0.0)
+            id_item.setZValue(4)
+        else:
+            item.setParentItem(group)
+            id_item.setParentItem(id_group)
+
+            # only the bounding rect of the item depends on its pen
+            item.setPen(self.border_pen)
+            item.setOpacity(1.0)
+            item.setZValue(0)
+
+            id_item.setOpacity(1.0)
+            id_item.setZValue(0)
+
+        self.showBlobItems(blob)
+
+    def showBlobItems(self, blob):
+        """
+        It shows the items of the blob if both the blob and its class are visible. The items in a group
+        follow the visibility of the group, the selected ones have no group and take it explicitly.
+        """
+        item = blob.qpath_gitem
+        id_item = blob.id_item
+        visible = not item.hidden
+        if item.parentItem() is None:
+            (group, id_group) = self.blobGroups(blob)
+            item.setVisible(visible and group.isVisible())
+            id_item.setVisible(visible and id_group.isVisible())
+        else:
+            item.setVisible(visible)
+            id_item.setVisible(visible)
+
+    def beginUpdate(self):
+        """
+        It starts a bulk change of the blobs (import, undo, classification): the updates of the scene,
+        of the overview and the selection signals are deferred until the matching endUpdate.
+        """
+        if self.update_depth == 0:
+            self.viewport().setUpdatesEnabled(False)
+        self.update_depth += 1
+
+    def endUpdate(self):
+
+        self.update_depth -= 1
+        if self.update_depth > 0:
+            return
+
+        self.viewport().setUpdatesEnabled(True)
+
+        if self.overview_dirty:
+            self.invalidateOverview()
+
+        if self.update_pending:
+            self.update_pending = False
+            self.scene.invalidate()
+
+        if self.selection_pending:
+            self.selection_pending = False
+            self.selectionChanged.emit()
+
+    def requestSceneUpdate(self):
+        if self.update_depth > 0:
+            self.update_pending = True
+        else:
+            self.scene.invalidate()
+
+    def emitSelectionChanged(self):
+        if self.update_depth > 0:
+            self.selection_pending = True
+        else:
+            self.selectionChanged.emit()
+
+    def updateLevelOfDetail(self):
+        """
+        It updates the drawing of the blobs after a change of the zoom. The layers with many blobs are
+        drawn by the overview image at low zoom (only the selected blobs are drawn by their items),
+        the ids of the blobs are drawn only above IDS_MIN_ZOOM.
+        """
+        overview = self.annotations is not None and self.zoom_factor < OVERVIEW_ZOOM and \
+                   len(self.annotations.seg_blobs) >= OVERVIEW_MIN_BLOBS
+        ids_drawn = self.zoom_factor >= IDS_MIN_ZOOM
+
+        if overview != self.overview or ids_drawn != self.ids_drawn:
+            self.overview = overview
+            self.ids_drawn = ids_drawn
+            self.updateGroups()
+
+        if self.overview:
+            if self.overview_dirty:
+                QApplication.setOverrideCursor(Qt.WaitCursor)
+                self.buildOverview()
+                QApplication.restoreOverrideCursor()
+        if self.overview_item is not None:
+            self.overview_item.setVisible(self.overview)
+
+    def invalidateOverview(self):
+        """
+        The blobs have been changed, the overview is rebuilt once the current operation is finished.
+        """
+        self.overview_dirty = True
+        if self.overview and not self.overview_scheduled and self.update_depth == 0:
+            self.overview_scheduled = True
+            QTimer.singleShot(0, self.buildOverview)
+
+    def buildOverview(self):
+        """
+        It draws the visible blobs of the current annotations in an image with a reduced resolution. The blobs
+        are drawn with the pen and the brush of their class, using the contours of the matching level of detail.
+        """
+        self.overview_scheduled = False
+        if not self.overview or self.annotations is None or not self.imgwidth or self.update_depth > 0:
+            return
+
+        scale = min(OVERVIEW_ZOOM, OVERVIEW_MAX_SIZE / max(self.imgwidth, self.imgheight))
+        w = int(math.ceil(self.imgwidth * scale))
+        h = int(math.ceil(self.imgheight * scale))
+        level = levelOfDetail(scale)
+
+        overview = QImage(w, h, QImage.Format_ARGB32_Premultiplied)
+        overview.fill(Qt.transparent)
+        painter = QPainter(overview)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.scale(scale, scale)
+        for blob in self.annotations.seg_blobs:
+            item = blob.qpath_gitem
+            if item is None or not item.isVisible():
+                continue
+            group = self.class_groups[blob.class_name][0]
+            painter.setPen(group.pen)
+            painter.setBrush(group.brush)
+            painter.drawPath(blob.lodPath(level))
+        painter.end()
+
+        if self.overview_item is None:
+            self.overview_item = QGraphicsPixmapItem()
+            self.overview_item.setTransformationMode(Qt.SmoothTransformation)
+            self.overview_item.setZValue(1)
+            self.scene.addItem(self.overview_item)
+        self.overview_item.setPixmap(QPixmap.fromImage(overview))
+        self.overview_item.setScale(1.0 / scale)
+        self.overview_item.setOpacity(self.transparency_value)
+        self.overview_dirty = False
+
+    def removeOverview(self):
+        if self.overview_item is not None:
+            self.scene.removeItem(self.overview_item)
+            self.overview_item = None
+        self.overview = False
+        self.overview_dirty = True
 
     #used for crossair cursor
     def drawForeground(self, painter, rect):
@@ -877,10 +1170,15 @@ class QtImageViewerPlus(QtImageViewer):
             self.centerOn(scene_pos - delta)
 
             self.updateScaleBar(self.zoom_factor)
+            self.updateLevelOfDetail()
 
             self.scene_overlay.invalidate()
             self.invalidateScene()
 
+    def updateViewer(self):
+        QtImageViewer.updateViewer(self)
+        self.updateLevelOfDetail()
+
     def updateScaleBar(self, zoom_factor):
 
         REFERENCE_LENGTH_IN_PIXEL = 100
@@ -933,7 +1231,7 @@ class QtImageViewerPlus(QtImageViewer):
         sy = self.dragSelectionStart[1]
         self.resetSelection()
         if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
+            for blob in self.annotations.blobsInBox([sy, sx, x - sx, y - sy], inside=True):
                 visible = self.annotations.isLabelVisible(blob.class_name)
                 if not visible:
                     continue
@@ -967,9 +1265,8 @@ class QtImageViewerPlus(QtImageViewer):
             g = int(color_components[1])
             b = int(color_components[2])
             self.border_pen.setColor(QColor(r, g, b))
-            if self.annotations is not None:
-                for blob in self.annotations.seg_blobs:
-                    blob.qpath_gitem.setPen(self.border_pen)
+            self.updateGroups()
+            self.invalidateOverview()
 
     @pyqtSlot(str, int)
     def setSelectionPen(self, color, thickness):
@@ -1005,15 +1302,13 @@ class QtImageViewerPlus(QtImageViewer):
 
     def setBlobVisible(self, blob, visibility):
         if blob.qpath_gitem is not None:
-            blob.qpath_gitem.setVisible(visibility)
-        if blob.id_item is not None:
-            blob.id_item.setVisible(visibility)
+            blob.qpath_gitem.hidden = not visibility
+            self.showBlobItems(blob)
 
     def updateVisibility(self):
         if self.annotations is not None:
-            for blob in self.annotations.seg_blobs:
-                visibility = self.annotations.isLabelVisible(blob.class_name)
-                self.setBlobVisible(blob, visibility)
+            self.updateGroups()
+            self.invalidateOverview()
 
 
 
@@ -1032,15 +1327,12 @@ class QtImageViewerPlus(QtImageViewer):
             self.logfile.info(str)
 
         if blob.qpath_gitem is not None:
-            blob.qpath_gitem.setPen(self.border_selected_pen)
-            blob.qpath_gitem.setZValue(3)
-            blob.id_item.setZValue(4)
-            blob.id_item.setOpacity(1.0)
+            self.setBlobGroup(blob, True)
         else:
             print("blob qpath_qitem is None!")
 
-        self.scene.invalidate()
-        self.selectionChanged.emit()
+        self.requestSceneUpdate()
+        self.emitSelectionChanged()
 
 
     def removeFromSelectedList(self, blob):
@@ -1049,24 +1341,15 @@ class QtImageViewerPlus(QtImageViewer):
             self.selected_blobs = [x for x in self.selected_blobs if not x == blob]
 
             if blob.qpath_gitem is not None:
-                if self.border_enabled is True:
-                    blob.qpath_gitem.setPen(self.border_pen)
-                else:
-                    blob.qpath_gitem.setPen(QPen(Qt.NoPen))
-
-                blob.qpath_gitem.setZValue(1)
-                blob.id_item.setZValue(2)
-                blob.id_item.setOpacity(0.7)
+                self.setBlobGroup(blob, False)
 
-
-
-            self.scene.invalidate()
+            self.requestSceneUpdate()
 
 
         except Exception as e:
             print("Exception: e", e)
             pass
-        self.selectionChanged.emit()
+        self.emitSelectionChanged()
 
     def resizeEvent(self, event):
         """ Maintain current zoom on resize.
@@ -1083,18 +1366,11 @@ class QtImageViewerPlus(QtImageViewer):
             if blob.qpath_gitem is None:
                 print("Selected item with no path!")
             else:
-                if self.border_enabled is True:
-                    blob.qpath_gitem.setPen(self.border_pen)
-                else:
-                    blob.qpath_gitem.setPen(QPen(Qt.NoPen))
-
-                blob.qpath_gitem.setZValue(1)
-                blob.id_item.setZValue(2)
-                blob.id_item.setOpacity(0.7)
+                self.setBlobGroup(blob, False)
 
         self.selected_blobs.clear()
-        self.scene.invalidate(self.scene.sceneRect())
-        self.selectionChanged.emit()
+        self.requestSceneUpdate()
+        self.emitSelectionChanged()
         self.selectionReset.emit()
 
 
@@ -1111,11 +1387,16 @@ class QtImageViewerPlus(QtImageViewer):
         if selected:
             self.addToSelectedList(blob)
 
-        if self.fill_enabled is False:
-            blob.qpath_gitem.setBrush(QBrush(Qt.NoBrush))
-
-        if self.border_enabled is False:
-            blob.qpath_gitem.setPen(QPen(Qt.NoPen))
+    def addBlobs(self, blobs):
+        """
+        It adds many blobs at once (the scene is updated at the end).
+        """
+        self.beginUpdate()
+        try:
+            for blob in blobs:
+                self.addBlob(blob, selected=False)
+        finally:
+            self.endUpdate()
 
     def removeBlob(self, blob):
         """
@@ -1141,16 +1422,14 @@ class QtImageViewerPlus(QtImageViewer):
         if selected:
             self.addToSelectedList(new_blob)
 
-        if self.fill_enabled is False:
-            new_blob.qpath_gitem.setBrush(QBrush(Qt.NoBrush))
-
-        if self.border_enabled is False:
-            new_blob.qpath_gitem.setPen(QPen(Qt.NoPen))
-
     def deleteSelectedBlobs(self):
 
-        for blob in self.selected_blobs:
-            self.removeBlob(blob)
+        self.beginUpdate()
+        try:
+            for blob in self.selected_blobs:
+                self.removeBlob(blob)
+        finally:
+            self.endUpdate()
         self.saveUndo()
 
     @pyqtSlot(str)
@@ -1158,14 +1437,16 @@ class QtImageViewerPlus(QtImageViewer):
         """
         Assign the given class to the selected blobs.
         """
+        self.beginUpdate()
         for blob in self.selected_blobs:
 
             self.undo_data.setBlobClass(blob, class_name)
             self.annotations.setBlobClass(blob, class_name)
-            brush =  self.annotations.classBrushFromName(blob)
-            blob.qpath_gitem.setBrush(brush)
+            self.setBlobGroup(blob, True)
 
-        self.scene.invalidate()
+        self.invalidateOverview()
+        self.requestSceneUpdate()
+        self.endUpdate()
 
     def setBlobClass(self, blob, class_name):
 
@@ -1176,9 +1457,9 @@ class QtImageViewerPlus(QtImageViewer):
         self.annotations.setBlobClass(blob, class_name)
 
         if blob.qpath_gitem:
-            brush = self.annotations.classBrushFromName(blob)
-            blob.qpath_gitem.setBrush(brush)
-            self.scene.invalidate()
+            self.setBlobGroup(blob, blob in self.selected_blobs)
+            self.invalidateOverview()
+            self.requestSceneUpdate()
 
 ###### UNDO STUFF #####
 
@@ -1199,6 +1480,14 @@ class QtImageViewerPlus(QtImageViewer):
         if operation is None:
             return
 
+        self.beginUpdate()
+        try:
+            self.applyUndoOperation(operation)
+        finally:
+            self.endUpdate()
+
+    def applyUndoOperation(self, operation):
+
         for blob in operation['remove']:
             message = "[UNDO][REMOVE] BLOBID={:d} VERSION={:d}".format(blob.id, blob.version)
             self.logfile.info(message)
@@ -1211,15 +1500,14 @@ class QtImageViewerPlus(QtImageViewer):
             self.logfile.info(message)
             self.annotations.addBlob(blob)
             self.selected_blobs.append(blob)
-            self.selectionChanged.emit()
+            self.emitSelectionChanged()
             self.drawBlob(blob)
 
         for (blob, class_name) in operation['class']:
             self.annotations.setBlobClass(blob, class_name)
-            brush = self.annotations.classBrushFromName(blob)
             #this might apply to blobs NOT in this image (or rendered)
             if blob.qpath_gitem:
-                blob.qpath_gitem.setBrush(brush)
+                self.setBlobGroup(blob, blob in self.selected_blobs)
 
         self.updateVisibility()
 
@@ -1228,6 +1516,14 @@ class QtImageViewerPlus(QtImageViewer):
         if operation is None:
             return
 
+        self.beginUpdate()
+        try:
+            self.applyRedoOperation(operation)
+        finally:
+            self.endUpdate()
+
+    def applyRedoOperation(self, operation):
+
         for blob in operation['add']:
             message = "[REDO][ADD] BLOBID={:d} VERSION={:d}".format(blob.id, blob.version)
             self.logfile.info(message)
@@ -1240,13 +1536,12 @@ class QtImageViewerPlus(QtImageViewer):
             self.logfile.info(message)
             self.annotations.addBlob(blob)
             self.selected_blobs.append(blob)
-            self.selectionChanged.emit()
+            self.emitSelectionChanged()
             self.drawBlob(blob)
 
         for (blob, class_name) in operation['newclass']:
             self.annotations.setBlobClass(blob, class_name)
-            brush = self.annotations.classBrushFromName(blob)
-            blob.qpath_gitem.setBrush(brush)
+            self.setBlobGroup(blob, blob in self.selected_blobs)
 
         self.updateVisibility()
 
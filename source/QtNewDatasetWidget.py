@@ -111,12 +111,16 @@ class QtNewDatasetWidget(QWidget):
 
         self.checkOversampling = QCheckBox("Oversampling")
         self.checkTiles = QCheckBox("Show exported tiles")
+        self.checkResume = QCheckBox("Resume an interrupted export")
+        self.checkResume.setToolTip("The tiles already written in the dataset folder are kept if they have been\n"
+                                    "exported from the same map, labels and tiles.")
 
         layoutH2 = QHBoxLayout()
         layoutH2.setAlignment(Qt.AlignCenter)
         layoutH2.addStretch()
         #layoutH2.addWidget(self.checkOversampling)
         layoutH2.addWidget(self.checkTiles)
+        layoutH2.addWidget(self.checkResume)
         layoutH2.addStretch()
 
         ###########################################################
@@ -0,0 +1,50 @@
+from PyQt5.QtCore import QRectF
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+
+class QtTiledImageItem(QGraphicsItem):
+    """
+    Graphics item that draws an image stored as a tiled pyramid (see TilePyramid). Only the tiles intersecting
+    the exposed area are drawn, taken from the level of detail matching the current zoom.
+    """
+
+    def __init__(self, parent=None):
+        super(QtTiledImageItem, self).__init__(parent)
+
+        self.pyramid = None
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def setPyramid(self, pyramid):
+
+        self.prepareGeometryChange()
+        self.pyramid = pyramid
+        self.update()
+
+    def boundingRect(self):
+
+        if self.pyramid is None:
+            return QRectF()
+        return QRectF(0, 0, self.pyramid.width(), self.pyramid.height())
+
+    def paint(self, painter, option, widget=None):
+
+        if self.pyramid is None:
+            return
+
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.pyramid.levelForScale(scale)
+
+        exposed = option.exposedRect
+        rect = (exposed.left(), exposed.top(), exposed.width(), exposed.height())
+        (row0, col0, row1, col1) = self.pyramid.tileRange(level, rect)
+
+        # the last tiles of the coarser levels can exceed the image by a few pixels
+        painter.setClipRect(self.boundingRect())
+
+        factor = float(1 << level)
+        size = self.pyramid.tile_size * factor
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                tile = self.pyramid.tile(level, row, col)
+                target = QRectF(col * size, row * size, tile.width() * factor, tile.height() * factor)
+                painter.drawImage(target, tile)
@@ -8,6 +8,7 @@ import osgeo.ogr as ogr
 import rasterio as rio
 from rasterio.plot import reshape_as_raster
 from rasterio.mask import mask
+from rasterio.windows import Window
 import pandas as pd
 from source.Blob import Blob
 
@@ -80,17 +81,6 @@ def createPolygon(blob, transform):
     return newPolygon
 
 
-def createPolygonFromWorkingArea(working_area, transform):
-
-    wa_coord = [(working_area[1], working_area[0]), (working_area[1] + working_area[2], working_area[0]), (working_area[1] + working_area[2] , working_area[0] + working_area[3]),(working_area[1], working_area[0]+ working_area[3])]
-
-    # load blob.contour and transform coordinate
-    wa_coord_change = changeFormat(wa_coord, transform)
-    waPolygon = Polygon(wa_coord_change)
-
-    return waPolygon
-
-
 def read_attributes(filename):
     driver = ogr.GetDriverByName("ESRI Shapefile")
     dataSource = driver.Open(filename, 0)
@@ -183,6 +173,9 @@ def write_shapefile( project, image, blobs, georef_filename, out_shp):
     """
     https://gis.stackexchange.com/a/52708/8104
     """
+    # the genets are computed the first time they are needed
+    project.genet.sync()
+
     scale_factor = image.pixelSize()
     date = image.acquisition_date
     # load georeference information to use
@@ -360,35 +353,27 @@ def saveClippedTiff(input, blobs, georef_filename, name):
     with rio.open(name, "w", **out_meta) as dest:
         dest.write(out_image)
 
-def saveGeorefLabelMap(label_map, georef_filename, working_area, out_name):
-
-    # create a georeferenced label image (as raster)
-    img = rio.open(georef_filename)
-    meta = img.meta
-    transform = img.transform
-
-    myLabel = reshape_as_raster(label_map)
-    myLabel_meta = meta.copy()
-    myLabel_meta.update({"dtype": rio.uint8,
-                         "count": 3,
-                         "nodata": None})
-    with rio.open(out_name + ".tif", "w", **myLabel_meta) as dest:
-        dest.write(myLabel)
-
-    dataset = rio.open(out_name + ".tif")
-    # convert the working area into a polygon
-    working_area_polygon = createPolygonFromWorkingArea(working_area, transform)
-    # crop the raster using the working area polygon
-    out_image, out_transform = rio.mask.mask(dataset, [working_area_polygon], crop=True)
-    out_meta = dataset.meta
-    # area= out_meta['transform'][0] ** 2*out_image
-    out_meta.update({"driver": "GTiff",
-                      "height": out_image.shape[1],
-                      "width": out_image.shape[2],
-                      "transform": out_transform})
-
-    with rio.open(out_name + ".tif", "w", **out_meta) as dest:
-        dest.write(out_image)
+def saveGeorefLabelTiles(tiles, palette, georef_filename, window, out_name):
+    """
+    It creates a georeferenced label image (as raster) of the window (top, left, width, height) of the map,
+    writing it tile by tile. tiles yields the position (top, left) in the window and the class indices of
+    each tile, palette the RGB colors of the indices (see Annotation.labelMapTiles).
+    """
+    with rio.open(georef_filename) as img:
+        meta = img.meta.copy()
+        transform = rio.windows.transform(Window(window[1], window[0], window[2], window[3]), img.transform)
+
+    meta.update({"driver": "GTiff",
+                 "dtype": rio.uint8,
+                 "count": 3,
+                 "nodata": None,
+                 "width": window[2],
+                 "height": window[3],
+                 "transform": transform})
+
+    with rio.open(out_name + ".tif", "w", **meta) as dest:
+        for (top, left, tile) in tiles:
+            dest.write(reshape_as_raster(palette[tile]), window=Window(left, top, tile.shape[1], tile.shape[0]))
 
 def exportSlope(raster, filename):
 
@@ -0,0 +1,154 @@
+import math
+
+import source.Mask as Mask
+
+
+class SpatialIndex(object):
+    """
+    Uniform grid over the map used to find quickly the blobs near a point or inside a rectangle.
+    Each blob is registered in all the cells overlapped by its bounding box (top, left, width, height).
+    The queries return the blobs in insertion order (that is the order of the annotation's blobs).
+    """
+
+    def __init__(self, cell_size=256):
+
+        self.cell_size = cell_size
+        self.cells = {}          # (row, col) -> set of blobs
+        self.blob_cells = {}     # blob -> range of cells (row0, col0, row1, col1) where it has been inserted
+        self.order = {}          # blob -> insertion number
+        self.counter = 0
+
+    def cellRange(self, box):
+        """
+        Range of cells (row0, col0, row1, col1), extremes included, covered by the box (top, left, width, height).
+        """
+        cs = self.cell_size
+        row0 = int(math.floor(box[0] / cs))
+        col0 = int(math.floor(box[1] / cs))
+        row1 = int(math.floor((box[0] + box[3]) / cs))
+        col1 = int(math.floor((box[1] + box[2]) / cs))
+        return (row0, col0, row1, col1)
+
+    def insert(self, blob):
+
+        if blob in self.blob_cells:
+            self.remove(blob)
+
+        cell_range = self.cellRange(blob.bbox)
+        (row0, col0, row1, col1) = cell_range
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                self.cells.setdefault((row, col), set()).add(blob)
+
+        self.blob_cells[blob] = cell_range
+        self.order[blob] = self.counter
+        self.counter += 1
+
+    def remove(self, blob):
+
+        cell_range = self.blob_cells.pop(blob, None)
+        if cell_range is None:
+            return
+        del self.order[blob]
+
+        (row0, col0, row1, col1) = cell_range
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                cell = self.cells.get((row, col))
+                if cell is not None:
+                    cell.discard(blob)
+                    if len(cell) == 0:
+                        del self.cells[(row, col)]
+
+    def update(self, blob):
+        """
+        Re-insert a blob whose bounding box has changed.
+        """
+        self.remove(blob)
+        self.insert(blob)
+
+    def sorted(self, blobs):
+        return sorted(blobs, key=lambda blob: self.order[blob])
+
+    def candidates(self, box):
+        """
+        The blobs registered in the cells covered by the box (top, left, width, height).
+        """
+        (row0, col0, row1, col1) = self.cellRange(box)
+
+        # for very large boxes it is cheaper to consider all the blobs
+        if (row1 - row0 + 1) * (col1 - col0 + 1) > len(self.cells):
+            return set(self.blob_cells.keys())
+
+        blobs = set()
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                cell = self.cells.get((row, col))
+                if cell is not None:
+                    blobs.update(cell)
+        return blobs
+
+    def pointQuery(self, x, y):
+        """
+        It returns the blobs whose bounding box contains the point (x, y).
+        """
+        cs = self.cell_size
+        cell = self.cells.get((int(math.floor(y / cs)), int(math.floor(x / cs))))
+        if cell is None:
+            return []
+
+        blobs = [blob for blob in cell if blob.bbox[1] <= x <= blob.bbox[1] + blob.bbox[2] and
+                                          blob.bbox[0] <= y <= blob.bbox[0] + blob.bbox[3]]
+        return self.sorted(blobs)
+
+    def rectQuery(self, box, inside=False):
+        """
+        It returns the blobs whose bounding box intersects the box (top, left, width, height).
+        If inside is True only the blobs entirely inside the box are returned.
+        """
+        if inside:
+            blobs = [blob for blob in self.candidates(box) if Mask.insideBox(box, blob.bbox)]
+        else:
+            blobs = [blob for blob in self.candidates(box) if Mask.checkIntersection(box, blob.bbox)]
+        return self.sorted(blobs)
+
+    def nearest(self, x, y):
+        """
+        It returns the blob whose bounding box is the nearest to the point (x, y), None if the index is empty.
+        """
+        if len(self.cells) == 0:
+            return None
+
+        cs = self.cell_size
+        row = int(math.floor(y / cs))
+        col = int(math.floor(x / cs))
+
+        rows = [key[0] for key in self.cells.keys()]
+        cols = [key[1] for key in self.cells.keys()]
+        max_ring = max(abs(row - min(rows)), abs(row - max(rows)), abs(col - min(cols)), abs(col - max(cols)))
+
+        best = None
+        best_distance = float("inf")
+        for ring in range(0, max_ring + 1):
+
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) != ring:
+                        continue
+                    cell = self.cells.get((r, c))
+                    if cell is None:
+                        continue
+                    for blob in cell:
+                        box = blob.bbox
+                        dx = max(box[1] - x, 0.0, x - (box[1] + box[2]))
+                        dy = max(box[0] - y, 0.0, y - (box[0] + box[3]))
+                        distance = math.sqrt(dx * dx + dy * dy)
+                        if distance < best_distance or (distance == best_distance and self.order[blob] < self.order[best]):
+                            best_distance = distance
+                            best = blob
+
+            # the blobs in the next rings are at least ring * cell_size far away
+            if best is not None and best_distance <= ring * cs:
+                break
+
+        return best
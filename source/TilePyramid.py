@@ -0,0 +1,301 @@
+"""
+Multi-resolution tiled version of an RGB image, used to visualize very large maps without decoding them.
+The levels of the pyramid (level 0 is the full resolution, each level halves the previous one) are stored
+as RGB32 (0xffRRGGBB) arrays in .npy files in the folder <image filename>.pyramid, next to the image, and they
+are memory-mapped: only the tiles visualized are read from the disk and kept in a LRU cache.
+"""
+
+import os
+import json
+import glob
+import math
+from collections import OrderedDict
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+from PyQt5.QtGui import QImage, QImageReader
+
+
+TILE_SIZE = 256
+PYRAMID_VERSION = 1
+
+# smaller images are visualized as a single pixmap
+TILED_IMAGE_MIN_PIXELS = 16 * 1024 * 1024
+
+# rows of the image processed at once while building the pyramid
+STRIP_HEIGHT = 1024
+
+
+def imageSize(filename):
+    """
+    It returns the size (width, height) of the image reading only its header, None if it cannot be read.
+    """
+    size = QImageReader(filename).size()
+    if not size.isValid():
+        return None
+    return (size.width(), size.height())
+
+def rgbToRGB32(rgb):
+    """
+    It packs a (H x W x 3) uint8 array in a (H x W) uint32 array with the QImage.Format_RGB32 layout.
+    """
+    rgb = rgb.astype(np.uint32)
+    return np.uint32(0xff000000) | (rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2]
+
+def halve(strip):
+    """
+    It downsamples by 2 (average of the 2x2 blocks) a strip of RGB32 pixels. Odd sizes are padded replicating the border.
+    """
+    (h, w) = strip.shape
+    if h % 2 == 1 or w % 2 == 1:
+        strip = np.pad(strip, ((0, h % 2), (0, w % 2)), mode="edge")
+
+    out = np.full((strip.shape[0] // 2, strip.shape[1] // 2), 0xff000000, dtype=np.uint32)
+    for shift in (16, 8, 0):
+        channel = ((strip >> shift) & 0xff).astype(np.uint16)
+        channel = (channel[0::2, 0::2] + channel[0::2, 1::2] + channel[1::2, 0::2] + channel[1::2, 1::2] + 2) // 4
+        out |= channel.astype(np.uint32) << shift
+    return out
+
+def arrayToQImage(array):
+
+    array = np.ascontiguousarray(array)
+    (h, w) = array.shape
+    qimg = QImage(array.data, w, h, 4 * w, QImage.Format_RGB32)
+    return qimg.copy()
+
+
+class TilePyramid(object):
+
+    def __init__(self, filename, tile_size=TILE_SIZE, cache_budget=128 * 1024 * 1024):
+
+        self.filename = filename
+        self.folder = filename + ".pyramid"
+        self.tile_size = tile_size
+
+        self.levels = []          # memory-mapped levels (H x W uint32)
+
+        # LRU cache of the tiles: (level, row, col) -> QImage
+        self.cache = OrderedDict()
+        self.cache_size = 0
+        self.cache_budget = cache_budget
+
+    def width(self):
+        return self.levels[0].shape[1]
+
+    def height(self):
+        return self.levels[0].shape[0]
+
+    def levelFilename(self, level):
+        return os.path.join(self.folder, "level_{:02d}.npy".format(level))
+
+    def sourceSignature(self):
+        stat = os.stat(self.filename)
+        return { "version": PYRAMID_VERSION, "size": stat.st_size, "mtime": stat.st_mtime, "tile_size": self.tile_size }
+
+    def isCached(self):
+        """
+        It returns True if the pyramid stored on the disk has been built from the current image.
+        """
+        try:
+            with open(os.path.join(self.folder, "pyramid.json"), "r") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if info.get("source") != self.sourceSignature():
+            return False
+
+        return all([os.path.exists(self.levelFilename(level)) for level in range(info["levels"])])
+
+    def load(self, logfile=None):
+        """
+        It opens the pyramid, building it the first time. It returns False if the image cannot be read.
+        The building of the pyramid is reported in the (optional) logfile.
+        """
+        if not os.path.exists(self.filename):
+            return False
+
+        # the pyramid is stored next to the image, the folder can be read-only or the disk full
+        try:
+            if not self.isCached():
+                if logfile is not None:
+                    logfile.info("[PYRAMID] Building the tiled pyramid of " + self.filename)
+                if not self.build():
+                    if logfile is not None:
+                        logfile.info("[PYRAMID] The image " + self.filename + " cannot be read.")
+                    return False
+
+            with open(os.path.join(self.folder, "pyramid.json"), "r") as f:
+                info = json.load(f)
+
+            self.levels = [np.load(self.levelFilename(level), mmap_mode="r") for level in range(info["levels"])]
+        except OSError as e:
+            self.removeTemporaryFiles()
+            self.levels = []
+            if logfile is not None:
+                logfile.info("[PYRAMID] The tiled pyramid of " + self.filename + " cannot be stored: " + str(e))
+            return False
+
+        self.clearCache()
+        return True
+
+    def removeTemporaryFiles(self):
+        """
+        It removes the levels left by an interrupted build.
+        """
+        for filename in glob.glob(os.path.join(glob.escape(self.folder), "level_*.npy.tmp")):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def readStrips(self):
+        """
+        It reads the image by strips of rows, it yields the position of the strip and its RGB32 pixels.
+        The 8-bit RGB TIFF and PNG images are read by rasterio without decoding all the image. The JPEG
+        compressed images are decoded by Qt, like in Channel.loadData, since the JPEG decoders can differ slightly.
+        """
+        try:
+            src = rio.open(self.filename)
+        except Exception:
+            src = None
+
+        if src is not None and src.driver in ["GTiff", "PNG"] and src.compression != rio.enums.Compression.jpeg \
+                and src.count == 3 and all([dtype == "uint8" for dtype in src.dtypes]):
+            with src:
+                for top in range(0, src.height, STRIP_HEIGHT):
+                    h = min(STRIP_HEIGHT, src.height - top)
+                    rgb = src.read([1, 2, 3], window=Window(0, top, src.width, h))
+                    yield (top, src.width, src.height, rgbToRGB32(np.moveaxis(rgb, 0, -1)))
+            return
+
+        if src is not None:
+            src.close()
+
+        reader = QImageReader(self.filename)
+        qimg = reader.read()
+        if qimg.isNull():
+            return
+        qimg = qimg.convertToFormat(QImage.Format_RGB32)
+
+        (w, h) = (qimg.width(), qimg.height())
+        bits = qimg.constBits()
+        bits.setsize(qimg.bytesPerLine() * h)
+        pixels = np.frombuffer(bits, dtype=np.uint32).reshape(h, qimg.bytesPerLine() // 4)[:, :w]
+        for top in range(0, h, STRIP_HEIGHT):
+            yield (top, w, h, pixels[top:top + STRIP_HEIGHT])
+
+    def build(self):
+        """
+        It builds the pyramid and stores it on the disk. The levels are written by strips, so only a strip of
+        each level (and, for the images not readable by strips, the decoded image) is kept in memory.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+
+        levels = []
+        pending = []              # for each level above 0, the odd row waiting for its pair
+        for (top, w, h, strip) in self.readStrips():
+
+            if len(levels) == 0:
+                (lw, lh) = (w, h)
+                while True:
+                    levels.append(np.lib.format.open_memmap(self.levelFilename(len(levels)) + ".tmp", mode="w+",
+                                                            dtype=np.uint32, shape=(lh, lw)))
+                    if max(lw, lh) <= self.tile_size:
+                        break
+                    (lw, lh) = ((lw + 1) // 2, (lh + 1) // 2)
+                pending = [None] * len(levels)
+                rows = [0] * len(levels)
+
+            levels[0][top:top + strip.shape[0]] = strip
+            last = top + strip.shape[0] == h
+
+            # propagate the strip to the coarser levels
+            for level in range(1, len(levels)):
+                if pending[level] is not None:
+                    strip = np.concatenate([pending[level], strip])
+                    pending[level] = None
+                if strip.shape[0] % 2 == 1 and not last:
+                    pending[level] = strip[-1:]
+                    strip = strip[:-1]
+                if strip.shape[0] == 0:
+                    break
+                strip = halve(strip)
+                levels[level][rows[level]:rows[level] + strip.shape[0]] = strip
+                rows[level] += strip.shape[0]
+
+        if len(levels) == 0:
+            return False
+
+        for level, array in enumerate(levels):
+            array.flush()
+            del array
+        levels = None
+
+        count = len(pending)
+        for level in range(count):
+            os.replace(self.levelFilename(level) + ".tmp", self.levelFilename(level))
+
+        with open(os.path.join(self.folder, "pyramid.json"), "w") as f:
+            json.dump({ "source": self.sourceSignature(), "levels": count }, f)
+
+        return True
+
+    def levelForScale(self, scale):
+        """
+        It returns the level to use when the image is drawn with the given scale (screen pixels per image pixel).
+        """
+        if scale <= 0.0:
+            return len(self.levels) - 1
+        level = int(math.floor(math.log2(1.0 / scale))) if scale < 1.0 else 0
+        return max(0, min(level, len(self.levels) - 1))
+
+    def tileRange(self, level, rect):
+        """
+        The range of tiles (row0, col0, row1, col1), extremes included, of the given level covering the rect
+        (left, top, width, height) in full resolution coordinates.
+        """
+        size = self.tile_size * (1 << level)
+        (h, w) = self.levels[level].shape
+        rows = (h + self.tile_size - 1) // self.tile_size
+        cols = (w + self.tile_size - 1) // self.tile_size
+
+        col0 = max(0, int(rect[0] // size))
+        row0 = max(0, int(rect[1] // size))
+        col1 = min(cols - 1, int((rect[0] + rect[2]) // size))
+        row1 = min(rows - 1, int((rect[1] + rect[3]) // size))
+        return (row0, col0, row1, col1)
+
+    def tile(self, level, row, col):
+        """
+        It returns the QImage of a tile.
+        """
+        key = (level, row, col)
+        qimg = self.cache.get(key)
+        if qimg is not None:
+            self.cache.move_to_end(key)
+            return qimg
+
+        ts = self.tile_size
+        qimg = arrayToQImage(self.levels[level][row * ts:(row + 1) * ts, col * ts:(col + 1) * ts])
+
+        self.cache[key] = qimg
+        self.cache_size += qimg.sizeInBytes()
+        while self.cache_size > self.cache_budget and len(self.cache) > 1:
+            (key, old) = self.cache.popitem(last=False)
+            self.cache_size -= old.sizeInBytes()
+
+        return qimg
+
+    def clearCache(self):
+        self.cache.clear()
+        self.cache_size = 0
+
+    def toQImage(self):
+        """
+        It returns the full resolution image (no decoding is needed).
+        """
+        return arrayToQImage(self.levels[0])
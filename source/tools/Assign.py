@@ -22,6 +22,9 @@ class Assign(Tool):
 
         self.viewerplus.addToSelectedList(selected_blob)
 
+        # the genets are computed the first time they are needed
+        self.viewerplus.project.genet.sync()
+
         genets = set()
         for blob in self.viewerplus.selected_blobs:
             if blob.genet is not None \